@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_mood_jockey.settings')
 
 application = get_asgi_application()
+
+# Pre-builds pooled clients per WARMUP_ON_START (off by default) once the
+# server takes its first request, not on import.
+from playlist_generator.warmup import start_warmup_on_first_request  # noqa: E402
+
+start_warmup_on_first_request()
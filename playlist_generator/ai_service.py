@@ -1,39 +1,71 @@
+import hashlib
 import os
 import json
-from google import genai
-from pydantic import BaseModel, Field
+import time
+from functools import cache
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
 
+from . import metrics
+from .breaker import get_breaker
+from .http_clients import get_genai_client
+from .mood_cache import get_mood_cache, normalize_text
+from .ratelimit import aacquire, acquire
+from .singleflight import get_singleflight
+
 load_dotenv()
 
-class MoodAnalysisSchema(BaseModel):
-    genres: list[str] = Field(description="1-2 relevant music genres")
-    moods: list[str] = Field(description="1-2 relevant music moods")
-    keywords: list[str] = Field(description="1-2 relevant music keywords")
+# Standard Jamendo-compatible tags the prompt steers Gemini towards.
+ALLOWED_GENRES = ["pop", "rock", "electronic", "hiphop", "jazz", "indie", "classical", "ambient", "chillout", "metal", "acoustic", "rnb"]
+ALLOWED_MOODS = ["happy", "sad", "chill", "energetic", "relax", "dark", "romantic", "uplifting", "calm", "heavy", "focus", "melancholic"]
 
-class GeminiService:
-    @staticmethod
-    def analyze_mood(user_input):
-        """
-        Takes user's natural language input and translates it to music parameters.
-        Returns a dict: {"error": "..."} or {"genres": [...], "moods": [...], "keywords": [...]}
-        """
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            return {"error": "GEMINI_API_KEY not found in environment variables."}
+# Use the latest flash model for speed and capability
+MODEL_ID = "gemini-3-flash-preview"
+
+# Inputs per structured Gemini call in analyze_moods_batch.
+BATCH_CHUNK_SIZE = int(os.getenv("GEMINI_BATCH_CHUNK_SIZE", "20"))
+
+@cache
+def get_schema():
+    """
+    The structured response schema (Pydantic), so responses are valid JSON
+    without brittle string parsing. Built on first use: pydantic is only
+    imported once Gemini is called. Also importable as
+    ai_service.MoodAnalysisSchema.
+    """
+    from pydantic import BaseModel, Field
+
+    class MoodAnalysisSchema(BaseModel):
+        genres: list[str] = Field(description="1-2 relevant music genres")
+        moods: list[str] = Field(description="1-2 relevant music moods")
+        keywords: list[str] = Field(description="1-2 relevant music keywords")
+
+    MoodAnalysisSchema.__module__ = __name__
+    MoodAnalysisSchema.__qualname__ = "MoodAnalysisSchema"
+    return MoodAnalysisSchema
+
+
+def __getattr__(name):
+    # Keeps MoodAnalysisSchema a module-level name without importing pydantic up front.
+    if name == "MoodAnalysisSchema":
+        return get_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-        # Use the modern GenAI Client
-        client = genai.Client(api_key=api_key)
-        
-        # Use the latest flash model for speed and capability
-        model_id = "gemini-3-flash-preview"
 
-        prompt = f"""
+@cache
+def generate_configs():
+    """(single, batch) generate configs using MoodAnalysisSchema."""
+    schema = get_schema()
+    single = {"response_mime_type": "application/json", "response_schema": schema}
+    batch = {"response_mime_type": "application/json", "response_schema": list[schema]}
+    return single, batch
+
+PROMPT_GUIDE = f"""
         Act as a professional music curator and semantic translator. Your task is to analyze the user's natural language text (which may describe feelings, weather, activities, or vague scenarios) and translate it into precise musical parameters: genres, moods, and keywords.
         
         CRITICAL: To ensure valid database lookups, prioritize these standard Jamendo-compatible tags where possible:
-        - Allowed Genres: pop, rock, electronic, hiphop, jazz, indie, classical, ambient, chillout, metal, acoustic, rnb
-        - Allowed Moods: happy, sad, chill, energetic, relax, dark, romantic, uplifting, calm, heavy, focus, melancholic
+        - Allowed Genres: {", ".join(ALLOWED_GENRES)}
+        - Allowed Moods: {", ".join(ALLOWED_MOODS)}
         
         Guidelines:
         - Extract 1-2 relevant standard music genres.
@@ -49,29 +81,218 @@ class GeminiService:
         
         User Text: "Sitting by the window watching the rain"
         Output: {{"genres": ["jazz", "acoustic"], "moods": ["melancholic", "chill"], "keywords": ["rain", "cozy"]}}
+"""
 
+class GeminiService:
+    @staticmethod
+    def _build_prompt(user_input):
+        return PROMPT_GUIDE + f"""
         User Text: "{user_input}"
         """
 
+    @staticmethod
+    def _build_batch_prompt(user_inputs):
+        numbered = "\n".join(f'        {i}. "{text}"' for i, text in enumerate(user_inputs, 1))
+        return PROMPT_GUIDE + f"""
+        Analyze each of the following {len(user_inputs)} user texts independently.
+        Return a JSON list with exactly {len(user_inputs)} objects, one per text, in the same order.
+
+{numbered}
+        """
+
+    @staticmethod
+    def _flight_key(user_input):
+        """Single-flight key: the mood cache's normalized text, hashed to stay cache-key safe."""
+        key = normalize_text(user_input) or user_input.strip().lower()
+        return f"gemini:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def _parse_response(response):
+        # The SDK automatically parses the JSON into our Pydantic model
+        if response.parsed:
+            return response.parsed.model_dump()
+        # Fallback if parsing fails but text exists (extremely unlikely with structured output)
+        return json.loads(response.text)
+
+    @staticmethod
+    def analyze_mood(user_input):
+        """
+        Takes user's natural language input and translates it to music parameters.
+        Returns a dict: {"error": "..."} or {"genres": [...], "moods": [...], "keywords": [...]}
+        Raises ratelimit.RateLimited when the Gemini budget is exhausted.
+        """
+        with metrics.span("gemini"):
+            return GeminiService._analyze_mood(user_input)
+
+    @staticmethod
+    def _analyze_mood(user_input):
+        cache = get_mood_cache()
+        if cache is not None:
+            cached = cache.get(user_input)
+            if cached is not None:
+                metrics.tag(cache="hit")
+                return cached
+        metrics.tag(cache="miss")
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            return {"error": "GEMINI_API_KEY not found in environment variables."}
+
+        # Shared, pooled GenAI Client (reused across requests)
+        client = get_genai_client(api_key)
+
+        def call():
+            # Fail fast while Gemini is known to be down.
+            breaker = get_breaker("gemini")
+            if not breaker.allow():
+                return None
+            # Raises RateLimited when the Gemini budget is exhausted.
+            acquire("gemini")
+            start = time.perf_counter()
+            try:
+                response = client.models.generate_content(
+                    model=MODEL_ID,
+                    contents=GeminiService._build_prompt(user_input),
+                    config=generate_configs()[0],
+                )
+                result = GeminiService._parse_response(response)
+            except Exception as e:
+                breaker.failure()
+                print(f"Gemini Service Error: {e}")
+                return None
+            breaker.success(time.perf_counter() - start)
+
+            if cache is not None:
+                cache.set(user_input, result)
+            return result
+
+        # Identical analyses already in flight share one Gemini call.
+        flight = get_singleflight()
+        if flight is not None:
+            result = flight.do("gemini", GeminiService._flight_key(user_input), call)
+        else:
+            result = call()
+        if result is None:
+            return {"error": "Failed to analyze mood using AI."}
+        return result
+
+    @staticmethod
+    async def analyze_mood_async(user_input):
+        """Async variant of analyze_mood using the SDK's aio client. Same return shape."""
+        with metrics.span("gemini"):
+            return await GeminiService._analyze_mood_async(user_input)
+
+    @staticmethod
+    async def _analyze_mood_async(user_input):
+        cache = get_mood_cache()
+        if cache is not None:
+            cached = await sync_to_async(cache.get)(user_input)
+            if cached is not None:
+                metrics.tag(cache="hit")
+                return cached
+        metrics.tag(cache="miss")
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            return {"error": "GEMINI_API_KEY not found in environment variables."}
+
+        client = get_genai_client(api_key)
+
+        async def call():
+            breaker = get_breaker("gemini")
+            if not breaker.allow():
+                return None
+            await aacquire("gemini")
+            start = time.perf_counter()
+            try:
+                response = await client.aio.models.generate_content(
+                    model=MODEL_ID,
+                    contents=GeminiService._build_prompt(user_input),
+                    config=generate_configs()[0],
+                )
+                result = GeminiService._parse_response(response)
+            except Exception as e:
+                breaker.failure()
+                print(f"Gemini Service Error: {e}")
+                return None
+            breaker.success(time.perf_counter() - start)
+
+            if cache is not None:
+                await sync_to_async(cache.set)(user_input, result)
+            return result
+
+        flight = get_singleflight()
+        if flight is not None:
+            result = await flight.ado("gemini", GeminiService._flight_key(user_input), call)
+        else:
+            result = await call()
+        if result is None:
+            return {"error": "Failed to analyze mood using AI."}
+        return result
+
+    @staticmethod
+    def analyze_moods_batch(user_inputs, chunk_size=None):
+        """
+        Analyzes many inputs with one structured Gemini call per chunk of
+        `chunk_size` (defaults to GEMINI_BATCH_CHUNK_SIZE) cache misses.
+        Returns a list aligned with user_inputs, each item shaped like
+        analyze_mood's return value.
+        """
+        chunk_size = max(1, chunk_size or BATCH_CHUNK_SIZE)
+        results = [None] * len(user_inputs)
+        cache = get_mood_cache()
+
+        pending = {}
+        for i, user_input in enumerate(user_inputs):
+            cached = cache.get(user_input) if cache is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                # Identical inputs in one batch share a single slot in the prompt.
+                pending.setdefault(user_input, []).append(i)
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if pending and not api_key:
+            error = {"error": "GEMINI_API_KEY not found in environment variables."}
+            return [r if r is not None else dict(error) for r in results]
+
+        texts = list(pending)
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            with metrics.span("gemini_batch"):
+                analyses = GeminiService._analyze_chunk(api_key, chunk)
+            for text, analysis in zip(chunk, analyses):
+                if cache is not None and "error" not in analysis:
+                    cache.set(text, analysis)
+                for i in pending[text]:
+                    results[i] = dict(analysis)
+        return results
+
+    @staticmethod
+    def _analyze_chunk(api_key, chunk):
+        """One structured call for a chunk; falls back to per-input calls only if the list comes back misaligned."""
+        client = get_genai_client(api_key)
+        breaker = get_breaker("gemini")
+        if not breaker.allow():
+            return [{"error": "Failed to analyze mood using AI."} for _ in chunk]
+        acquire("gemini")
+        start = time.perf_counter()
         try:
-            # Generate content with structured response schema (Pydantic)
-            # This ensures valid JSON matching our schema without brittle string parsing
             response = client.models.generate_content(
-                model=model_id,
-                contents=prompt,
-                config={
-                    "response_mime_type": "application/json",
-                    "response_schema": MoodAnalysisSchema,
-                }
+                model=MODEL_ID,
+                contents=GeminiService._build_batch_prompt(chunk),
+                config=generate_configs()[1],
             )
-            
-            # The SDK automatically parses the JSON into our Pydantic model
             if response.parsed:
-                return response.parsed.model_dump()
-            
-            # Fallback if parsing fails but text exists (extremely unlikely with structured output)
-            return json.loads(response.text)
-            
+                analyses = [item.model_dump() for item in response.parsed]
+            else:
+                analyses = json.loads(response.text)
         except Exception as e:
+            breaker.failure()
             print(f"Gemini Service Error: {e}")
-            return {"error": "Failed to analyze mood using AI."}
+            return [{"error": "Failed to analyze mood using AI."} for _ in chunk]
+        breaker.success(time.perf_counter() - start)
+        if isinstance(analyses, list) and len(analyses) == len(chunk) and all(isinstance(a, dict) for a in analyses):
+            return analyses
+        print(f"Gemini Service Error: batch response did not match the {len(chunk)} inputs")
+        return [GeminiService.analyze_mood(text) for text in chunk]
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PlaylistGeneratorConfig(AppConfig):
     name = 'playlist_generator'
+
+    def ready(self):
+        # Keeps the similarity index in step with MoodQuery rows.
+        from . import signals  # noqa: F401
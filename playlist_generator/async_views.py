@@ -0,0 +1,173 @@
+"""
+Async versions of the playlist endpoints for ASGI deployments.
+
+Enabled with ASYNC_VIEWS=True (see urls.py). Under an ASGI server
+(e.g. `gunicorn ai_mood_jockey.asgi -k uvicorn.workers.UvicornWorker`)
+each in-flight generation only holds a coroutine while it waits on
+Gemini and Jamendo, instead of a whole worker thread.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import metrics
+from .history import TRACK_FIELDS
+from .models import MoodQuery, Track
+from .mood_analyzer import resolve_mood_async
+from .persistence import count_queries, save_mood_query
+from .query_index import SOURCE_SIMILAR, find_similar
+from .ratelimit import RateLimited, rate_limit, rate_limited_response
+from .responses import FastJsonResponse, query_etag, query_payload
+from .services import JamendoService
+from .views import no_tracks_response
+
+logger = logging.getLogger(__name__)
+
+
+def _save_counted(*args):
+    """save_mood_query plus the number of queries it ran (counted on the sync thread that owns the connection)."""
+    with count_queries() as queries:
+        mood_query, saved_tracks = save_mood_query(*args)
+    return mood_query, saved_tracks, queries['count']
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+@rate_limit("public")
+async def public_generate_playlist(request):
+    """Async version of views.public_generate_playlist."""
+    try:
+        if request.method == "POST":
+            data = json.loads(request.body)
+            user_input = data.get('user_input', '')
+        else:
+            user_input = request.GET.get('user_input', 'Relaxing lo-fi beats for studying')
+
+        if not user_input:
+            return JsonResponse({'error': 'User input is required'}, status=400)
+
+        # 0. Reuse one of the user's near-identical past queries (no Gemini or Jamendo calls)
+        similar = await sync_to_async(find_similar)(user_input, 10, await request.auser())
+        if similar:
+            (ai_response, jamendo_tracks), source = similar, SOURCE_SIMILAR
+        else:
+            # 1. Analyze mood (local analyzer, Gemini when it isn't confident)
+            ai_response, source = await resolve_mood_async(user_input)
+            if 'error' in ai_response:
+                return JsonResponse(ai_response, status=500)
+
+            # 2. Fetch tracks from Jamendo
+            jamendo_tracks = await JamendoService.get_tracks_async(
+                ai_response.get('genres', []),
+                ai_response.get('moods', []),
+                ai_response.get('keywords', []),
+                limit=10,
+            )
+
+        if not jamendo_tracks:
+            return no_tracks_response()
+
+        return FastJsonResponse({
+            'message': 'Public test successful',
+            'user_input': user_input,
+            'keywords': ai_response,
+            'analysis_source': source,
+            'tracks': jamendo_tracks
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except Exception:
+        logger.exception("An error occurred during public playlist generation")
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+
+@login_required
+@require_http_methods(["POST"])
+@rate_limit("generate")
+async def generate_playlist(request):
+    """Async version of views.generate_playlist."""
+    try:
+        data = json.loads(request.body)
+        user_input = data.get('user_input', '')
+
+        if not user_input:
+            return JsonResponse({'error': 'User input is required'}, status=400)
+
+        # 0. Reuse one of the user's near-identical past queries (no Gemini or Jamendo calls)
+        user = await request.auser()
+        similar = await sync_to_async(find_similar)(user_input, 24, user)
+        if similar:
+            (ai_response, jamendo_tracks), source = similar, SOURCE_SIMILAR
+        else:
+            # 1. Analyze mood (local analyzer, Gemini when it isn't confident)
+            ai_response, source = await resolve_mood_async(user_input)
+            if 'error' in ai_response:
+                return JsonResponse(ai_response, status=500)
+
+            # 2. Fetch tracks from Jamendo using tiered search strategy
+            jamendo_tracks = await JamendoService.get_tracks_async(
+                ai_response.get('genres', []),
+                ai_response.get('moods', []),
+                ai_response.get('keywords', []),
+                limit=24,
+            )
+
+        if not jamendo_tracks:
+            return no_tracks_response()
+
+        # 3. Save to database (the bulk save runs in one transaction on a sync thread)
+        with metrics.span("persist"):
+            mood_query, saved_tracks, query_count = await sync_to_async(_save_counted)(
+                user, user_input, ai_response, jamendo_tracks, source
+            )
+
+        response = FastJsonResponse({
+            'query_id': mood_query.id,
+            'user_input': mood_query.user_input,
+            'keywords': mood_query.generated_keywords,
+            'analysis_source': mood_query.analysis_source,
+            'tracks': saved_tracks
+        })
+        response['X-DB-Query-Count'] = query_count
+        return response
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except Exception:
+        logger.exception("An error occurred during playlist generation")
+        return JsonResponse({'error': 'An unexpected error occurred while generating your playlist.'}, status=500)
+
+
+@login_required
+@require_http_methods(["GET"])
+async def get_query(request, query_id):
+    """Async version of views.get_query using the async ORM."""
+    user = await request.auser()
+    query = await MoodQuery.objects.filter(id=query_id, user=user).values(
+        'id', 'user_input', 'generated_keywords', 'created_at'
+    ).afirst()
+    if query is None:
+        raise Http404("No MoodQuery matches the given query.")
+
+    etag = query_etag(query['id'], query['created_at'])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        tracks = [
+            track
+            async for track in Track.objects.filter(mood_queries__id=query_id).values(*TRACK_FIELDS)
+        ]
+        response = FastJsonResponse(query_payload(query, tracks))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
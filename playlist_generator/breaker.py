@@ -0,0 +1,111 @@
+"""
+Per-upstream circuit breakers.
+
+After BREAKER_FAILURES consecutive failures (errors, or calls slower than
+the upstream's slow-call threshold) a breaker opens and calls fail fast for
+BREAKER_OPEN_SECONDS. It then goes half-open and lets one probe through:
+success closes it, failure re-opens it. State is per worker process.
+"""
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+SLOW_SECONDS = {
+    "jamendo": float(os.getenv("BREAKER_JAMENDO_SLOW_SECONDS", "4")),
+    "gemini": float(os.getenv("BREAKER_GEMINI_SLOW_SECONDS", "15")),
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+TRANSITION_METRIC = "mood_jockey_breaker_transitions_total"
+REJECTED_METRIC = "mood_jockey_breaker_rejected_total"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failures=FAILURES, open_seconds=OPEN_SECONDS, slow_seconds=None):
+        self.name = name
+        self.failure_threshold = failures
+        self.open_seconds = open_seconds
+        self.slow_seconds = slow_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        metrics.registry.inc(TRANSITION_METRIC, upstream=self.name, state=state)
+
+    def allow(self):
+        """True if a call may go upstream now. In half-open state only one probe at a time passes."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+                self.probe_started_at = None
+            if self.state == HALF_OPEN:
+                # A probe that never reported back (e.g. it was rate limited) is given up on.
+                if self.probe_started_at is None or now - self.probe_started_at >= self.open_seconds:
+                    self.probe_started_at = now
+                    return True
+            elif self.state == CLOSED:
+                return True
+        metrics.registry.inc(REJECTED_METRIC, upstream=self.name)
+        return False
+
+    def success(self, elapsed=0.0):
+        if self.slow_seconds is not None and elapsed > self.slow_seconds:
+            self.failure()
+            return
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+                self.probe_started_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+
+    @property
+    def is_open(self):
+        return self.state != CLOSED
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at)) if self.state == OPEN else 0.0
+            return {"state": self.state, "failures": self.failures, "retry_in": round(retry_in, 1)}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, slow_seconds=SLOW_SECONDS.get(name))
+    return breaker
+
+
+def snapshot():
+    """State of every breaker used so far, for /api/diagnostics/."""
+    return {name: breaker.snapshot() for name, breaker in sorted(_breakers.items())}
@@ -0,0 +1,134 @@
+import os
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import Tag, Track, TrackTag
+
+load_dotenv()
+
+# "live" searches Jamendo only; "local" answers from the ingested catalog first.
+MODE = os.getenv("JAMENDO_CATALOG_MODE", "live").lower()
+# Fraction of the requested limit the catalog must fill before live search is skipped.
+MIN_FILL = float(os.getenv("JAMENDO_CATALOG_MIN_FILL", "1.0"))
+
+TAG_KINDS = ("genres", "instruments", "vartags")
+
+
+class CatalogService:
+    @staticmethod
+    def enabled():
+        return MODE == "local"
+
+    @staticmethod
+    def search(params):
+        """
+        Answers one search pass from the local tag index, mirroring Jamendo's
+        semantics: "tags" must all match, "fuzzytags" match any (more matches
+        rank higher). Results are ordered by listens and shaped like
+        JamendoService._parse_item output.
+        """
+        limit = int(params.get("limit", 10))
+        qs = Track.objects.filter(catalog_synced_at__isnull=False)
+
+        if params.get("tags"):
+            for name in params["tags"].split("+"):
+                qs = qs.filter(track_tags__tag__name=name)
+            qs = qs.order_by("-listens", "id")
+        elif params.get("fuzzytags"):
+            names = params["fuzzytags"].split("+")
+            qs = (
+                qs.filter(track_tags__tag__name__in=names)
+                .annotate(matches=Count("track_tags"))
+                .order_by("-matches", "-listens", "id")
+            )
+        else:
+            qs = qs.order_by("-listens", "id")
+
+        rows = list(qs.values("id", "jamendo_id", "title", "artist", "preview_url", "album_image")[:limit])
+        tags_by_track = {row["id"]: {kind: [] for kind in TAG_KINDS} for row in rows}
+        for track_id, kind, name in TrackTag.objects.filter(
+            track_id__in=tags_by_track
+        ).values_list("track_id", "kind", "tag__name"):
+            tags_by_track[track_id][kind].append(name)
+
+        return [
+            {
+                "id": row["jamendo_id"],
+                "title": row["title"],
+                "artist": row["artist"],
+                "preview_url": row["preview_url"],
+                "album_image": row["album_image"],
+                "tags": tags_by_track[row["id"]],
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def last_synced_at():
+        return Track.objects.filter(catalog_synced_at__isnull=False).order_by("-catalog_synced_at").values_list(
+            "catalog_synced_at", flat=True
+        ).first()
+
+    @staticmethod
+    def oldest_synced_at():
+        return Track.objects.filter(catalog_synced_at__isnull=False).order_by("catalog_synced_at").values_list(
+            "catalog_synced_at", flat=True
+        ).first()
+
+    @staticmethod
+    @transaction.atomic
+    def ingest(items):
+        """
+        Upserts parsed Jamendo tracks (with "tags" and optional "listens")
+        and rebuilds their tag index rows. Returns (created, updated).
+        """
+        items = {str(item["id"]): item for item in items if item.get("id")}
+        if not items:
+            return 0, 0
+        now = timezone.now()
+
+        existing = Track.objects.in_bulk(list(items), field_name="jamendo_id")
+        new_tracks = []
+        for jamendo_id, item in items.items():
+            track = existing.get(jamendo_id)
+            if track is None:
+                track = Track(jamendo_id=jamendo_id)
+                new_tracks.append(track)
+            track.title = (item.get("title") or "")[:255]
+            track.artist = (item.get("artist") or "")[:255]
+            track.preview_url = item.get("preview_url") or ""
+            track.album_image = item.get("album_image") or ""
+            track.listens = item.get("listens") or 0
+            track.catalog_synced_at = now
+        Track.objects.bulk_create(new_tracks, ignore_conflicts=True)
+        if existing:
+            Track.objects.bulk_update(
+                existing.values(),
+                ["title", "artist", "preview_url", "album_image", "listens", "catalog_synced_at"],
+            )
+        track_ids = dict(
+            Track.objects.filter(jamendo_id__in=list(items)).values_list("jamendo_id", "id")
+        )
+
+        names = {
+            name
+            for item in items.values()
+            for kind in TAG_KINDS
+            for name in (item.get("tags") or {}).get(kind, [])
+        }
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Tag.objects.filter(name__in=names).values_list("name", "id"))
+
+        TrackTag.objects.filter(track_id__in=track_ids.values()).delete()
+        links = {}
+        for jamendo_id, item in items.items():
+            for kind in TAG_KINDS:
+                for name in (item.get("tags") or {}).get(kind, []):
+                    key = (tag_ids[name], track_ids[jamendo_id])
+                    links.setdefault(key, TrackTag(tag_id=key[0], track_id=key[1], kind=kind))
+        TrackTag.objects.bulk_create(links.values(), ignore_conflicts=True)
+
+        return len(new_tracks), len(existing)
@@ -0,0 +1,103 @@
+"""
+Degraded-mode playlists, served when Jamendo is failing or its circuit
+breaker is open. Everything here reads data we already store: warm sets of
+any age, the local catalog's tag index, and the tracks saved with past
+MoodQuery rows whose analysis overlaps the request.
+"""
+import os
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Q
+from dotenv import load_dotenv
+
+from .catalog import CatalogService
+from .models import MoodQuery, WarmPlaylist
+from .persistence import load_query_tracks
+from .warm_playlists import WarmPlaylistService
+
+load_dotenv()
+
+# Recent analysed queries scanned for overlapping tags.
+QUERY_SAMPLE = int(os.getenv("DEGRADED_QUERY_SAMPLE", "2000"))
+# Past queries whose tracks are pooled into one degraded playlist.
+MAX_QUERIES = int(os.getenv("DEGRADED_MAX_QUERIES", "20"))
+
+# A shared genre/mood says more about the vibe than a shared keyword.
+FIELD_WEIGHTS = {"genres": 2, "moods": 3, "keywords": 1}
+
+
+def _overlap(analysis, wanted):
+    if not isinstance(analysis, dict):
+        return 0
+    score = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        values = {str(v).lower() for v in analysis.get(field) or []}
+        score += weight * len(values & wanted[field])
+    return score
+
+
+class DegradedService:
+    @staticmethod
+    def tracks(passes, genres, moods, keywords, limit):
+        """Best-effort track dicts (shaped like JamendoService._parse_item) without calling Jamendo."""
+        tracks = []
+        seen_ids = set()
+
+        def add(new_tracks):
+            for t in new_tracks:
+                if len(tracks) >= limit:
+                    return
+                if t["id"] not in seen_ids:
+                    seen_ids.add(t["id"])
+                    tracks.append(t)
+
+        # An expired warm set is still a good playlist for the same signature.
+        signature = WarmPlaylistService.signature(genres, moods, keywords)
+        if signature is not None:
+            warm = WarmPlaylist.objects.filter(signature=signature).values_list("tracks", flat=True).first()
+            add(warm or [])
+
+        for _, params in passes:
+            if len(tracks) >= limit:
+                break
+            add(CatalogService.search({**params, "limit": limit}))
+
+        if len(tracks) < limit:
+            add(DegradedService.from_history(genres, moods, keywords, limit))
+        return tracks
+
+    @staticmethod
+    def from_history(genres, moods, keywords, limit):
+        """Tracks saved with the past queries whose analyses share the most tags with this one."""
+        wanted = {
+            "genres": {g.lower() for g in genres or []},
+            "moods": {m.lower() for m in moods or []},
+            "keywords": {k.lower() for k in keywords or []},
+        }
+        queries = MoodQuery.objects.filter(generated_keywords__isnull=False)
+        if connection.vendor == "postgresql":
+            # Served by the GIN index on generated_keywords (migration 0009).
+            lookups = [
+                Q(generated_keywords__contains={field: [value]})
+                for field, values in wanted.items()
+                for value in values
+            ]
+            if not lookups:
+                return []
+            queries = queries.filter(reduce(or_, lookups))
+
+        scored = []
+        for query_id, analysis in (
+            queries.order_by("-id")
+            .values_list("id", "generated_keywords")[:QUERY_SAMPLE]
+            .iterator()
+        ):
+            score = _overlap(analysis, wanted)
+            if score:
+                scored.append((score, query_id))
+        if not scored:
+            return []
+        scored.sort(key=lambda x: (-x[0], -x[1]))
+        return load_query_tracks([query_id for _, query_id in scored[:MAX_QUERIES]], limit)
@@ -0,0 +1,151 @@
+"""
+Local stand-ins for the Jamendo and Gemini APIs, used by the benchmark command.
+
+Both run on ThreadingHTTPServer in a background thread and can be tuned for
+latency, error rate and result size, so the full pipeline can be measured
+offline and reproducibly.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .ai_service import ALLOWED_GENRES, ALLOWED_MOODS
+
+
+class UpstreamConfig:
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, results=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # Jamendo: cap on tracks returned per page (None = honour "limit").
+        self.results = results
+
+    def wait(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self):
+        with self.stats["lock"]:
+            self.stats["requests"] += 1
+
+
+class FakeJamendoHandler(_Handler):
+    """Answers GET /v3.0/tracks/ with deterministic tracks per tag query."""
+
+    def do_GET(self):
+        self._count()
+        self.config.wait()
+        if self.config.should_fail():
+            self._send_json(503, {"error": "fake upstream failure"})
+            return
+
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        tags = query.get("tags") or query.get("fuzzytags") or "all"
+        limit = int(query.get("limit", 10))
+        offset = int(query.get("offset", 0))
+        if self.config.results is not None:
+            limit = min(limit, self.config.results)
+
+        tag_list = tags.split("+")
+        results = []
+        for i in range(offset, offset + limit):
+            # Ids overlap between related queries so dedup is exercised.
+            seed = f"{tag_list[i % len(tag_list)]}-{i // 2}"
+            track_id = str(int(hashlib.md5(seed.encode()).hexdigest()[:8], 16))
+            results.append({
+                "id": track_id,
+                "name": f"Fake track {track_id}",
+                "artist_name": f"Artist {int(track_id) % 50}",
+                "audio": f"https://example.com/audio/{track_id}.mp3",
+                "image": f"https://example.com/image/{track_id}.jpg",
+                "musicinfo": {"tags": {"genres": tag_list, "instruments": [], "vartags": tag_list}},
+                "stats": {"rate_listened_total": int(track_id) % 10000},
+            })
+        self._send_json(200, {"headers": {"status": "success", "results_count": len(results)}, "results": results})
+
+
+class FakeGeminiHandler(_Handler):
+    """Answers POST .../models/<model>:generateContent with a schema-shaped mood analysis."""
+
+    def do_POST(self):
+        self._count()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8", "replace")
+        self.config.wait()
+        if self.config.should_fail():
+            self._send_json(503, {"error": {"code": 503, "message": "fake upstream failure", "status": "UNAVAILABLE"}})
+            return
+
+        # Batch prompts ask for "a JSON list with exactly N objects".
+        batch = re.search(r"JSON list with exactly (\d+) objects", body)
+        if batch:
+            payload = [self._analysis(f"{body}#{i}") for i in range(int(batch.group(1)))]
+        else:
+            payload = self._analysis(body)
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": json.dumps(payload)}]},
+                "finishReason": "STOP",
+            }],
+            "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2},
+        })
+
+    @staticmethod
+    def _analysis(seed):
+        digest = int(hashlib.md5(seed.encode()).hexdigest()[:8], 16)
+        return {
+            "genres": [ALLOWED_GENRES[digest % len(ALLOWED_GENRES)]],
+            "moods": [ALLOWED_MOODS[(digest // 7) % len(ALLOWED_MOODS)]],
+            "keywords": ["study" if digest % 2 else "night"],
+        }
+
+
+class FakeUpstream:
+    """Runs a fake handler on 127.0.0.1:<ephemeral port> until stopped."""
+
+    def __init__(self, handler, config):
+        self.stats = {"requests": 0, "lock": threading.Lock()}
+        handler_cls = type(handler.__name__, (handler,), {"config": config, "stats": self.stats})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return self.stats["requests"]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
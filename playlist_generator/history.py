@@ -0,0 +1,72 @@
+import base64
+import os
+from datetime import datetime
+
+from django.db.models import Prefetch, Q
+from dotenv import load_dotenv
+
+from .models import MoodQuery, Track
+
+load_dotenv()
+
+PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = 100
+
+# Only the columns the vault template and history API actually read.
+QUERY_FIELDS = ("id", "user_input", "generated_keywords", "created_at")
+TRACK_FIELDS = ("id", "title", "artist", "preview_url", "album_image")
+
+
+def encode_cursor(query):
+    raw = f"{query.created_at.isoformat()}|{query.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, id) or raises ValueError for a malformed cursor."""
+    try:
+        created_at, query_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(query_id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def get_history_page(user, cursor=None, limit=PAGE_SIZE):
+    """
+    Keyset pagination over a user's MoodQuery history, newest first, on
+    (created_at, id). Served by the (user, created_at, id) index, so page
+    cost does not grow with history size. Returns (queries, next_cursor).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    qs = (
+        MoodQuery.objects.filter(user=user)
+        .only(*QUERY_FIELDS)
+        .order_by("-created_at", "-id")
+    )
+    if cursor:
+        created_at, query_id = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=query_id))
+
+    queries = list(
+        qs.prefetch_related(
+            Prefetch("tracks", queryset=Track.objects.only(*TRACK_FIELDS))
+        )[:limit + 1]
+    )
+    next_cursor = None
+    if len(queries) > limit:
+        queries = queries[:limit]
+        next_cursor = encode_cursor(queries[-1])
+    return queries, next_cursor
+
+
+def serialize_query(query):
+    return {
+        "query_id": query.id,
+        "user_input": query.user_input,
+        "keywords": query.generated_keywords,
+        "created_at": query.created_at.isoformat(),
+        "tracks": [
+            {field: getattr(track, field) for field in TRACK_FIELDS}
+            for track in query.tracks.all()
+        ],
+    }
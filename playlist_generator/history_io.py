@@ -0,0 +1,291 @@
+"""
+Bulk export and import of MoodQuery history with tracks.
+
+Exports walk the history in keyset chunks of EXPORT_CHUNK_SIZE queries on
+id (two queries per chunk: the MoodQuery rows, then their tracks) and yield
+one record at a time, so memory stays flat however long the history is.
+Two formats:
+
+- NDJSON: one query per line, tracks nested. Lossless; import reads it back.
+- CSV: one row per query and track (a query without tracks gets one row),
+  with genres/moods/keywords joined by "|". Suited to spreadsheets and
+  analytics jobs; importing it keeps only genres, moods and keywords.
+
+Imports parse records lazily and insert them IMPORT_BATCH_SIZE queries at a
+time (bulk inserts in one transaction per batch). A query that already
+exists for the user with the same input and creation time is skipped, so
+re-running an import is safe. Imported rows bypass model signals: run
+`manage.py build_query_index` afterwards when the similarity index is on.
+Uploads to POST /api/history/import/ are capped at IMPORT_MAX_BYTES and
+IMPORT_MAX_RECORDS; the import_history command has no cap.
+"""
+import csv
+import json
+import os
+from datetime import datetime
+from itertools import groupby
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import MoodQuery
+from .persistence import upsert_tracks
+from .responses import dumps
+
+load_dotenv()
+
+# Queries read per export chunk.
+EXPORT_CHUNK_SIZE = int(os.getenv("HISTORY_EXPORT_CHUNK_SIZE", "1000"))
+# Queries inserted per import transaction.
+IMPORT_BATCH_SIZE = int(os.getenv("HISTORY_IMPORT_BATCH_SIZE", "500"))
+# Largest upload POST /api/history/import/ accepts, in bytes and in records.
+IMPORT_MAX_BYTES = int(os.getenv("HISTORY_IMPORT_MAX_BYTES", str(10 * 1024 * 1024)))
+IMPORT_MAX_RECORDS = int(os.getenv("HISTORY_IMPORT_MAX_RECORDS", "10000"))
+
+NDJSON = "ndjson"
+CSV = "csv"
+FORMATS = {NDJSON: "application/x-ndjson", CSV: "text/csv"}
+
+EXPORT_TRACK_FIELDS = ("jamendo_id", "title", "artist", "preview_url", "album_image")
+CSV_FIELDS = (
+    "query_id", "username", "created_at", "user_input", "analysis_source",
+    "genres", "moods", "keywords", "position", *EXPORT_TRACK_FIELDS,
+)
+ANALYSIS_FIELDS = ("genres", "moods", "keywords")
+SOURCES = {value for value, _ in MoodQuery.SOURCE_CHOICES}
+
+
+class ImportTooLarge(ValueError):
+    """An import over its byte or record limit."""
+
+
+def iter_history(user=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields export records (dicts) for one user's history, or everyone's, oldest first."""
+    queries = MoodQuery.objects.order_by("id")
+    if user is not None:
+        queries = queries.filter(user=user)
+    Through = MoodQuery.tracks.through
+    last_id = 0
+    while True:
+        chunk = list(
+            queries.filter(id__gt=last_id).values(
+                "id", "user__username", "user_input", "generated_keywords", "analysis_source", "created_at"
+            )[:chunk_size]
+        )
+        if not chunk:
+            return
+        last_id = chunk[-1]["id"]
+
+        tracks = {row["id"]: [] for row in chunk}
+        # Through rows are inserted in playlist order, so their ids keep it.
+        for row in (
+            Through.objects.filter(moodquery_id__in=tracks)
+            .order_by("id")
+            .values("moodquery_id", *(f"track__{field}" for field in EXPORT_TRACK_FIELDS))
+        ):
+            tracks[row["moodquery_id"]].append({field: row[f"track__{field}"] for field in EXPORT_TRACK_FIELDS})
+
+        for row in chunk:
+            yield {
+                "query_id": row["id"],
+                "username": row["user__username"],
+                "user_input": row["user_input"],
+                "keywords": row["generated_keywords"],
+                "analysis_source": row["analysis_source"],
+                "created_at": row["created_at"].isoformat(),
+                "tracks": tracks[row["id"]],
+            }
+
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer can stream."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_rows(record):
+    analysis = record["keywords"] if isinstance(record["keywords"], dict) else {}
+    base = [
+        record["query_id"], record["username"], record["created_at"], record["user_input"],
+        record["analysis_source"],
+        *("|".join(str(v) for v in analysis.get(field) or []) for field in ANALYSIS_FIELDS),
+    ]
+    if not record["tracks"]:
+        yield base + [""] * (1 + len(EXPORT_TRACK_FIELDS))
+    for position, track in enumerate(record["tracks"], 1):
+        yield base + [position] + [track[field] or "" for field in EXPORT_TRACK_FIELDS]
+
+
+def export_lines(records, fmt=NDJSON):
+    """Encodes records as NDJSON lines (bytes) or CSV lines (str, header first)."""
+    if fmt == CSV:
+        writer = csv.writer(_Echo())
+        yield writer.writerow(CSV_FIELDS)
+        for record in records:
+            for row in _csv_rows(record):
+                yield writer.writerow(row)
+    else:
+        for record in records:
+            yield dumps(record) + b"\n"
+
+
+def parse_lines(lines, fmt=NDJSON):
+    """Lazily turns NDJSON or CSV lines (str or bytes) back into records."""
+    lines = (line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+    if fmt == CSV:
+        rows = csv.DictReader(lines)
+        for _, group in groupby(rows, key=lambda row: (row.get("query_id"), row.get("created_at"))):
+            group = list(group)
+            first = group[0]
+            yield {
+                "username": first.get("username"),
+                "user_input": first.get("user_input"),
+                "keywords": {field: [v for v in (first.get(field) or "").split("|") if v] for field in ANALYSIS_FIELDS},
+                "analysis_source": first.get("analysis_source"),
+                "created_at": first.get("created_at"),
+                "tracks": [
+                    {field: row.get(field) for field in EXPORT_TRACK_FIELDS}
+                    for row in sorted(group, key=lambda row: int(row.get("position") or 0))
+                    if row.get("jamendo_id")
+                ],
+            }
+    else:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"Line {number}: invalid JSON") from e
+
+
+def limit_lines(lines, max_bytes):
+    """Passes lines through, raising ImportTooLarge once more than max_bytes were read."""
+    read = 0
+    for line in lines:
+        read += len(line)
+        if read > max_bytes:
+            raise ImportTooLarge(f"the file is larger than {max_bytes} bytes")
+        yield line
+
+
+def _clean(record):
+    """Validated (user_input, keywords, source, created_at, tracks) from a record; raises ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    user_input = record.get("user_input")
+    if not isinstance(user_input, str) or not user_input.strip():
+        raise ValueError("user_input is required")
+    keywords = record.get("keywords")
+    if keywords is not None and not isinstance(keywords, dict):
+        raise ValueError("keywords must be an object")
+    source = record.get("analysis_source")
+    created_at = record.get("created_at")
+    if created_at:
+        created_at = datetime.fromisoformat(created_at)
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at, timezone.get_default_timezone())
+    tracks = []
+    for track in record.get("tracks") or []:
+        if not isinstance(track, dict) or not track.get("jamendo_id") or not track.get("preview_url"):
+            raise ValueError("every track needs jamendo_id and preview_url")
+        tracks.append({
+            "jamendo_id": str(track["jamendo_id"]),
+            "title": (track.get("title") or "")[:255],
+            "artist": (track.get("artist") or "")[:255],
+            "preview_url": track["preview_url"],
+            "album_image": track.get("album_image") or "",
+        })
+    return (
+        user_input[:500],
+        keywords,
+        source if source in SOURCES else "gemini",
+        created_at or timezone.now(),
+        tracks,
+    )
+
+
+def import_history(records, user=None, batch_size=IMPORT_BATCH_SIZE, max_records=None):
+    """
+    Saves records for `user`, or for the user named in each record when
+    None (unknown usernames are skipped). Returns {"imported": n, "skipped": n};
+    raises ValueError naming the first invalid record, or ImportTooLarge past
+    max_records (earlier batches stay saved).
+    """
+    totals = {"imported": 0, "skipped": 0}
+    user_ids = {}
+    batch = []
+    for number, record in enumerate(records, 1):
+        if max_records is not None and number > max_records:
+            raise ImportTooLarge(f"more than {max_records} records")
+        try:
+            cleaned = _clean(record)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Record {number}: {e}") from e
+
+        if user is not None:
+            user_id = user.id
+        else:
+            username = record.get("username")
+            if username not in user_ids:
+                user_ids[username] = User.objects.filter(username=username).values_list("id", flat=True).first()
+            user_id = user_ids[username]
+            if user_id is None:
+                totals["skipped"] += 1
+                continue
+
+        batch.append((user_id, *cleaned))
+        if len(batch) >= batch_size:
+            _import_batch(batch, totals)
+            batch = []
+    if batch:
+        _import_batch(batch, totals)
+    return totals
+
+
+@transaction.atomic
+def _import_batch(batch, totals):
+    """Bulk inserts one batch: existing-query check, queries, tracks, links."""
+    existing = set(
+        MoodQuery.objects.filter(
+            user_id__in={item[0] for item in batch},
+            created_at__in=[item[4] for item in batch],
+        ).values_list("user_id", "user_input", "created_at")
+    )
+    new = []
+    for item in batch:
+        key = (item[0], item[1], item[4])
+        if key in existing:
+            totals["skipped"] += 1
+            continue
+        existing.add(key)
+        new.append(item)
+    if not new:
+        return
+
+    queries = MoodQuery.objects.bulk_create([
+        MoodQuery(
+            user_id=user_id, user_input=user_input, generated_keywords=keywords,
+            analysis_source=source, created_at=created_at,
+        )
+        for user_id, user_input, keywords, source, created_at, _ in new
+    ])
+
+    by_jamendo_id = {}
+    for item in new:
+        for track in item[5]:
+            by_jamendo_id.setdefault(track["jamendo_id"], track)
+    rows = upsert_tracks(by_jamendo_id) if by_jamendo_id else {}
+
+    Through = MoodQuery.tracks.through
+    Through.objects.bulk_create(
+        [
+            Through(moodquery_id=query.id, track_id=rows[track["jamendo_id"]]["id"])
+            for query, item in zip(queries, new)
+            for track in item[5]
+        ],
+        ignore_conflicts=True,
+    )
+    totals["imported"] += len(new)
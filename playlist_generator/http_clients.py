@@ -0,0 +1,148 @@
+"""
+Pooled, process-wide HTTP clients for Jamendo (requests / httpx) and Gemini.
+
+The client libraries are imported on first use rather than at module
+import: google.genai alone is most of a cold start, and many requests
+(cached analyses, warm playlists, history) never need it. warmup.py can
+build the clients ahead of the first request instead.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connection pool sizing. POOL_MAXSIZE should be at least JAMENDO_SEARCH_WORKERS
+# so concurrent search passes never wait on a free connection.
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+# Retries on 429/5xx with exponential backoff (honours Retry-After).
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Override the Gemini API host, e.g. for a proxy or the benchmark stand-in.
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") or None
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_genai_clients = {}
+# httpx.AsyncClient is bound to the loop it was first used on, so keep one per loop.
+_async_clients = weakref.WeakKeyDictionary()
+_genai_pid = None
+
+
+def _build_session():
+    """Creates a requests.Session with a pooled, retrying adapter."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    Returns the process-wide keep-alive session.
+    Rebuilt after a fork so gunicorn workers never share sockets with the master.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def reset_clients():
+    """Drops cached clients so the next call picks up changed settings."""
+    global _session, _session_pid
+    with _lock:
+        _session = None
+        _session_pid = None
+        _genai_clients.clear()
+
+
+def get_genai_client(api_key):
+    """
+    Returns a cached genai.Client for the given key. The client keeps its
+    underlying httpx connection pool alive between requests.
+    """
+    global _genai_pid
+    pid = os.getpid()
+    client = _genai_clients.get(api_key) if _genai_pid == pid else None
+    if client is None:
+        with _lock:
+            if _genai_pid != pid:
+                _genai_clients.clear()
+                _genai_pid = pid
+            client = _genai_clients.get(api_key)
+            if client is None:
+                import httpx
+                from google import genai
+                from google.genai import types
+
+                client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(
+                        base_url=GEMINI_BASE_URL,
+                        client_args={
+                            "limits": httpx.Limits(
+                                max_connections=POOL_MAXSIZE,
+                                max_keepalive_connections=POOL_MAXSIZE,
+                            ),
+                        },
+                        retry_options=types.HttpRetryOptions(
+                            attempts=MAX_RETRIES + 1,
+                            initial_delay=RETRY_BACKOFF,
+                            http_status_codes=list(RETRY_STATUSES),
+                        ),
+                    ),
+                )
+                _genai_clients[api_key] = client
+    return client
+
+
+def get_async_client():
+    """
+    Returns the keep-alive httpx.AsyncClient for the running event loop.
+    The transport retries connection errors; retries on 429/5xx are done by
+    the caller (see JamendoService._request_async).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        import httpx
+
+        client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                retries=MAX_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=POOL_MAXSIZE,
+                    max_keepalive_connections=POOL_MAXSIZE,
+                ),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
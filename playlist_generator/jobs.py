@@ -0,0 +1,353 @@
+"""
+Database-backed job queue for playlist generation.
+
+POST /generate/jobs/ stores a PlaylistJob and returns at once; workers
+(`manage.py run_jobs`, or threads inside the web process when
+JOB_INLINE_WORKERS is set) claim due jobs with a conditional UPDATE, run
+the same pipeline as generate_playlist and record the stage they reached,
+so /api/jobs/<id>/ can report progress and finally the saved MoodQuery.
+No broker is needed: any database Django supports works as the queue.
+
+On serverless hosts (Vercel) nothing runs once the response is sent, so
+neither kind of worker exists there. Instead a scheduled request to
+/api/jobs/run/ (authorized with CRON_SECRET or JOB_RUN_TOKEN) calls
+drain(), which runs due jobs within that request and returns after
+JOB_DRAIN_SECONDS at the latest. vercel.json schedules it once a day, the
+most Vercel's Hobby plan accepts; on Pro change the schedule to
+"* * * * *", or have an external scheduler call it every minute with
+JOB_RUN_TOKEN.
+
+Failed attempts are retried with exponential backoff (or the upstream's
+Retry-After) up to JOB_MAX_ATTEMPTS. A claimed job holds a lease that each
+stage renews; if a worker dies the lease runs out and another worker takes
+the job over. The playlist is saved at most once per job, so a takeover
+after the save reuses that MoodQuery. Identical requests from one user
+(same normalized input) share the queued or running job, and one that
+succeeded within JOB_DEDUP_SECONDS.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from . import breaker, metrics
+from .models import PlaylistJob
+from .mood_analyzer import resolve_mood
+from .mood_cache import normalize_text
+from .persistence import save_mood_query
+from .query_index import SOURCE_SIMILAR, find_similar
+from .ratelimit import RateLimited, upstream_retry_after
+from .services import JamendoService
+
+load_dotenv()
+
+# Worker threads started by `manage.py run_jobs` unless --workers is given.
+WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Worker threads run inside each web process (0 = only `manage.py run_jobs` runs jobs).
+INLINE_WORKERS = int(os.getenv("JOB_INLINE_WORKERS", "0"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Delay before the first retry; doubled for each further attempt.
+RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+# How long a worker may go without finishing a stage before the job is taken over.
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Idle workers check for due jobs this often.
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# A finished job answers identical requests for this long.
+DEDUP_SECONDS = int(os.getenv("JOB_DEDUP_SECONDS", "60"))
+# Finished jobs are deleted after this long.
+RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+# Longest one /api/jobs/run/ request runs jobs; keep it under the host's function timeout.
+DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "25"))
+# Time one attempt may need (a Gemini call plus the Jamendo tiers). drain()
+# stops claiming this long before JOB_DRAIN_SECONDS ends, and its jobs hold
+# leases this long, so an attempt cut off by the host is retried soon.
+ATTEMPT_SECONDS = float(os.getenv("JOB_ATTEMPT_SECONDS", "15"))
+
+PLAYLIST_LIMIT = 24
+# Due jobs looked at per claim; workers racing for the first one fall through to the next.
+CLAIM_BATCH = 8
+JOB_METRIC = "mood_jockey_jobs_total"
+
+ACTIVE = (PlaylistJob.QUEUED, PlaylistJob.RUNNING)
+FINISHED = (PlaylistJob.SUCCEEDED, PlaylistJob.FAILED)
+
+
+class JobError(Exception):
+    """A failed attempt; retried after at least `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def dedup_key(user_id, user_input):
+    text = normalize_text(user_input) or user_input.strip().lower()
+    return hashlib.sha1(f"{user_id}|{text}".encode("utf-8")).hexdigest()
+
+
+def enqueue(user, user_input):
+    """
+    Returns (job, created). An identical request already queued, running or
+    recently succeeded is returned instead of queueing another one.
+    """
+    key = dedup_key(user.id, user_input)
+    recent = Q(status=PlaylistJob.SUCCEEDED, finished_at__gte=timezone.now() - timedelta(seconds=DEDUP_SECONDS))
+    for _ in range(2):
+        existing = (
+            PlaylistJob.objects.filter(dedup_key=key)
+            .filter(Q(status__in=ACTIVE) | recent)
+            .order_by("-id")
+            .first()
+        )
+        if existing is not None:
+            metrics.registry.inc(JOB_METRIC, outcome="deduplicated")
+            return existing, False
+        try:
+            with transaction.atomic():
+                job = PlaylistJob.objects.create(
+                    user=user, user_input=user_input, dedup_key=key, run_after=timezone.now()
+                )
+        except IntegrityError:
+            # An identical request queued its job between our lookup and insert.
+            continue
+        metrics.registry.inc(JOB_METRIC, outcome="queued")
+        if INLINE_WORKERS:
+            get_inline_worker()
+        return job, True
+    raise JobError("Could not queue the job")
+
+
+def claim(lease_seconds=LEASE_SECONDS):
+    """Marks the oldest due job (or one whose lease expired) running and returns it, or None."""
+    now = timezone.now()
+    due = (
+        PlaylistJob.objects.filter(
+            Q(status=PlaylistJob.QUEUED, run_after__lte=now)
+            | Q(status=PlaylistJob.RUNNING, locked_until__lt=now)
+        )
+        .order_by("run_after", "id")
+        .values_list("id", "status", "attempts")[:CLAIM_BATCH]
+    )
+    for job_id, status, attempts in due:
+        # Only one worker's UPDATE can still match the status and attempt count it read.
+        current = PlaylistJob.objects.filter(id=job_id, status=status, attempts=attempts)
+        if attempts >= MAX_ATTEMPTS:
+            # Its last attempt died with the worker.
+            current.update(
+                status=PlaylistJob.FAILED, error="Worker stopped responding", locked_until=None, finished_at=now
+            )
+            metrics.registry.inc(JOB_METRIC, outcome="failed")
+            continue
+        if current.update(
+            status=PlaylistJob.RUNNING,
+            attempts=attempts + 1,
+            stage="",
+            locked_until=now + timedelta(seconds=lease_seconds),
+        ):
+            job = PlaylistJob.objects.select_related("user").get(id=job_id)
+            job.lease_seconds = lease_seconds
+            return job
+    return None
+
+
+def _stage(job, stage):
+    """Records progress and renews the lease."""
+    PlaylistJob.objects.filter(id=job.id, attempts=job.attempts).update(
+        stage=stage, locked_until=timezone.now() + timedelta(seconds=job.lease_seconds)
+    )
+
+
+def generate(job):
+    """generate_playlist's pipeline for a claimed job; returns the saved MoodQuery or raises JobError."""
+    if job.mood_query_id is not None:
+        # An earlier attempt saved the playlist, then lost its lease before finishing.
+        return job.mood_query
+
+    similar = find_similar(job.user_input, PLAYLIST_LIMIT, job.user)
+    if similar:
+        (ai_response, jamendo_tracks), source = similar, SOURCE_SIMILAR
+    else:
+        _stage(job, "analysis")
+        ai_response, source = resolve_mood(job.user_input)
+        if "error" in ai_response:
+            raise JobError(ai_response["error"])
+
+        _stage(job, "tracks")
+        jamendo_tracks = JamendoService.get_tracks(
+            ai_response.get("genres", []),
+            ai_response.get("moods", []),
+            ai_response.get("keywords", []),
+            limit=PLAYLIST_LIMIT,
+        )
+        if not jamendo_tracks:
+            jamendo = breaker.get_breaker("jamendo").snapshot()
+            raise JobError(
+                "No tracks found for the given mood",
+                retry_after=max(upstream_retry_after("jamendo"), jamendo["retry_in"]),
+            )
+
+    _stage(job, "persist")
+    with metrics.span("persist"):
+        return _persist(job, ai_response, jamendo_tracks, source)
+
+
+def _persist(job, ai_response, jamendo_tracks, source):
+    """Saves the playlist once per job: a worker that lost the race keeps the first worker's MoodQuery."""
+    with transaction.atomic():
+        mood_query, _ = save_mood_query(job.user, job.user_input, ai_response, jamendo_tracks, source)
+        if PlaylistJob.objects.filter(id=job.id, mood_query__isnull=True).update(mood_query=mood_query):
+            return mood_query
+        transaction.set_rollback(True)
+    return PlaylistJob.objects.select_related("mood_query").get(id=job.id).mood_query
+
+
+def run(job):
+    """Runs one claimed attempt and records success, a scheduled retry or the final failure."""
+    current = PlaylistJob.objects.filter(id=job.id, attempts=job.attempts)
+    with metrics.span("job") as span:
+        try:
+            mood_query = generate(job)
+        except JobError as e:
+            error, retry_after = str(e), e.retry_after
+        except RateLimited as e:
+            error, retry_after = "Too many requests. Please try again shortly.", e.retry_after
+        except Exception as e:
+            print(f"Job Worker Error: {e}")
+            error, retry_after = "An unexpected error occurred while generating your playlist.", 0
+        else:
+            current.update(
+                status=PlaylistJob.SUCCEEDED,
+                stage="done",
+                error="",
+                mood_query=mood_query,
+                locked_until=None,
+                finished_at=timezone.now(),
+            )
+            span.tag(outcome="succeeded")
+            metrics.registry.inc(JOB_METRIC, outcome="succeeded")
+            return
+
+        now = timezone.now()
+        if job.attempts < MAX_ATTEMPTS:
+            delay = max(retry_after, RETRY_BACKOFF * 2 ** (job.attempts - 1))
+            current.update(
+                status=PlaylistJob.QUEUED,
+                error=error[:255],
+                locked_until=None,
+                run_after=now + timedelta(seconds=delay),
+            )
+            outcome = "retried"
+        else:
+            current.update(status=PlaylistJob.FAILED, error=error[:255], locked_until=None, finished_at=now)
+            outcome = "failed"
+        span.tag(outcome=outcome)
+        metrics.registry.inc(JOB_METRIC, outcome=outcome)
+
+
+def stats():
+    """Queued and running job counts."""
+    counts = dict(
+        PlaylistJob.objects.filter(status__in=ACTIVE).values("status").annotate(n=Count("id")).values_list("status", "n")
+    )
+    return {status: counts.get(status, 0) for status in ACTIVE}
+
+
+def drain(seconds=DRAIN_SECONDS, concurrency=WORKERS, attempt_seconds=ATTEMPT_SECONDS):
+    """
+    Runs due jobs on `concurrency` threads for hosts without long-lived
+    workers (/api/jobs/run/) and returns how many attempts finished. Jobs
+    are only claimed while `attempt_seconds` of the `seconds` window remain,
+    and it returns after `seconds` even if an attempt is still running: that
+    job's lease (`attempt_seconds`) then runs out and a later drain retries it.
+    """
+    worker = JobWorker(concurrency, lease_seconds=attempt_seconds)
+    worker.start(drain=True, claim_for=max(0.0, seconds - attempt_seconds))
+    worker.join(seconds)
+    worker.stop()
+    return worker.processed
+
+
+def prune(older_than):
+    """Deletes jobs that finished before `older_than`; returns how many."""
+    deleted, _ = PlaylistJob.objects.filter(status__in=FINISHED, finished_at__lt=older_than).delete()
+    return deleted
+
+
+class JobWorker:
+    """Claims and runs jobs on `concurrency` daemon threads."""
+
+    def __init__(self, concurrency=WORKERS, poll_interval=POLL_INTERVAL, lease_seconds=LEASE_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._claim_until = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._processed_lock = threading.Lock()
+        self.processed = 0
+
+    def start(self, drain=False, claim_for=None):
+        """
+        Starts the threads; with drain=True each exits once no job is due, and
+        with `claim_for` none claims a job after that many seconds.
+        """
+        if claim_for is not None:
+            self._claim_until = time.monotonic() + claim_for
+        for i in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._loop, args=(drain,), name=f"job-worker-{i}", daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def _loop(self, drain):
+        while not self._stop.is_set():
+            if self._claim_until is not None and time.monotonic() >= self._claim_until:
+                return
+            try:
+                job = claim(self.lease_seconds)
+                if job is not None:
+                    run(job)
+                    with self._processed_lock:
+                        self.processed += 1
+            except Exception as e:
+                print(f"Job Worker Error: {e}")
+                job = None
+            finally:
+                close_old_connections()
+            if job is None:
+                if drain:
+                    return
+                self._stop.wait(self.poll_interval)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_inline_worker():
+    """Starts (once per process) the JOB_INLINE_WORKERS threads that run jobs inside the web server."""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = JobWorker(INLINE_WORKERS).start()
+    return _worker
@@ -0,0 +1,237 @@
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from playlist_generator import http_clients, ratelimit, services
+from playlist_generator.fake_upstreams import FakeGeminiHandler, FakeJamendoHandler, FakeUpstream, UpstreamConfig
+from playlist_generator.mood_cache import get_mood_cache
+from playlist_generator.persistence import count_queries, save_mood_query
+
+ENDPOINTS = ("public_generate", "generate", "get_query", "history")
+
+MOOD_INPUTS = [
+    "Relaxing lo-fi beats for studying",
+    "Hitting the gym hard today, need something aggressive",
+    "Sitting by the window watching the rain",
+    "Late night drive through the city",
+    "Sunday morning coffee and sunshine",
+    "Heartbroken and can't sleep",
+    "Dinner party with friends",
+    "Deep focus coding session",
+    "Road trip singalong",
+    "Calm meditation before bed",
+    "Happy summer beach day",
+    "Dark moody thunderstorm",
+]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    # Nearest-rank percentile.
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests the playlist endpoints against local fake Jamendo/Gemini servers "
+        "on a throwaway database and reports latency percentiles, throughput and DB query counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Concurrent client threads.")
+        parser.add_argument("--distinct-inputs", type=int, default=len(MOOD_INPUTS),
+                            help="Distinct mood inputs cycled through (lower = more cache hits).")
+        parser.add_argument("--jamendo-latency", type=float, default=0.08, help="Seconds per fake Jamendo call.")
+        parser.add_argument("--gemini-latency", type=float, default=0.6, help="Seconds per fake Gemini call.")
+        parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random latency jitter.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake upstream calls that fail with 503.")
+        parser.add_argument("--results", type=int, default=None, help="Cap on tracks per fake Jamendo page.")
+        parser.add_argument("--history-size", type=int, default=200, help="Saved queries seeded for history/get_query.")
+        parser.add_argument("--warm", action="store_true", help="Keep caches warm between endpoints instead of clearing them.")
+        parser.add_argument("--output", help="Write the JSON report to this path.")
+        parser.add_argument("--compare", help="Previous JSON report to print deltas against.")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1.")
+
+        jamendo = FakeUpstream(FakeJamendoHandler, UpstreamConfig(
+            options["jamendo_latency"], options["jitter"], options["error_rate"], options["results"]
+        )).start()
+        gemini = FakeUpstream(FakeGeminiHandler, UpstreamConfig(
+            options["gemini_latency"], options["jitter"], options["error_rate"]
+        )).start()
+
+        # Point the services at the stand-ins.
+        os.environ.setdefault("JAMENDO_CLIENT_ID", "benchmark")
+        os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+        services.TRACKS_URL = f"{jamendo.url}/v3.0/tracks/"
+        http_clients.GEMINI_BASE_URL = gemini.url
+        http_clients.reset_clients()
+        # Measure the pipeline, not the rate-limit governor.
+        ratelimit.BACKEND = "none"
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        test_db = os.path.join(tempfile.mkdtemp(prefix="mood_jockey_bench_"), "bench.sqlite3")
+        if connection.vendor == "sqlite":
+            # A file-backed test DB so worker threads share it.
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = test_db
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = self._run(options, jamendo, gemini)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            jamendo.stop()
+            gemini.stop()
+
+        self._print(report)
+        if options["compare"]:
+            self._compare(report, options["compare"])
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _clear_caches(self):
+        mood_cache = get_mood_cache()
+        if mood_cache is not None:
+            mood_cache.clear()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def _seed(self, user, count):
+        for i in range(count):
+            save_mood_query(user, MOOD_INPUTS[i % len(MOOD_INPUTS)], {"genres": ["pop"], "moods": ["happy"], "keywords": ["bench"]}, [
+                {"id": f"seed-{(i * 7 + j) % 500}", "title": "Seed", "artist": "Seed", "preview_url": "https://example.com/a.mp3",
+                 "album_image": "https://example.com/a.jpg"}
+                for j in range(24)
+            ])
+
+    def _run(self, options, jamendo, gemini):
+        user = User.objects.create_user("benchmark", password="benchmark")
+        self._seed(user, options["history_size"])
+        query_ids = list(user.queries.values_list("id", flat=True))
+        inputs = [MOOD_INPUTS[i % len(MOOD_INPUTS)] for i in range(max(1, options["distinct_inputs"]))]
+        inputs = [f"{text} #{i // len(MOOD_INPUTS)}" if i >= len(MOOD_INPUTS) else text for i, text in enumerate(inputs)]
+
+        def call(endpoint, i):
+            client = Client()
+            client.force_login(user)
+            text = inputs[i % len(inputs)]
+            with count_queries() as queries:
+                start = time.perf_counter()
+                if endpoint == "public_generate":
+                    response = client.get("/api/public/generate/", {"user_input": text})
+                elif endpoint == "generate":
+                    response = client.post("/generate/", data=json.dumps({"user_input": text}), content_type="application/json")
+                elif endpoint == "get_query":
+                    response = client.get(f"/api/query/{query_ids[i % len(query_ids)]}/")
+                else:
+                    response = client.get("/history/")
+                elapsed = time.perf_counter() - start
+            close_old_connections()
+            return elapsed, response.status_code, queries["count"]
+
+        results = {}
+        for endpoint in options["endpoints"]:
+            if not options["warm"]:
+                self._clear_caches()
+            jamendo_before, gemini_before = jamendo.requests, gemini.requests
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                samples = list(pool.map(lambda i: call(endpoint, i), range(options["requests"])))
+            wall = time.perf_counter() - started
+
+            latencies = [s[0] * 1000 for s in samples]
+            query_counts = [s[2] for s in samples]
+            results[endpoint] = {
+                "requests": len(samples),
+                "errors": sum(1 for s in samples if s[1] >= 400),
+                "throughput_rps": round(len(samples) / wall, 2),
+                "latency_ms": {
+                    "p50": round(_percentile(latencies, 50), 2),
+                    "p95": round(_percentile(latencies, 95), 2),
+                    "p99": round(_percentile(latencies, 99), 2),
+                    "mean": round(statistics.fmean(latencies), 2),
+                    "max": round(max(latencies), 2),
+                },
+                "db_queries": {
+                    "mean": round(statistics.fmean(query_counts), 2),
+                    "max": max(query_counts),
+                },
+                "upstream_calls": {
+                    "jamendo": jamendo.requests - jamendo_before,
+                    "gemini": gemini.requests - gemini_before,
+                },
+            }
+
+        return {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "config": {k: options[k] for k in (
+                "requests", "concurrency", "distinct_inputs", "jamendo_latency", "gemini_latency",
+                "jitter", "error_rate", "results", "history_size", "warm",
+            )},
+            "results": results,
+        }
+
+    def _print(self, report):
+        self.stdout.write(f"Benchmark @ {report['commit'] or 'unknown commit'} ({report['database']})")
+        self.stdout.write(f"{'endpoint':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'queries':>9}{'errors':>8}")
+        for endpoint, r in report["results"].items():
+            lat = r["latency_ms"]
+            self.stdout.write(
+                f"{endpoint:<16}{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}"
+                f"{r['throughput_rps']:>9.1f}{r['db_queries']['mean']:>9.1f}{r['errors']:>8}"
+            )
+
+    def _compare(self, report, path):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read baseline report {path}: {e}")
+
+        self.stdout.write(f"Compared with {baseline.get('commit') or path}:")
+        for endpoint, r in report["results"].items():
+            base = baseline.get("results", {}).get(endpoint)
+            if not base:
+                continue
+            deltas = []
+            for pct in ("p50", "p95", "p99"):
+                old, new = base["latency_ms"][pct], r["latency_ms"][pct]
+                change = (new - old) / old * 100 if old else 0.0
+                deltas.append(f"{pct} {old:.1f}->{new:.1f}ms ({change:+.0f}%)")
+            self.stdout.write(f"  {endpoint:<16}" + "  ".join(deltas))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from playlist_generator.models import MoodQuery
+from playlist_generator.query_index import PATH, SOURCE_SIMILAR, QueryIndex, embed
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the similarity index of past mood queries from the database, "
+        "dropping deleted rows. New queries are added incrementally while the app runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=str(PATH), help="Index file to write.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        items = []
+        skipped = 0
+        for query_id, user_input, analysis in (
+            MoodQuery.objects.filter(generated_keywords__isnull=False)
+            .exclude(analysis_source=SOURCE_SIMILAR)
+            .order_by("id")
+            .values_list("id", "user_input", "generated_keywords")
+            .iterator(chunk_size=2000)
+        ):
+            vector = embed(user_input)
+            if not isinstance(analysis, dict) or "error" in analysis or not vector.any():
+                skipped += 1
+                continue
+            items.append((query_id, vector))
+
+        index = QueryIndex(options["path"])
+        index.rebuild(items)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(items)} queries ({skipped} skipped) into {options['path']} "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
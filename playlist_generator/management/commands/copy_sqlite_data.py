@@ -0,0 +1,82 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+from playlist_generator.models import MoodAnalysisCache, MoodQuery, Tag, Track, TrackTag, WarmPlaylist
+
+SOURCE_ALIAS = "sqlite_source"
+
+# Parents before children so foreign keys resolve; primary keys are kept.
+MODELS = [User, Track, Tag, TrackTag, MoodQuery, MoodQuery.tracks.through, MoodAnalysisCache, WarmPlaylist]
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies users, tracks, the catalog tag index, mood queries and caches from an SQLite "
+        "file into the configured database (e.g. PostgreSQL via DATABASE_URL). "
+        "Run `manage.py migrate` on the target first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=str(settings.BASE_DIR / "db.sqlite3"), help="SQLite file to read.")
+        parser.add_argument("--database", default="default", help="Target database alias.")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows per bulk insert.")
+        parser.add_argument("--force", action="store_true", help="Copy even if the target already has rows.")
+
+    def handle(self, *args, **options):
+        target = options["database"]
+        if connections[target].vendor == "sqlite" and str(connections[target].settings_dict["NAME"]) == options["source"]:
+            raise CommandError("Source and target are the same SQLite file; set DATABASE_URL to the new database.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        connections.databases[SOURCE_ALIAS] = connections.configure_settings({
+            **connections.databases,
+            SOURCE_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": options["source"]},
+        })[SOURCE_ALIAS]
+
+        if not options["force"]:
+            populated = [m._meta.label for m in MODELS if m.objects.using(target).exists()]
+            if populated:
+                raise CommandError(f"Target already has rows in {', '.join(populated)}; use --force to copy anyway.")
+
+        started = time.perf_counter()
+        try:
+            with transaction.atomic(using=target):
+                for model in MODELS:
+                    copied = self._copy(model, target, options["batch_size"])
+                    self.stdout.write(f"{model._meta.label}: {copied} rows")
+                self._reset_sequences(target)
+        finally:
+            connections[SOURCE_ALIAS].close()
+
+        self.stdout.write(self.style.SUCCESS(f"Copied data in {time.perf_counter() - started:.1f}s."))
+
+    def _copy(self, model, target, batch_size):
+        # values() rows use column attnames (user_id, track_id), which the constructor accepts.
+        rows = model.objects.using(SOURCE_ALIAS).order_by("pk").values().iterator(chunk_size=batch_size)
+        copied = 0
+        batch = []
+        for row in rows:
+            batch.append(model(**row))
+            if len(batch) >= batch_size:
+                model.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+                copied += len(batch)
+                batch = []
+        if batch:
+            model.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+            copied += len(batch)
+        return copied
+
+    def _reset_sequences(self, target):
+        """Explicit ids leave PostgreSQL sequences behind; move them past the copied rows."""
+        connection = connections[target]
+        statements = connection.ops.sequence_reset_sql(no_style(), MODELS)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,53 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from playlist_generator import history_io, query_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports an export_history file (NDJSON or CSV) with batched bulk inserts. Records go to "
+        "--user, or to the user named in each record; queries that already exist are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="File to read, or - for stdin.")
+        parser.add_argument("--user", help="Username to import every record into (default: each record's username).")
+        parser.add_argument("--format", choices=list(history_io.FORMATS),
+                            help="Input format (default: from the file extension, else ndjson).")
+        parser.add_argument("--batch-size", type=int, default=history_io.IMPORT_BATCH_SIZE,
+                            help="Queries inserted per transaction.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        user = None
+        if options["user"]:
+            user = User.objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']!r}.")
+        fmt = options["format"] or (history_io.CSV if options["input"].endswith(".csv") else history_io.NDJSON)
+
+        started = time.perf_counter()
+        try:
+            if options["input"] == "-":
+                totals = self._import(sys.stdin, fmt, user, options["batch_size"])
+            else:
+                with open(options["input"], encoding="utf-8", newline="") as f:
+                    totals = self._import(f, fmt, user, options["batch_size"])
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            raise CommandError(f"Import stopped: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['imported']} queries ({totals['skipped']} skipped) "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
+        if query_index.ENABLED:
+            self.stdout.write("Run `manage.py build_query_index` to add the imported queries to the similarity index.")
+
+    @staticmethod
+    def _import(lines, fmt, user, batch_size):
+        return history_io.import_history(history_io.parse_lines(lines, fmt), user=user, batch_size=batch_size)
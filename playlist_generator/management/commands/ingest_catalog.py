@@ -0,0 +1,90 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from playlist_generator.ai_service import ALLOWED_GENRES, ALLOWED_MOODS
+from playlist_generator.catalog import CatalogService
+from playlist_generator.http_clients import get_session
+from playlist_generator.services import TRACKS_URL, JamendoService
+
+
+class Command(BaseCommand):
+    help = "Bulk-pulls Jamendo tracks with their musicinfo tags into the local catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tags", nargs="*",
+            help="Tags to pull (defaults to every allowed genre and mood). Pass no values to pull the global feed.",
+        )
+        parser.add_argument("--pages", type=int, default=3, help="Pages to pull per tag.")
+        parser.add_argument("--page-size", type=int, default=200, help="Tracks per page (Jamendo max is 200).")
+        parser.add_argument("--order", default="popularity_total", help="Jamendo ordering for the pulled feed.")
+        parser.add_argument(
+            "--incremental", action="store_true",
+            help=(
+                "Only pull tracks released since the last catalog sync. Jamendo cannot filter on "
+                "last modification, so tags and listen counts of older tracks are not refreshed: "
+                "run a full ingest periodically as well."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        client_id = os.getenv("JAMENDO_CLIENT_ID")
+        if not client_id:
+            raise CommandError("JAMENDO_CLIENT_ID not found in environment variables.")
+
+        tags = options["tags"]
+        if tags is None:
+            tags = ALLOWED_GENRES + ALLOWED_MOODS
+        feeds = tags or [None]
+
+        base = {
+            "client_id": client_id,
+            "format": "json",
+            "include": "musicinfo stats",
+            "order": options["order"],
+            "limit": min(options["page_size"], 200),
+        }
+        if options["incremental"]:
+            last_sync = CatalogService.last_synced_at()
+            if last_sync is None:
+                raise CommandError("Catalog is empty; run a full ingest first.")
+            base["datebetween"] = f"{last_sync:%Y-%m-%d}_{timezone.now():%Y-%m-%d}"
+
+        total_created = total_updated = 0
+        for tag in feeds:
+            for page in range(options["pages"]):
+                params = {**base, "offset": page * base["limit"]}
+                if tag:
+                    params["tags"] = tag
+                try:
+                    response = get_session().get(TRACKS_URL, params=params, timeout=30)
+                    response.raise_for_status()
+                    results = response.json().get("results", [])
+                except Exception as e:
+                    self.stderr.write(f"Failed to fetch {tag or 'all'} page {page + 1}: {e}")
+                    break
+
+                items = []
+                for item in results:
+                    track = JamendoService._parse_item(item)
+                    track["listens"] = (item.get("stats") or {}).get("rate_listened_total") or 0
+                    items.append(track)
+                created, updated = CatalogService.ingest(items)
+                total_created += created
+                total_updated += updated
+                self.stdout.write(f"{tag or 'all'} page {page + 1}: {created} new, {updated} updated")
+
+                if len(results) < base["limit"]:
+                    break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Catalog ingest finished: {total_created} new, {total_updated} updated."
+        ))
+        if options["incremental"]:
+            oldest = CatalogService.oldest_synced_at()
+            self.stdout.write(self.style.WARNING(
+                f"Incremental ingests only pull new releases; the stalest tracks' tags and listens "
+                f"date from {oldest:%Y-%m-%d %H:%M}. Run a full ingest to refresh them."
+            ))
@@ -0,0 +1,109 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: what a cold start does before serving its first request.
+PROBE = """
+import importlib, json, time
+started = time.perf_counter()
+module = importlib.import_module({wsgi_module!r})
+from django.urls import resolve
+resolve("/")
+loaded = time.perf_counter()
+timings = {{}}
+if {warmup!r}:
+    from playlist_generator.warmup import warmup
+    timings = warmup()
+print(json.dumps({{
+    "app_ms": (loaded - started) * 1000,
+    "warmup_ms": (time.perf_counter() - loaded) * 1000,
+    "warmup_steps": timings,
+}}))
+"""
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)$")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cold-start time in fresh interpreters (python -X importtime) and reports "
+        "the import cost per module and per top-level package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=3, help="Cold starts to measure (medians are reported).")
+        parser.add_argument("--top", type=int, default=20, help="Modules to list.")
+        parser.add_argument("--sort", choices=["self", "cumulative"], default="cumulative",
+                            help="Order modules by their own import time or including what they import.")
+        parser.add_argument("--warmup", action="store_true", help="Also time warmup() after the app has loaded.")
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1 or options["top"] < 1:
+            raise CommandError("--repeat and --top must be at least 1.")
+
+        wsgi_module = settings.WSGI_APPLICATION.rsplit(".", 1)[0]
+        probe = PROBE.format(wsgi_module=wsgi_module, warmup=options["warmup"])
+        env = {**os.environ, "WARMUP_ON_START": "off", "PYTHONDONTWRITEBYTECODE": "1"}
+
+        runs = []
+        modules = defaultdict(lambda: {"self": [], "cumulative": []})
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", probe],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            total_ms = (time.perf_counter() - started) * 1000
+            if result.returncode != 0:
+                raise CommandError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run["total_ms"] = total_ms
+            runs.append(run)
+            for line in result.stderr.splitlines():
+                match = _IMPORT_LINE.match(line)
+                if match:
+                    own, cumulative, name = match.groups()
+                    modules[name]["self"].append(int(own) / 1000)
+                    modules[name]["cumulative"].append(int(cumulative) / 1000)
+
+        def median(key):
+            return statistics.median(run[key] for run in runs)
+
+        self.stdout.write(
+            f"Cold start (median of {len(runs)}): {median('total_ms'):.0f} ms process"
+            f"{' including warmup' if options['warmup'] else ''}, "
+            f"{median('app_ms'):.0f} ms loading {wsgi_module} and the URLconf"
+        )
+        if options["warmup"]:
+            steps = ", ".join(
+                f"{name} {statistics.median(run['warmup_steps'][name] for run in runs):.0f}"
+                for name in runs[0]["warmup_steps"]
+            )
+            self.stdout.write(f"Warmup: {median('warmup_ms'):.0f} ms ({steps})")
+
+        costs = {
+            name: {key: statistics.median(values) for key, values in times.items()}
+            for name, times in modules.items()
+        }
+        packages = defaultdict(float)
+        for name, cost in costs.items():
+            packages[name.split(".")[0]] += cost["self"]
+
+        scope = " (warmup imports included)" if options["warmup"] else ""
+        self.stdout.write(f"\nTop {options['top']} modules by {options['sort']} import time{scope} (ms):")
+        self.stdout.write(f"{'self':>9} {'cumulative':>11}  module")
+        ranked = sorted(costs.items(), key=lambda item: -item[1][options["sort"]])
+        for name, cost in ranked[:options["top"]]:
+            self.stdout.write(f"{cost['self']:9.1f} {cost['cumulative']:11.1f}  {name}")
+
+        self.stdout.write(f"\nTop {options['top']} packages by total import time (ms):")
+        for name, cost in sorted(packages.items(), key=lambda item: -item[1])[:options["top"]]:
+            self.stdout.write(f"{cost:9.1f}  {name}")
@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from playlist_generator import jobs
+
+# Seconds between prunes of finished jobs.
+PRUNE_INTERVAL = 600
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued playlist generation jobs (POST /generate/jobs/) on a pool of worker threads. "
+        "Start as many of these processes as you like; they share the queue through the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=jobs.WORKERS, help="Jobs run concurrently by this process.")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due instead of polling forever.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        started = time.perf_counter()
+        self._prune()
+        worker = jobs.JobWorker(options["workers"]).start(drain=options["once"])
+        self.stdout.write(f"Running jobs on {options['workers']} workers.")
+        try:
+            while worker.alive():
+                worker.join(PRUNE_INTERVAL)
+                if worker.alive():
+                    self._prune()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the current jobs...")
+            worker.stop()
+            worker.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Job workers stopped after {time.perf_counter() - started:.1f}s."))
+
+    def _prune(self):
+        try:
+            pruned = jobs.prune(timezone.now() - timedelta(seconds=jobs.RETENTION_SECONDS))
+            if pruned:
+                self.stdout.write(f"Removed {pruned} finished jobs.")
+        finally:
+            close_old_connections()
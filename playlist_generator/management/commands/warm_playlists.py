@@ -0,0 +1,104 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from playlist_generator.ai_service import ALLOWED_GENRES, ALLOWED_MOODS
+from playlist_generator.models import WarmPlaylist
+from playlist_generator.services import JamendoService
+from playlist_generator.warm_playlists import MAX_AGE, SIZE, WarmPlaylistService
+
+
+class Command(BaseCommand):
+    help = (
+        "Precomputes playlists for every allowed genre x mood pair (and the most popular "
+        "keywords) so live requests can be served from warm sets. Use --loop to keep them fresh."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keywords", type=int, default=10,
+                            help="Also warm each pair with this many of the most used keywords.")
+        parser.add_argument("--extra-keywords", nargs="*", default=[], help="Keywords to warm in addition to the popular ones.")
+        parser.add_argument("--size", type=int, default=SIZE, help="Tracks stored per combination.")
+        parser.add_argument("--workers", type=int, default=4, help="Combinations searched in parallel.")
+        parser.add_argument("--stale-after", type=int, default=MAX_AGE // 2,
+                            help="Skip sets refreshed less than this many seconds ago (0 refreshes everything).")
+        parser.add_argument("--loop", type=int, default=0,
+                            help="Run forever, sleeping this many seconds between rounds.")
+
+    def handle(self, *args, **options):
+        if not os.getenv("JAMENDO_CLIENT_ID"):
+            raise CommandError("JAMENDO_CLIENT_ID not found in environment variables.")
+        if options["size"] < 1 or options["workers"] < 1:
+            raise CommandError("--size and --workers must be at least 1.")
+
+        while True:
+            self._round(options)
+            if not options["loop"]:
+                break
+            close_old_connections()
+            time.sleep(options["loop"])
+
+    def _combinations(self, options):
+        keywords = WarmPlaylistService.popular_keywords(options["keywords"]) if options["keywords"] else []
+        for keyword in options["extra_keywords"]:
+            if keyword.lower() not in keywords:
+                keywords.append(keyword.lower())
+        return [
+            (genre, mood, keyword)
+            for genre in ALLOWED_GENRES
+            for mood in ALLOWED_MOODS
+            for keyword in [""] + keywords
+        ]
+
+    def _round(self, options):
+        started = time.perf_counter()
+        combinations = self._combinations(options)
+
+        if options["stale_after"]:
+            fresh = set(
+                WarmPlaylist.objects.filter(
+                    size__gte=options["size"],
+                    refreshed_at__gte=timezone.now() - timedelta(seconds=options["stale_after"]),
+                ).values_list("signature", flat=True)
+            )
+            combinations = [
+                c for c in combinations
+                if WarmPlaylistService.signature([c[0]], [c[1]], [c[2]] if c[2] else []) not in fresh
+            ]
+
+        def search(genre, mood, keyword):
+            try:
+                return JamendoService.get_tracks(
+                    [genre], [mood], [keyword] if keyword else [], limit=options["size"], warm=False
+                )
+            finally:
+                close_old_connections()
+
+        stored = empty = 0
+        # Searches run on the pool; writes stay on this thread (SQLite allows one writer).
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {pool.submit(search, *combination): combination for combination in combinations}
+            for future in as_completed(futures):
+                genre, mood, keyword = futures[future]
+                try:
+                    tracks = future.result()
+                except Exception as e:
+                    self.stderr.write(f"Failed to warm {genre}/{mood}/{keyword or '-'}: {e}")
+                    continue
+                if not tracks:
+                    # Keep the previous set rather than storing an upstream failure.
+                    empty += 1
+                    continue
+                WarmPlaylistService.store(genre, mood, keyword, options["size"], tracks)
+                stored += 1
+
+        pruned = WarmPlaylistService.prune(timezone.now() - timedelta(seconds=MAX_AGE))
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {stored} playlists ({empty} empty, {pruned} expired removed) "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
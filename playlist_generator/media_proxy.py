@@ -0,0 +1,333 @@
+"""
+Caching proxy for Jamendo audio previews and album art.
+
+Upstream files are downloaded once into MEDIA_CACHE_DIR and served from
+disk afterwards (FileResponse, so the server can use sendfile). Album art
+is resized to small thumbnails with Pillow (in requirements.txt; without it
+full-size images are served and a warning is logged). The cache is
+bounded by MEDIA_CACHE_MAX_BYTES with least-recently-used eviction: every
+hit touches the file's mtime and eviction removes the oldest files first.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+from django.http import FileResponse, HttpResponse
+from dotenv import load_dotenv
+
+from . import metrics
+from .http_clients import get_session
+from .singleflight import get_singleflight
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("MEDIA_PROXY_ENABLED", "False").lower() in ("true", "1", "yes")
+CACHE_DIR = Path(os.getenv("MEDIA_CACHE_DIR", Path(__file__).resolve().parent.parent / "media_cache"))
+MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Upstream files larger than this are refused rather than cached.
+MAX_FILE_BYTES = int(os.getenv("MEDIA_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+# Only URLs on these hosts (or their subdomains) are fetched.
+ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("MEDIA_PROXY_HOSTS", "jamendo.com").split(",") if h.strip()]
+# Largest resize the art endpoint accepts (templates ask for 48px thumbnails).
+MAX_IMAGE_SIZE = 600
+TIMEOUT = float(os.getenv("MEDIA_PROXY_TIMEOUT", "15"))
+# Redirects are followed by hand so every hop is checked against ALLOWED_HOSTS.
+MAX_REDIRECTS = 5
+# Cached files never change for a given URL.
+CACHE_CONTROL = "public, max-age=604800"
+
+CACHE_METRIC = "mood_jockey_media_cache_total"
+
+PREVIEW = "preview"
+ART = "art"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class MediaError(Exception):
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+def allowed_url(url):
+    parsed = urlparse(url or "")
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and any(host == h or host.endswith(f".{h}") for h in ALLOWED_HOSTS)
+
+
+def parse_range(header, size):
+    """
+    Returns (start, end) inclusive for a single "bytes=" range, None when
+    there is no usable Range header (serve the whole file), or raises
+    ValueError for an unsatisfiable one.
+    """
+    match = _RANGE_RE.match((header or "").strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def sniff_content_type(head):
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"GIF8"):
+        return "image/gif"
+    if head.startswith(b"ID3") or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    return "application/octet-stream"
+
+
+class MediaCache:
+    """Files under `root`, named by a hash of (kind, url, size)."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Running total, recomputed by each eviction scan.
+        self._size = None
+
+    @staticmethod
+    def key(kind, url, size=None):
+        return hashlib.sha256(f"{kind}|{size or ''}|{url}".encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        # Two-level fan-out keeps directories small.
+        return self.root / key[:2] / key
+
+    def get(self, key):
+        """Path of a cached file (marking it recently used), or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, data):
+        """Writes atomically (temp file + rename) and evicts if over budget."""
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        files = []
+        for directory in self.root.iterdir() if self.root.exists() else []:
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.startswith(".tmp-"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            # Down to 90% so the next few stores don't each trigger a scan.
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                    metrics.registry.inc(CACHE_METRIC, outcome="evicted")
+                except FileNotFoundError:
+                    pass
+        self._size = total
+
+    def stats(self):
+        with self._lock:
+            if self._size is None:
+                self._evict()
+            return {"bytes": self._size, "max_bytes": self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MediaCache()
+    return _cache
+
+
+def _download(url):
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            with get_session().get(url, timeout=TIMEOUT, stream=True, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers["Location"])
+                    if not allowed_url(url):
+                        raise MediaError("Upstream redirected to a host that is not allowed")
+                    continue
+                response.raise_for_status()
+                chunks = []
+                received = 0
+                for chunk in response.iter_content(64 * 1024):
+                    received += len(chunk)
+                    if received > MAX_FILE_BYTES:
+                        raise MediaError("Upstream file too large", status=413)
+                    chunks.append(chunk)
+                return b"".join(chunks)
+        raise MediaError("Too many redirects")
+    except MediaError:
+        raise
+    except Exception as e:
+        print(f"Media Proxy Error: {e}")
+        raise MediaError("Failed to fetch media") from e
+
+
+_warned_no_pillow = False
+
+
+def _thumbnail(data, size):
+    """Fits the image into size x size as JPEG; the original bytes (with a warning) without Pillow."""
+    global _warned_no_pillow
+    try:
+        # Imported here so Pillow stays out of cold starts.
+        from PIL import Image
+    except ImportError:  # optional dependency
+        if not _warned_no_pillow:
+            _warned_no_pillow = True
+            logger.warning("Pillow is not installed: album art is served at full size instead of %spx.", size)
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=85, optimize=True)
+            return out.getvalue()
+    except Exception as e:
+        print(f"Media Proxy Error: {e}")
+        return data
+
+
+def is_cached(kind, url, size=None):
+    return get_media_cache().path(MediaCache.key(kind, url, size)).exists()
+
+
+def fetch(kind, url, size=None):
+    """
+    Returns the cached file path for a preview or (optionally resized) album
+    art URL, downloading it on a miss. Concurrent misses for the same file
+    share one download. Raises MediaError.
+    """
+    if not allowed_url(url):
+        raise MediaError("URL not allowed", status=400)
+    cache = get_media_cache()
+    key = MediaCache.key(kind, url, size)
+    path = cache.get(key)
+    if path is not None:
+        metrics.registry.inc(CACHE_METRIC, outcome="hit")
+        return path
+
+    def fill():
+        path = cache.get(key)
+        if path is not None:
+            return str(path)
+        with metrics.span("media_fetch", kind=kind):
+            data = _download(url)
+            if kind == ART and size:
+                data = _thumbnail(data, size)
+        return str(cache.store(key, data))
+
+    metrics.registry.inc(CACHE_METRIC, outcome="miss")
+    flight = get_singleflight()
+    return Path(flight.do("media", key, fill) if flight is not None else fill())
+
+
+class FileRange:
+    """Read-only view of `length` bytes of a file from `start`, for 206 responses."""
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def serve(request, path):
+    """
+    FileResponse for a cached file honouring a single-range Range header
+    (206 / 416). Whole-file responses pass the open file straight through so
+    the WSGI server can use sendfile. Raises FileNotFoundError if the file
+    was evicted in the meantime.
+    """
+    f = open(path, "rb")
+    size = os.fstat(f.fileno()).st_size
+    content_type = sniff_content_type(f.read(16))
+    f.seek(0)
+    try:
+        byte_range = parse_range(request.headers.get("Range"), size)
+    except ValueError:
+        f.close()
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(f, start, end - start + 1), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
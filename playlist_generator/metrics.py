@@ -0,0 +1,159 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram bucket upper bounds in seconds (Prometheus defaults).
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_METRIC = "mood_jockey_stage_duration_seconds"
+TRACKS_METRIC = "mood_jockey_jamendo_tracks_total"
+
+# Per-request list of finished spans, read by ServerTimingMiddleware.
+_request_spans = ContextVar("request_spans", default=None)
+# Innermost open span, so nested code can tag it (e.g. with cache status).
+_current_span = ContextVar("current_span", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Process-local metric store. Each worker exposes its own numbers."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Prometheus text exposition format."""
+        def fmt(labels):
+            return ",".join(f'{k}="{v}"' for k, v in labels)
+
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{fmt(labels + (("le", le),))}}} {cumulative}')
+            lines.append(f"{name}_sum{{{fmt(labels)}}} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{{{fmt(labels)}}} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{{{fmt(labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Span:
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = dict(labels)
+        self.results = None
+        self.duration = 0.0
+
+    def tag(self, **labels):
+        self.labels.update(labels)
+
+    @property
+    def timing_name(self):
+        tier = self.labels.get("tier")
+        return f"{self.stage}_{tier}" if tier else self.stage
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Times a pipeline stage into the stage histogram and, inside a request,
+    into its Server-Timing header. Yields the Span so callers can add labels
+    (tier, cache) or a result count once known.
+    """
+    current = Span(stage, labels)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        registry.observe(STAGE_METRIC, current.duration, stage=stage, **current.labels)
+        if current.results is not None:
+            registry.inc(TRACKS_METRIC, current.results, stage=stage, **current.labels)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(current)
+
+
+def tag(**labels):
+    """Adds labels to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.tag(**labels)
+
+
+def begin_request():
+    return _request_spans.set([])
+
+
+def end_request(token):
+    """Returns the spans recorded during the request and clears the context."""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans):
+    parts = []
+    for s in spans:
+        desc = " ".join(str(v) for v in (s.labels.get("cache"), s.results) if v is not None)
+        part = f"{s.timing_name};dur={s.duration * 1000:.1f}"
+        if desc:
+            part += f';desc="{desc}"'
+        parts.append(part)
+    return ", ".join(parts)
@@ -0,0 +1,102 @@
+import os
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import compress_string
+from dotenv import load_dotenv
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # optional dependency; gzip only
+    brotli = None
+
+load_dotenv()
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+COMPRESS_CONTENT_TYPES = {"application/json", "text/plain"}
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Adds a Server-Timing header with the pipeline spans recorded during the request."""
+
+    def finish(token, response):
+        spans = metrics.end_request(token)
+        # Streaming responses send headers before their spans finish.
+        if spans and not response.streaming:
+            response["Server-Timing"] = metrics.server_timing(spans)
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = metrics.begin_request()
+            response = await get_response(request)
+            return finish(token, response)
+    else:
+        def middleware(request):
+            token = metrics.begin_request()
+            response = get_response(request)
+            return finish(token, response)
+
+    return middleware
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    """
+    Brotli (when the brotli package is installed) or gzip for API payloads of
+    at least COMPRESS_MIN_BYTES. Only JSON/text types are compressed: HTML
+    pages carry CSRF tokens next to reflected input (BREACH), and NDJSON
+    streams must not be buffered.
+    """
+
+    def finish(request, response):
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < COMPRESS_MIN_BYTES
+            or response.get("Content-Type", "").split(";")[0].strip() not in COMPRESS_CONTENT_TYPES
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accepted = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is not None and _accepts(accepted, "br"):
+            encoding, content = "br", brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif _accepts(accepted, "gzip"):
+            encoding, content = "gzip", compress_string(response.content)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        # The bytes differ from the uncompressed entity, so the validator becomes weak.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return finish(request, await get_response(request))
+    else:
+        def middleware(request):
+            return finish(request, get_response(request))
+
+    return middleware
+
+
+def _accepts(header, encoding):
+    """True if Accept-Encoding lists `encoding` without q=0."""
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() == encoding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.1 on 2026-10-18 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0002_track_album_image_moodquery_delete_moodplaylist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MoodAnalysisCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_hash', models.CharField(max_length=40, unique=True)),
+                ('normalized_text', models.CharField(max_length=500)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-18 06:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0003_moodanalysiscache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='catalog_synced_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='listens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TrackTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('genres', 'Genre'), ('instruments', 'Instrument'), ('vartags', 'Descriptive tag')], max_length=20)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_tags', to='playlist_generator.tag')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_tags', to='playlist_generator.track')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tag', 'track'), name='unique_tag_track')],
+            },
+        ),
+    ]
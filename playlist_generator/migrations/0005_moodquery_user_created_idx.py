@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-18 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0004_catalog_tags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moodquery',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='moodquery_user_created_idx'),
+        ),
+    ]
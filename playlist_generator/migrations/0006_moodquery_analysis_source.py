@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0005_moodquery_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moodquery',
+            name='analysis_source',
+            field=models.CharField(choices=[('gemini', 'Gemini'), ('local', 'Local analyzer')], default='gemini', max_length=10),
+        ),
+    ]
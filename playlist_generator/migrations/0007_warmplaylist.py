@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0006_moodquery_analysis_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarmPlaylist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.CharField(max_length=255, unique=True)),
+                ('genre', models.CharField(max_length=50)),
+                ('mood', models.CharField(max_length=50)),
+                ('keyword', models.CharField(blank=True, default='', max_length=100)),
+                ('size', models.PositiveIntegerField()),
+                ('tracks', models.JSONField()),
+                ('refreshed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
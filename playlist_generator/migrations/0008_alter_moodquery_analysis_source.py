@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0007_warmplaylist'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='moodquery',
+            name='analysis_source',
+            field=models.CharField(choices=[('gemini', 'Gemini'), ('local', 'Local analyzer'), ('degraded', 'Local fallback (Gemini unavailable)')], default='gemini', max_length=10),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+GIN_INDEX = 'moodquery_keywords_gin'
+
+
+def create_gin_index(apps, schema_editor):
+    # jsonb_path_ops serves the @> (JSONField __contains) tag lookups; other backends skip it.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {GIN_INDEX} ON playlist_generator_moodquery '
+        'USING gin (generated_keywords jsonb_path_ops)'
+    )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {GIN_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0008_alter_moodquery_analysis_source'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moodquery',
+            index=models.Index(fields=['analysis_source', '-id'], name='moodquery_source_id_idx'),
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
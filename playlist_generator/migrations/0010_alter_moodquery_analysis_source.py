@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0009_moodquery_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='moodquery',
+            name='analysis_source',
+            field=models.CharField(choices=[('gemini', 'Gemini'), ('local', 'Local analyzer'), ('degraded', 'Local fallback (Gemini unavailable)'), ('similar', 'Similar past query')], default='gemini', max_length=10),
+        ),
+    ]
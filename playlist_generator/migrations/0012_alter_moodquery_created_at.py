@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlist_generator', '0011_playlistjob'),
+    ]
+
+    # MoodQuery.created_at: auto_now_add -> default=timezone.now, so history
+    # imports (history_io) can set the original time. Existing rows are
+    # untouched; only explicitly passed values are now kept on insert.
+    operations = [
+        migrations.AlterField(
+            model_name='moodquery',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Track(models.Model):
     title = models.CharField(max_length=255)
@@ -7,16 +8,136 @@ class Track(models.Model):
     preview_url = models.URLField()
     jamendo_id = models.CharField(max_length=50, unique=True)
     album_image = models.URLField(blank=True, null=True)
+    # Local catalog fields, filled by the ingest_catalog command.
+    listens = models.PositiveIntegerField(default=0)
+    catalog_synced_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"{self.title} by {self.artist}"
 
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+class TrackTag(models.Model):
+    """Inverted tag -> track index built from Jamendo musicinfo."""
+    KIND_CHOICES = [
+        ('genres', 'Genre'),
+        ('instruments', 'Instrument'),
+        ('vartags', 'Descriptive tag'),
+    ]
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='track_tags')
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='track_tags')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'track'], name='unique_tag_track'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag.name} -> {self.track_id}"
+
 class MoodQuery(models.Model):
+    SOURCE_CHOICES = [
+        ('gemini', 'Gemini'),
+        ('local', 'Local analyzer'),
+        ('degraded', 'Local fallback (Gemini unavailable)'),
+        ('similar', 'Similar past query'),
+    ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="queries")
     user_input = models.CharField(max_length=500)
     generated_keywords = models.JSONField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Which path produced generated_keywords (see mood_analyzer.resolve_mood).
+    analysis_source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='gemini')
+    # default=timezone.now rather than auto_now_add (since migration 0012) so
+    # history imports can keep the original times. Contract change: an
+    # explicit created_at passed to create()/save() is now kept instead of
+    # overwritten. The field is still editable=False, so forms and the admin
+    # never set it.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     tracks = models.ManyToManyField(Track, related_name='mood_queries')
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's history on (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='moodquery_user_created_idx'),
+            # Local analyzer training reads the newest rows of one source
+            models.Index(fields=['analysis_source', '-id'], name='moodquery_source_id_idx'),
+        ]
+        # PostgreSQL also gets a GIN index on generated_keywords (migration 0009).
+
     def __str__(self):
         return f"Query by {self.user.username} at {self.created_at}"
+
+class MoodAnalysisCache(models.Model):
+    """Cached Gemini mood analyses keyed on normalized user input."""
+    key_hash = models.CharField(max_length=40, unique=True)
+    normalized_text = models.CharField(max_length=500)
+    result = models.JSONField()
+    created_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.normalized_text
+
+class WarmPlaylist(models.Model):
+    """Precomputed get_tracks result for one genre/mood(/keyword) combination."""
+    signature = models.CharField(max_length=255, unique=True)
+    genre = models.CharField(max_length=50)
+    mood = models.CharField(max_length=50)
+    keyword = models.CharField(max_length=100, blank=True, default='')
+    # The limit the tracks were searched with; answers any request up to it.
+    size = models.PositiveIntegerField()
+    tracks = models.JSONField()
+    refreshed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.signature
+
+class PlaylistJob(models.Model):
+    """Queued playlist generation, run by jobs.JobWorker (see `manage.py run_jobs`)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='playlist_jobs')
+    user_input = models.CharField(max_length=500)
+    # Hash of user + normalized input; at most one queued/running job per key.
+    dedup_key = models.CharField(max_length=40)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Pipeline step the job is in (or failed at): analysis, tracks, persist.
+    stage = models.CharField(max_length=20, blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True, default='')
+    mood_query = models.ForeignKey(MoodQuery, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Not claimed before this time (retry backoff).
+    run_after = models.DateTimeField()
+    # Lease of the worker running the job; once expired another worker may take it over.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest due job of a status
+            models.Index(fields=['status', 'run_after'], name='playlistjob_claim_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='playlistjob_active_dedup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}) by {self.user_id}"
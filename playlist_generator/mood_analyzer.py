@@ -0,0 +1,353 @@
+"""
+Local mood analysis in front of Gemini.
+
+LocalMoodAnalyzer resolves inputs that name our tags directly ("energetic
+rock", "sad jazz for the rain") with a synonym lexicon, backed by a small
+token -> tag classifier trained on the analyses Gemini produced for past
+MoodQuery rows. Only when it is not confident does resolve_mood fall back
+to GeminiService. Every result carries its source ("local" or "gemini"),
+which is stored on the MoodQuery. When Gemini fails (e.g. its circuit
+breaker is open) any tags the analyzer did recognise are used anyway,
+with source "degraded".
+"""
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from dotenv import load_dotenv
+
+from . import metrics
+from .ai_service import ALLOWED_GENRES, ALLOWED_MOODS, GeminiService
+from .mood_cache import normalize_text
+
+load_dotenv()
+
+ENABLED = os.getenv("LOCAL_ANALYZER_ENABLED", "True").lower() in ("true", "1", "yes")
+# Minimum confidence (0-1) for the local result to be used instead of Gemini.
+THRESHOLD = float(os.getenv("LOCAL_ANALYZER_THRESHOLD", "0.8"))
+# Past queries a token must appear in before the classifier trusts it.
+MIN_SUPPORT = int(os.getenv("LOCAL_ANALYZER_MIN_SUPPORT", "3"))
+RETRAIN_SECONDS = int(os.getenv("LOCAL_ANALYZER_RETRAIN_SECONDS", "3600"))
+TRAINING_ROWS = int(os.getenv("LOCAL_ANALYZER_TRAINING_ROWS", "5000"))
+
+SOURCE_LOCAL = "local"
+SOURCE_GEMINI = "gemini"
+SOURCE_DEGRADED = "degraded"
+SOURCE_METRIC = "mood_jockey_analysis_source_total"
+
+# Canonical tag -> words that name it.
+GENRE_SYNONYMS = {
+    "pop": ["pop", "poppy", "mainstream", "catchy"],
+    "rock": ["rock", "punk", "grunge", "guitar"],
+    "electronic": ["electronic", "electro", "edm", "techno", "house", "trance", "synth", "dance", "club"],
+    "hiphop": ["hiphop", "rap", "trap"],
+    "jazz": ["jazz", "jazzy", "swing", "bebop", "saxophone", "sax"],
+    "indie": ["indie"],
+    "classical": ["classical", "orchestra", "orchestral", "symphony", "piano", "violin", "baroque"],
+    "ambient": ["ambient", "atmospheric", "soundscape", "drone"],
+    "chillout": ["chillout", "lofi", "downtempo", "chillhop", "lounge"],
+    "metal": ["metal", "metalcore", "thrash"],
+    "acoustic": ["acoustic", "unplugged", "folk"],
+    "rnb": ["rnb", "soul"],
+}
+MOOD_SYNONYMS = {
+    "happy": ["happy", "cheerful", "joyful", "fun", "sunny", "sunshine"],
+    "sad": ["sad", "unhappy", "heartbroken", "heartbreak", "cry", "crying", "depressed", "lonely", "breakup"],
+    "chill": ["chill", "chilled", "chilling", "laidback", "mellow"],
+    "energetic": ["energetic", "energy", "hype", "pumped", "upbeat", "aggressive", "intense"],
+    "relax": ["relax", "relaxing", "relaxed", "unwind", "soothing"],
+    "dark": ["dark", "gloomy", "spooky", "creepy", "sinister"],
+    "romantic": ["romantic", "romance", "love", "valentine"],
+    "uplifting": ["uplifting", "inspiring", "motivational", "motivation", "hopeful", "positive"],
+    "calm": ["calm", "peaceful", "quiet", "serene", "tranquil", "meditation", "meditate"],
+    "heavy": ["heavy", "loud", "angry", "rage"],
+    "focus": ["focus", "focused", "concentrate", "concentration", "productive"],
+    "melancholic": ["melancholic", "melancholy", "nostalgic", "bittersweet", "wistful"],
+}
+# Setting/activity keyword -> words that name it.
+KEYWORD_SYNONYMS = {
+    "study": ["study", "studying", "homework", "exam", "exams", "finals"],
+    "workout": ["workout", "gym", "exercise", "training", "running", "run", "lifting", "cardio"],
+    "rain": ["rain", "rainy", "raining", "storm", "thunderstorm"],
+    "party": ["party", "partying", "celebration", "celebrate"],
+    "sleep": ["sleep", "sleeping", "bedtime", "asleep", "insomnia"],
+    "drive": ["drive", "driving", "roadtrip", "car"],
+    "night": ["night", "tonight", "midnight", "latenight"],
+    "morning": ["morning", "sunrise", "breakfast"],
+    "coffee": ["coffee", "cafe"],
+    "summer": ["summer", "beach"],
+    "coding": ["coding", "programming", "code"],
+    "reading": ["reading", "book"],
+    "cooking": ["cooking", "dinner", "kitchen"],
+    "yoga": ["yoga", "stretching"],
+    "gaming": ["gaming", "game", "games"],
+    "travel": ["travel", "traveling", "journey", "trip"],
+}
+# Multi-word spellings folded into one token before tokenizing.
+PHRASES = {
+    r"hip\s+hop": "hiphop",
+    r"lo\s+fi": "lofi",
+    r"r\s*&\s*b|r\s+and\s+b": "rnb",
+    r"road\s+trip": "roadtrip",
+    r"late\s+night": "latenight",
+    r"heavy\s+metal": "metal",
+    r"chill\s+out": "chillout",
+    r"laid\s+back": "laidback",
+}
+# Filler that says nothing about the music; ignored when measuring coverage.
+FILLER = {
+    "vibe", "vibes", "feel", "feeling", "mood", "really", "very", "just", "like",
+    "kind", "sort", "bit", "little", "today", "now", "time", "get", "good", "nice",
+    "beat", "beats", "tune", "tunes", "sound", "sounds",
+}
+
+
+def _index(synonyms):
+    """Maps each normalized synonym token to its canonical label."""
+    return {
+        token: label
+        for label, words in synonyms.items()
+        for word in words
+        for token in normalize_text(word).split()
+    }
+
+
+_GENRE_INDEX = _index(GENRE_SYNONYMS)
+_MOOD_INDEX = _index(MOOD_SYNONYMS)
+_KEYWORD_INDEX = _index(KEYWORD_SYNONYMS)
+_FILLER = set(normalize_text(" ".join(FILLER)).split())
+
+FIELDS = ("genres", "moods", "keywords")
+
+
+def tokenize(text):
+    text = (text or "").lower()
+    for pattern, token in PHRASES.items():
+        text = re.sub(rf"\b(?:{pattern})\b", token, text)
+    return normalize_text(text).split()
+
+
+class TagClassifier:
+    """
+    Token -> tag associations learned from past Gemini analyses. A label's
+    score is the noisy-OR of P(label | token) over the input's tokens, with
+    add-one smoothing so rare tokens cannot reach full confidence.
+    """
+
+    def __init__(self, min_support=MIN_SUPPORT):
+        self.min_support = min_support
+        self.token_counts = Counter()
+        self.label_counts = defaultdict(Counter)
+        self.trained_at = 0.0
+        self.samples = 0
+
+    def fit(self, rows):
+        """rows: iterable of (user_input, generated_keywords)."""
+        for user_input, analysis in rows:
+            if not isinstance(analysis, dict):
+                continue
+            labels = [
+                (field, str(label).lower())
+                for field in FIELDS
+                for label in analysis.get(field) or []
+            ]
+            if not labels:
+                continue
+            self.samples += 1
+            for token in set(tokenize(user_input)):
+                self.token_counts[token] += 1
+                self.label_counts[token].update(labels)
+        self.trained_at = time.time()
+        return self
+
+    def knows(self, token):
+        return self.token_counts[token] >= self.min_support
+
+    def scores(self, tokens):
+        """Returns {field: {label: score}} for the known tokens."""
+        misses = defaultdict(lambda: 1.0)
+        for token in tokens:
+            if not self.knows(token):
+                continue
+            total = self.token_counts[token] + 1
+            for (field, label), count in self.label_counts[token].items():
+                misses[(field, label)] *= 1 - count / total
+        result = {field: {} for field in FIELDS}
+        for (field, label), miss in misses.items():
+            result[field][label] = 1 - miss
+        return result
+
+
+class LocalMoodAnalyzer:
+    """
+    Lexicon lookups score 1.0; the classifier fills in what the lexicon
+    misses. Confidence is the weaker of the best genre and best mood score,
+    scaled by the share of meaningful tokens either source recognised, so
+    long free-form descriptions still go to Gemini.
+    """
+
+    def __init__(self, threshold=THRESHOLD, retrain_seconds=RETRAIN_SECONDS, training_rows=TRAINING_ROWS):
+        self.threshold = threshold
+        self.retrain_seconds = retrain_seconds
+        self.training_rows = training_rows
+        self.classifier = None
+        self._lock = threading.Lock()
+
+    def _training_rows(self):
+        from .models import MoodQuery
+
+        # Only Gemini's answers: training on our own output would just echo the lexicon.
+        return (
+            MoodQuery.objects.filter(analysis_source=SOURCE_GEMINI, generated_keywords__isnull=False)
+            .order_by("-id")
+            .values_list("user_input", "generated_keywords")[:self.training_rows]
+        )
+
+    def train(self):
+        try:
+            classifier = TagClassifier().fit(self._training_rows())
+        except Exception as e:
+            print(f"Local Analyzer Error: {e}")
+            # Lexicon-only until the next retrain attempt.
+            classifier = TagClassifier().fit([])
+        self.classifier = classifier
+        return classifier
+
+    def get_classifier(self):
+        classifier = self.classifier
+        if classifier is None or time.time() - classifier.trained_at > self.retrain_seconds:
+            with self._lock:
+                classifier = self.classifier
+                if classifier is None or time.time() - classifier.trained_at > self.retrain_seconds:
+                    classifier = self.train()
+        return classifier
+
+    def score(self, user_input):
+        """Returns (analysis, confidence); analysis is None when nothing was recognised."""
+        tokens = [t for t in tokenize(user_input) if t not in _FILLER]
+        if not tokens:
+            return None, 0.0
+        classifier = self.get_classifier()
+        learned = classifier.scores(tokens)
+
+        scores = {field: dict(learned[field]) for field in FIELDS}
+        for field, index in (("genres", _GENRE_INDEX), ("moods", _MOOD_INDEX), ("keywords", _KEYWORD_INDEX)):
+            for token in tokens:
+                if token in index:
+                    scores[field][index[token]] = 1.0
+        # Gemini is steered to these tags; the search depends on them.
+        scores["genres"] = {k: v for k, v in scores["genres"].items() if k in ALLOWED_GENRES}
+        scores["moods"] = {k: v for k, v in scores["moods"].items() if k in ALLOWED_MOODS}
+
+        analysis = {
+            field: [label for label, s in sorted(scores[field].items(), key=lambda x: -x[1]) if s >= 0.5][:2]
+            for field in FIELDS
+        }
+        if not analysis["genres"] and not analysis["moods"]:
+            return None, 0.0
+
+        recognised = sum(
+            1 for t in tokens
+            if t in _GENRE_INDEX or t in _MOOD_INDEX or t in _KEYWORD_INDEX or classifier.knows(t)
+        )
+        best = [max(scores[field].values(), default=0.0) for field in ("genres", "moods")]
+        return analysis, min(best) * recognised / len(tokens)
+
+    def analyze(self, user_input):
+        """Returns an analyze_mood-shaped dict, or None if confidence is below the threshold."""
+        analysis, confidence = self.score(user_input)
+        if analysis is None or confidence < self.threshold:
+            return None
+        return analysis
+
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def _get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = LocalMoodAnalyzer()
+    return _analyzer
+
+
+def get_local_analyzer():
+    """Returns the process-wide LocalMoodAnalyzer, or None when LOCAL_ANALYZER_ENABLED is off."""
+    if not ENABLED:
+        return None
+    return _get_analyzer()
+
+
+def _analyze_local(user_input):
+    analyzer = get_local_analyzer()
+    if analyzer is None:
+        return None
+    with metrics.span("analyze_local") as span:
+        result = analyzer.analyze(user_input)
+        span.tag(outcome="hit" if result is not None else "miss")
+    return result
+
+
+def _degrade(user_input, analysis):
+    """
+    Gemini's answer, or when it failed, the local analyzer's best guess at
+    any confidence (even with LOCAL_ANALYZER_ENABLED off). Returns (analysis, source).
+    """
+    if "error" not in analysis:
+        return analysis, SOURCE_GEMINI
+    guess, _ = _get_analyzer().score(user_input)
+    if guess is None:
+        return analysis, SOURCE_GEMINI
+    return guess, SOURCE_DEGRADED
+
+
+def resolve_mood(user_input):
+    """
+    Local analyzer first, Gemini only when it is not confident.
+    Returns (analysis, source) where analysis is shaped like
+    GeminiService.analyze_mood's return value.
+    """
+    result = _analyze_local(user_input)
+    if result is not None:
+        metrics.registry.inc(SOURCE_METRIC, source=SOURCE_LOCAL)
+        return result, SOURCE_LOCAL
+    result, source = _degrade(user_input, GeminiService.analyze_mood(user_input))
+    metrics.registry.inc(SOURCE_METRIC, source=source)
+    return result, source
+
+
+async def resolve_mood_async(user_input):
+    """Async resolve_mood; the local pass may (re)train from the DB, so it runs on a thread."""
+    result = await sync_to_async(_analyze_local)(user_input)
+    if result is not None:
+        metrics.registry.inc(SOURCE_METRIC, source=SOURCE_LOCAL)
+        return result, SOURCE_LOCAL
+    analysis = await GeminiService.analyze_mood_async(user_input)
+    result, source = await sync_to_async(_degrade)(user_input, analysis)
+    metrics.registry.inc(SOURCE_METRIC, source=source)
+    return result, source
+
+
+def resolve_moods_batch(user_inputs, chunk_size=None):
+    """Batch resolve_mood: only the inputs the local analyzer can't answer go to Gemini."""
+    results = [None] * len(user_inputs)
+    remaining = []
+    for i, user_input in enumerate(user_inputs):
+        result = _analyze_local(user_input)
+        if result is not None:
+            results[i] = (result, SOURCE_LOCAL)
+        else:
+            remaining.append(i)
+    if remaining:
+        analyses = GeminiService.analyze_moods_batch([user_inputs[i] for i in remaining], chunk_size)
+        for i, analysis in zip(remaining, analyses):
+            results[i] = _degrade(user_inputs[i], analysis)
+    for _, source in results:
+        metrics.registry.inc(SOURCE_METRIC, source=source)
+    return results
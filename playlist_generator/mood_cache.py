@@ -0,0 +1,375 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which store backs the cache: "memory", "django", "database" or "none".
+BACKEND = os.getenv("MOOD_CACHE_BACKEND", "memory").lower()
+TTL = int(os.getenv("MOOD_CACHE_TTL", "86400"))
+MAX_ENTRIES = int(os.getenv("MOOD_CACHE_MAX_ENTRIES", "2048"))
+# Minimum shingle Jaccard similarity for a near-duplicate hit. 0 disables it.
+SIMILARITY = float(os.getenv("MOOD_CACHE_SIMILARITY", "0.75"))
+DJANGO_CACHE_ALIAS = os.getenv("MOOD_CACHE_DJANGO_ALIAS", "default")
+# The database backend records a read in last_used_at at most this often per entry.
+TOUCH_INTERVAL = int(os.getenv("MOOD_CACHE_TOUCH_INTERVAL", "300"))
+# How often a worker reloads its near-duplicate index from a shared (database) backend.
+INDEX_REFRESH = int(os.getenv("MOOD_CACHE_INDEX_REFRESH", "60"))
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "for", "to", "of", "in", "on", "at", "with",
+    "while", "some", "something", "me", "my", "i", "im", "am", "is", "it",
+    "need", "want", "give", "play", "please", "music", "song", "songs",
+    "track", "tracks", "playlist",
+}
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Inputs with these only ever get exact hits: "happy not sad" must not
+# borrow the analysis of "sad, not happy", whose tokens are the same.
+_NEGATIONS = {"not", "no", "never", "without", "nothing", "nor", "dont", "doesnt", "isnt", "arent", "cant", "wont"}
+
+
+def _stem(token):
+    """Very light suffix stripping so "studying"/"study" and "beats"/"beat" match."""
+    if len(token) > 5 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def normalize_text(text):
+    """
+    Reduces user input to a canonical key: lowercase, hyphens and apostrophes
+    joined ("lo-fi" -> "lofi"), stopwords dropped, tokens stemmed and
+    deduplicated. Word order is kept, so it still carries negation scope.
+    """
+    text = re.sub(r"['’-]", "", (text or "").lower())
+    tokens = dict.fromkeys(_stem(t) for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS)
+    return " ".join(tokens)
+
+
+def token_bag(key):
+    """A normalized key's tokens sorted, for order-insensitive matching."""
+    return " ".join(sorted(key.split()))
+
+
+def _negated(key):
+    return not _NEGATIONS.isdisjoint(key.split())
+
+
+def _shingles(key, size=3):
+    padded = f" {key} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def _hash_key(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class InMemoryBackend:
+    """Per-process LRU store with TTL. Thread-safe."""
+
+    name = "memory"
+
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """Stores entries in a Django cache alias; eviction is left to that cache."""
+
+    name = "django"
+
+    def __init__(self, alias=DJANGO_CACHE_ALIAS, ttl=TTL):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.cache.get(f"mood_cache:{_hash_key(key)}")
+
+    def set(self, key, value):
+        self.cache.set(f"mood_cache:{_hash_key(key)}", value, timeout=self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class DatabaseBackend:
+    """
+    Stores entries in the MoodAnalysisCache table (SQLite by default), shared
+    by all workers. Least recently used rows are pruned above max_entries;
+    last_used_at is only rewritten once it is touch_interval seconds old, so
+    hot entries do not cost a write per read.
+    """
+
+    name = "database"
+
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES, touch_interval=TOUCH_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+
+    def get(self, key):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .models import MoodAnalysisCache
+
+        now = timezone.now()
+        entry = MoodAnalysisCache.objects.filter(key_hash=_hash_key(key)).first()
+        if entry is None:
+            return None
+        if entry.created_at < now - timedelta(seconds=self.ttl):
+            entry.delete()
+            return None
+        if entry.last_used_at < now - timedelta(seconds=self.touch_interval):
+            MoodAnalysisCache.objects.filter(pk=entry.pk).update(last_used_at=now)
+        return entry.result
+
+    def keys(self, limit):
+        """The `limit` most recently used unexpired keys, for the near-duplicate index."""
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .models import MoodAnalysisCache
+
+        return list(
+            MoodAnalysisCache.objects.filter(created_at__gte=timezone.now() - timedelta(seconds=self.ttl))
+            .order_by("-last_used_at")
+            .values_list("normalized_text", flat=True)[:limit]
+        )
+
+    def set(self, key, value):
+        from django.utils import timezone
+
+        from .models import MoodAnalysisCache
+
+        now = timezone.now()
+        MoodAnalysisCache.objects.update_or_create(
+            key_hash=_hash_key(key),
+            defaults={
+                "normalized_text": key[:500],
+                "result": value,
+                "created_at": now,
+                "last_used_at": now,
+            },
+        )
+        stale = MoodAnalysisCache.objects.order_by("-last_used_at").values_list("pk", flat=True)[self.max_entries:]
+        stale_ids = list(stale)
+        if stale_ids:
+            MoodAnalysisCache.objects.filter(pk__in=stale_ids).delete()
+
+    def clear(self):
+        from .models import MoodAnalysisCache
+
+        MoodAnalysisCache.objects.all().delete()
+
+
+class ShingleIndex:
+    """
+    In-process near-duplicate index over normalized keys: an inverted
+    token index narrows the candidates, character 3-gram Jaccard over each
+    key's token bag (so word order does not matter) picks the best.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._shingles = OrderedDict()
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            if key in self._shingles:
+                self._shingles.move_to_end(key)
+                return
+            self._shingles[key] = _shingles(token_bag(key))
+            for token in key.split():
+                self._postings.setdefault(token, set()).add(key)
+            while len(self._shingles) > self.max_entries:
+                self._remove(next(iter(self._shingles)))
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._shingles:
+                self._remove(key)
+
+    def _remove(self, key):
+        del self._shingles[key]
+        for token in key.split():
+            keys = self._postings.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[token]
+
+    def nearest(self, key, threshold):
+        """Returns (best_key, score) above threshold, or (None, 0.0)."""
+        query = _shingles(token_bag(key))
+        best_key, best_score = None, 0.0
+        with self._lock:
+            candidates = set()
+            for token in key.split():
+                candidates |= self._postings.get(token, set())
+            for candidate in candidates:
+                other = self._shingles[candidate]
+                score = len(query & other) / len(query | other)
+                if score > best_score:
+                    best_key, best_score = candidate, score
+        if best_score >= threshold:
+            return best_key, best_score
+        return None, 0.0
+
+    def clear(self):
+        with self._lock:
+            self._shingles.clear()
+            self._postings.clear()
+
+    def load(self, keys):
+        """Adds keys oldest first, so the most recently used survive eviction."""
+        for key in reversed(keys):
+            if not _negated(key):
+                self.add(key)
+
+
+class MoodCache:
+    """
+    Exact + near-duplicate cache in front of GeminiService.analyze_mood.
+
+    The near-duplicate index lives in each process. With the database
+    backend it is reloaded from the table every index_refresh seconds, so
+    workers agree on fuzzy hits within that window; the django backend cannot
+    list its keys, so there each worker only knows the keys it has seen.
+    """
+
+    def __init__(self, backend, similarity=SIMILARITY, index_refresh=INDEX_REFRESH):
+        self.backend = backend
+        self.similarity = similarity
+        self.index_refresh = index_refresh
+        self.index = ShingleIndex()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0}
+        self._index_loaded_at = None
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _refresh_index(self):
+        if not hasattr(self.backend, "keys"):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._index_loaded_at is not None and now - self._index_loaded_at < self.index_refresh:
+                return
+            self._index_loaded_at = now
+        self.index.load(self.backend.keys(self.index.max_entries))
+
+    def get(self, user_input):
+        key = normalize_text(user_input)
+        if not key:
+            return None
+        try:
+            value = self.backend.get(key)
+            if value is not None:
+                if not _negated(key):
+                    self.index.add(key)
+                self._count("hits")
+                return dict(value)
+            if self.similarity > 0 and not _negated(key):
+                self._refresh_index()
+                near_key, _ = self.index.nearest(key, self.similarity)
+                if near_key is not None:
+                    value = self.backend.get(near_key)
+                    if value is not None:
+                        self._count("near_hits")
+                        return dict(value)
+                    self.index.discard(near_key)
+        except Exception as e:
+            print(f"Mood Cache Error: {e}")
+        self._count("misses")
+        return None
+
+    def set(self, user_input, value):
+        key = normalize_text(user_input)
+        if not key:
+            return
+        try:
+            self.backend.set(key, value)
+            if not _negated(key):
+                self.index.add(key)
+        except Exception as e:
+            print(f"Mood Cache Error: {e}")
+
+    def clear(self):
+        self.backend.clear()
+        self.index.clear()
+        with self._lock:
+            self._index_loaded_at = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["near_hits"]) / lookups, 4) if lookups else 0.0
+        stats["backend"] = self.backend.name
+        return stats
+
+
+BACKENDS = {
+    "memory": InMemoryBackend,
+    "django": DjangoCacheBackend,
+    "database": DatabaseBackend,
+}
+
+_mood_cache = None
+_mood_cache_lock = threading.Lock()
+
+
+def get_mood_cache():
+    """Returns the process-wide MoodCache, or None when MOOD_CACHE_BACKEND=none."""
+    global _mood_cache
+    if BACKEND not in BACKENDS:
+        return None
+    if _mood_cache is None:
+        with _mood_cache_lock:
+            if _mood_cache is None:
+                _mood_cache = MoodCache(BACKENDS[BACKEND]())
+    return _mood_cache
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from .history import TRACK_FIELDS
+from .models import MoodQuery, Track, TrackTag
+
+# history.TRACK_FIELDS plus the Jamendo id the rows are keyed on.
+TRACK_ROW_FIELDS = ("jamendo_id", *TRACK_FIELDS)
+
+
+@contextmanager
+def count_queries():
+    """
+    Counts queries run on the default connection inside the block.
+    Yields a dict whose "count" is updated live; works with DEBUG off.
+    """
+    counter = {"count": 0}
+
+    def wrapper(execute, sql, params, many, context):
+        counter["count"] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield counter
+
+
+@transaction.atomic
+def save_mood_query(user, user_input, ai_response, jamendo_tracks, analysis_source="gemini"):
+    """
+    Persists a generated playlist in a constant number of queries:
+    one lookup of known jamendo_ids, one bulk insert of new tracks, one
+    bulk insert into the M2M through table. Returns (mood_query, track dicts)
+    with the tracks in jamendo_tracks order.
+    """
+    mood_query = MoodQuery.objects.create(
+        user=user,
+        user_input=user_input,
+        generated_keywords=ai_response,
+        analysis_source=analysis_source,
+    )
+
+    by_jamendo_id = {}
+    for track_data in jamendo_tracks:
+        by_jamendo_id.setdefault(str(track_data['id']), track_data)
+    rows = upsert_tracks(by_jamendo_id)
+
+    Through = MoodQuery.tracks.through
+    Through.objects.bulk_create(
+        [Through(moodquery_id=mood_query.id, track_id=rows[jamendo_id]['id']) for jamendo_id in by_jamendo_id],
+        ignore_conflicts=True,
+    )
+
+    return mood_query, [rows[jamendo_id] for jamendo_id in by_jamendo_id]
+
+
+def upsert_tracks(by_jamendo_id):
+    """
+    Makes sure a Track row exists for every {jamendo_id: track data} entry
+    (title, artist, preview_url, album_image) in two or three queries.
+    Returns {jamendo_id: TRACK_ROW_FIELDS row}.
+    """
+    rows = {
+        row['jamendo_id']: row
+        for row in Track.objects.filter(jamendo_id__in=list(by_jamendo_id)).values(*TRACK_ROW_FIELDS)
+    }
+    missing = [jamendo_id for jamendo_id in by_jamendo_id if jamendo_id not in rows]
+    if missing:
+        Track.objects.bulk_create(
+            [
+                Track(
+                    jamendo_id=jamendo_id,
+                    title=by_jamendo_id[jamendo_id]['title'],
+                    artist=by_jamendo_id[jamendo_id]['artist'],
+                    preview_url=by_jamendo_id[jamendo_id]['preview_url'],
+                    album_image=by_jamendo_id[jamendo_id].get('album_image', ''),
+                )
+                for jamendo_id in missing
+            ],
+            ignore_conflicts=True,
+        )
+        # Re-read instead of trusting returned pks: rows may have been created concurrently.
+        rows.update(
+            (row['jamendo_id'], row)
+            for row in Track.objects.filter(jamendo_id__in=missing).values(*TRACK_ROW_FIELDS)
+        )
+    return rows
+
+
+def load_query_tracks(query_ids, limit):
+    """
+    Tracks saved with the given queries (best first), shaped like
+    JamendoService._parse_item output so they can be ranked and saved again.
+    Catalog tags are included for tracks the ingest has indexed. Three queries.
+    """
+    rank = {query_id: i for i, query_id in enumerate(query_ids)}
+    order = {}
+    for query_id, track_id in MoodQuery.tracks.through.objects.filter(
+        moodquery_id__in=rank
+    ).values_list("moodquery_id", "track_id"):
+        order[track_id] = min(order.get(track_id, len(rank)), rank[query_id])
+    rows = sorted(
+        Track.objects.filter(id__in=order).values(*TRACK_ROW_FIELDS),
+        key=lambda row: (order[row["id"]], row["id"]),
+    )[:limit]
+
+    tags = {row["id"]: {} for row in rows}
+    for track_id, kind, name in TrackTag.objects.filter(track_id__in=tags).values_list("track_id", "kind", "tag__name"):
+        tags[track_id].setdefault(kind, []).append(name)
+    return [
+        {
+            "id": row["jamendo_id"],
+            "title": row["title"],
+            "artist": row["artist"],
+            "preview_url": row["preview_url"],
+            "album_image": row["album_image"],
+            "tags": tags[row["id"]],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,287 @@
+"""
+Nearest-neighbour index over past MoodQuery inputs.
+
+Inputs are embedded on the CPU with signed feature hashing of their
+normalized words and character trigrams (see embed), so similar phrasings
+("rainy day jazz to study" / "studying jazz on a rainy day") land close
+together without any model download. Vectors live in one memory-mapped
+file shared by every worker process: a small header, the query ids, then
+the float32 vectors. Searches are a single matrix-vector product over the
+mapped rows. NumPy is only imported once the index is used.
+
+Queries are added and tombstoned as MoodQuery rows are created and deleted
+(see signals.py). Rows written without model signals (bulk_create, which
+history imports use, or raw SQL) never reach the index:
+`manage.py build_query_index` rebuilds the file from the database, picking
+them up and dropping the tombstones. When a new input is close enough to
+the same user's past ones, find_similar answers it with their analysis and
+saved tracks, skipping both Gemini and Jamendo. Other users' history is
+never used.
+"""
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from . import metrics, ranking
+from .mood_cache import normalize_text, token_bag
+from .models import MoodQuery
+from .persistence import load_query_tracks
+
+load_dotenv()
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within a process
+    fcntl = None
+
+ENABLED = os.getenv("QUERY_INDEX_ENABLED", "False").lower() in ("true", "1", "yes")
+PATH = Path(os.getenv("QUERY_INDEX_PATH", Path(__file__).resolve().parent.parent / "query_index.bin"))
+DIM = int(os.getenv("QUERY_INDEX_DIM", "512"))
+# Minimum cosine similarity for a past query to answer a new input.
+THRESHOLD = float(os.getenv("QUERY_INDEX_THRESHOLD", "0.9"))
+# Past queries whose tracks are pooled into the answer.
+NEIGHBOURS = int(os.getenv("QUERY_INDEX_NEIGHBOURS", "5"))
+# Nearest rows (of every user) read per lookup before keeping the caller's own.
+CANDIDATES = int(os.getenv("QUERY_INDEX_CANDIDATES", "200"))
+
+INITIAL_CAPACITY = 1024
+SIMILAR_METRIC = "mood_jockey_similar_queries_total"
+# MoodQuery.analysis_source of playlists answered from the index.
+SOURCE_SIMILAR = "similar"
+
+# Header slots (int64).
+_MAGIC, _DIM, _CAPACITY, _COUNT, _STALE = range(5)
+_HEADER_SLOTS = 8
+_HEADER_BYTES = _HEADER_SLOTS * 8
+_MAGIC_VALUE = 0x4D4A5149  # "MJQI"
+
+# Whole words say more than their trigrams.
+_WORD_WEIGHT = 1.0
+_TRIGRAM_WEIGHT = 0.5
+
+
+def embed(text, dim=DIM):
+    """L2-normalized float32 vector of `text` (all zeros if nothing is left after normalizing)."""
+    import numpy as np
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in token_bag(normalize_text(text)).split():
+        features = [(word, _WORD_WEIGHT)]
+        padded = f"<{word}>"
+        features.extend((padded[i:i + 3], _TRIGRAM_WEIGHT) for i in range(len(padded) - 2))
+        for feature, weight in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            # Low bits pick the slot, one high bit the sign, so collisions cancel out on average.
+            vector[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+class QueryIndex:
+    """
+    Append-only vector file with tombstones. Writers (add/remove/rebuild)
+    take an exclusive file lock; readers only check the header, so searches
+    never block. Growing or rebuilding writes a new file, swaps it in with
+    os.replace and flags the old one stale so other processes remap.
+    """
+
+    def __init__(self, path=PATH, dim=DIM):
+        self.path = Path(path)
+        self.dim = dim
+        self._header = self._ids = self._vectors = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+
+    # --- file handling ---
+
+    def _layout(self, capacity):
+        ids_bytes = capacity * 8
+        return _HEADER_BYTES, _HEADER_BYTES + ids_bytes, _HEADER_BYTES + ids_bytes + capacity * self.dim * 4
+
+    def _create(self, path, capacity):
+        import numpy as np
+        _, _, size = self._layout(capacity)
+        with open(path, "wb") as f:
+            f.truncate(size)
+        header = np.memmap(path, dtype=np.int64, mode="r+", shape=(_HEADER_SLOTS,))
+        header[_MAGIC] = _MAGIC_VALUE
+        header[_DIM] = self.dim
+        header[_CAPACITY] = capacity
+        header[_COUNT] = 0
+        header.flush()
+        del header
+
+    def _map(self):
+        import numpy as np
+        if not self.path.exists():
+            with self._file_lock():
+                if not self.path.exists():
+                    self._create(self.path, INITIAL_CAPACITY)
+        header = np.memmap(self.path, dtype=np.int64, mode="r+", shape=(_HEADER_SLOTS,))
+        if header[_MAGIC] != _MAGIC_VALUE or header[_DIM] != self.dim:
+            raise ValueError(f"{self.path} is not a {self.dim}-dimension query index; run build_query_index")
+        capacity = int(header[_CAPACITY])
+        ids_at, vectors_at, _ = self._layout(capacity)
+        self._header = header
+        self._ids = np.memmap(self.path, dtype=np.int64, mode="r+", offset=ids_at, shape=(capacity,))
+        self._vectors = np.memmap(self.path, dtype=np.float32, mode="r+", offset=vectors_at, shape=(capacity, self.dim))
+
+    def _current(self):
+        if self._header is None or self._header[_STALE]:
+            with self._lock:
+                if self._header is None or self._header[_STALE]:
+                    self._map()
+        return self._header, self._ids, self._vectors
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive across processes; re-entrant within this one (flock is per open file)."""
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _replace(self, ids, vectors, capacity):
+        """Writes a new file holding `ids`/`vectors`, swaps it in and marks the old one stale."""
+        import numpy as np
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        self._create(tmp, capacity)
+        header = np.memmap(tmp, dtype=np.int64, mode="r+", shape=(_HEADER_SLOTS,))
+        ids_at, vectors_at, _ = self._layout(capacity)
+        if len(ids):
+            for dtype, offset, shape, data in (
+                (np.int64, ids_at, (len(ids),), ids),
+                (np.float32, vectors_at, (len(ids), self.dim), vectors),
+            ):
+                block = np.memmap(tmp, dtype=dtype, mode="r+", offset=offset, shape=shape)
+                block[:] = data
+                block.flush()
+        header[_COUNT] = len(ids)
+        header.flush()
+        os.replace(tmp, self.path)
+        old = self._header
+        self._map()
+        if old is not None:
+            old[_STALE] = 1
+
+    # --- operations ---
+
+    def add(self, query_id, vector):
+        import numpy as np
+        with self._file_lock():
+            header, ids, vectors = self._current()
+            count = int(header[_COUNT])
+            if count >= ids.shape[0]:
+                self._replace(np.array(ids[:count]), np.array(vectors[:count]), ids.shape[0] * 2)
+                header, ids, vectors = self._header, self._ids, self._vectors
+            vectors[count] = vector
+            ids[count] = query_id
+            # Publish the row only once it is fully written.
+            header[_COUNT] = count + 1
+
+    def remove(self, query_id):
+        with self._file_lock():
+            header, ids, _ = self._current()
+            rows = ids[:int(header[_COUNT])]
+            rows[rows == query_id] = 0
+
+    def rebuild(self, items):
+        """Replaces the whole index with (query_id, vector) pairs."""
+        import numpy as np
+        ids = np.array([query_id for query_id, _ in items], dtype=np.int64)
+        vectors = np.array([vector for _, vector in items], dtype=np.float32).reshape(len(items), self.dim)
+        with self._file_lock():
+            if self.path.exists():
+                self._current()
+            self._replace(ids, vectors, max(INITIAL_CAPACITY, 1 << max(len(items) - 1, 0).bit_length()))
+
+    def search(self, vector, k=NEIGHBOURS, threshold=THRESHOLD):
+        """[(query_id, similarity)] of up to k live rows at or above `threshold`, best first."""
+        import numpy as np
+        header, ids, vectors = self._current()
+        count = int(header[_COUNT])
+        if not count:
+            return []
+        scores = vectors[:count] @ vector
+        scores[ids[:count] <= 0] = -1.0
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] >= threshold]
+
+    def stats(self):
+        import numpy as np
+        header, ids, _ = self._current()
+        count = int(header[_COUNT])
+        return {"rows": count, "live": int(np.count_nonzero(ids[:count] > 0)), "capacity": int(header[_CAPACITY])}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_query_index():
+    """Returns the process-wide QueryIndex, or None when QUERY_INDEX_ENABLED is off."""
+    global _index
+    if not ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = QueryIndex()
+    return _index
+
+
+def find_similar(user_input, limit, user):
+    """
+    (analysis, tracks) from `user`'s past queries closest to `user_input`, or
+    None when none is similar enough, they do not hold `limit` tracks, or
+    the caller is anonymous. The index holds every user's queries, so the
+    nearest CANDIDATES rows are narrowed to the user's own in the database.
+    """
+    index = get_query_index()
+    if index is None or user is None or not user.is_authenticated:
+        return None
+    with metrics.span("similar") as span:
+        vector = embed(user_input)
+        hits = index.search(vector, k=CANDIDATES) if vector.any() else []
+        analyses = dict(
+            MoodQuery.objects.filter(
+                id__in=[query_id for query_id, _ in hits], user=user, generated_keywords__isnull=False
+            ).values_list("id", "generated_keywords")
+        ) if hits else {}
+        # Deleted rows may still be in the index until the next rebuild.
+        query_ids = [
+            query_id for query_id, _ in hits
+            if isinstance(analyses.get(query_id), dict) and "error" not in analyses[query_id]
+        ][:NEIGHBOURS]
+        tracks = load_query_tracks(query_ids, limit * 2) if query_ids else []
+        if len(tracks) < limit:
+            span.tag(outcome="miss")
+            metrics.registry.inc(SIMILAR_METRIC, outcome="miss")
+            return None
+        span.tag(outcome="hit")
+        metrics.registry.inc(SIMILAR_METRIC, outcome="hit")
+
+    analysis = analyses[query_ids[0]]
+    return analysis, ranking.rank(
+        tracks, analysis.get("genres", []), analysis.get("moods", []), analysis.get("keywords", []), limit
+    )
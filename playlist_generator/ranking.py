@@ -0,0 +1,121 @@
+"""
+Relevance ranking with artist diversity for get_tracks results.
+
+get_tracks over-fetches (RANKING_HEADROOM extra candidates from the passes
+it runs anyway), scores every candidate by how many of the analysed genres,
+moods and keywords its Jamendo musicinfo tags contain plus a popularity
+prior from the order the tiers produced, then picks the playlist greedily
+with maximal marginal relevance (MMR): each pick trades relevance against
+similarity to the tracks already chosen, where similarity is mostly "same
+artist" and partly tag overlap. Everything is NumPy over the candidate
+pool, so re-ranking a few hundred tracks takes well under a millisecond.
+NumPy is imported on first use to keep it out of cold starts.
+"""
+import os
+
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+ENABLED = os.getenv("RANKING_ENABLED", "True").lower() in ("true", "1", "yes")
+# Extra candidates per requested track (1.0 = a pool twice the limit).
+HEADROOM = float(os.getenv("RANKING_HEADROOM", "1.0"))
+# Relevance = (1 - POPULARITY_WEIGHT) * tag match + POPULARITY_WEIGHT * popularity prior.
+POPULARITY_WEIGHT = float(os.getenv("RANKING_POPULARITY_WEIGHT", "0.3"))
+# MMR trade-off: 1.0 ranks by relevance only, lower values favour variety.
+DIVERSITY_LAMBDA = float(os.getenv("RANKING_DIVERSITY_LAMBDA", "0.7"))
+# Share of track similarity that comes from a shared artist (the rest is tag overlap).
+ARTIST_WEIGHT = float(os.getenv("RANKING_ARTIST_WEIGHT", "0.8"))
+
+# Genres and moods define the vibe; keywords only refine it.
+FIELD_WEIGHTS = {"genres": 1.0, "moods": 1.0, "keywords": 0.5}
+
+
+def headroom(limit):
+    """Extra candidates get_tracks should collect for a playlist of `limit`."""
+    return int(limit * HEADROOM) if ENABLED else 0
+
+
+def encode(tracks):
+    """
+    Returns (tags, vocabulary, artists): a binary candidate x tag matrix over
+    all musicinfo tags in the pool, the tag -> column mapping, and an integer
+    artist code per candidate.
+    """
+    import numpy as np
+    vocabulary, artist_codes = {}, {}
+    rows, cols, artists = [], [], []
+    for i, track in enumerate(tracks):
+        artists.append(artist_codes.setdefault((track.get("artist") or "").strip().lower(), len(artist_codes)))
+        for values in (track.get("tags") or {}).values():
+            for tag in values or ():
+                rows.append(i)
+                cols.append(vocabulary.setdefault(tag, len(vocabulary)))
+    tags = np.zeros((len(tracks), len(vocabulary)))
+    tags[rows, cols] = 1.0
+    return tags, vocabulary, np.array(artists, dtype=np.intp)
+
+
+def relevance(tags, vocabulary, genres, moods, keywords):
+    """Per-candidate relevance in [0, 1]; candidates are in tier order (best first)."""
+    import numpy as np
+    n = tags.shape[0]
+    # Tiers already run most relevant first and Jamendo orders each by popularity.
+    prior = 1.0 - np.arange(n, dtype=np.float64) / max(n, 1)
+
+    weights = {}
+    for field, values in (("genres", genres), ("moods", moods), ("keywords", keywords)):
+        for value in values or []:
+            if value:
+                weights.setdefault(value.lower(), FIELD_WEIGHTS[field])
+    if not weights:
+        return prior
+    present = [(vocabulary[term], weight) for term, weight in weights.items() if term in vocabulary]
+    tag_score = np.zeros(n)
+    if present:
+        cols, column_weights = zip(*present)
+        tag_score = tags[:, list(cols)] @ np.asarray(column_weights)
+    tag_score /= sum(weights.values())
+    return (1.0 - POPULARITY_WEIGHT) * tag_score + POPULARITY_WEIGHT * prior
+
+
+def mmr(scores, tags, artists, k, diversity_lambda=DIVERSITY_LAMBDA):
+    """
+    Greedy maximal marginal relevance; returns the indices of the k picks in
+    order. Similarity to a pick is ARTIST_WEIGHT for the same artist plus the
+    rest times the tags' cosine similarity. Only the k rows of it that are
+    needed get computed, not the full n x n matrix.
+    """
+    import numpy as np
+    k = min(k, len(scores))
+    norms = np.linalg.norm(tags, axis=1, keepdims=True)
+    unit = np.divide(tags, norms, out=np.zeros_like(tags), where=norms > 0)
+    gain_base = diversity_lambda * np.asarray(scores, dtype=np.float64)
+    penalty = 1.0 - diversity_lambda
+    max_sim = np.zeros(len(scores))
+    gain = np.empty(len(scores))
+    picked = []
+    for _ in range(k):
+        np.multiply(max_sim, penalty, out=gain)
+        np.subtract(gain_base, gain, out=gain)
+        best = int(gain.argmax())
+        picked.append(best)
+        gain_base[best] = -np.inf
+        sim = (1.0 - ARTIST_WEIGHT) * (unit @ unit[best])
+        sim[artists == artists[best]] += ARTIST_WEIGHT
+        np.maximum(max_sim, sim, out=max_sim)
+    return picked
+
+
+def rank(tracks, genres, moods, keywords, limit):
+    """Returns at most `limit` of `tracks`, most relevant first with artists spread out."""
+    if not ENABLED or len(tracks) <= 1:
+        return tracks[:limit]
+    with metrics.span("rank") as span:
+        tags, vocabulary, artists = encode(tracks)
+        scores = relevance(tags, vocabulary, genres, moods, keywords)
+        picked = mmr(scores, tags, artists, limit)
+        span.results = len(picked)
+    return [tracks[i] for i in picked]
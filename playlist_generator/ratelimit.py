@@ -0,0 +1,338 @@
+"""
+Token-bucket governor for upstream quotas and per-client request rates.
+
+Upstream buckets ("jamendo", "gemini") guard our API keys: callers queue
+for up to RATE_LIMIT_MAX_WAIT seconds for a token and are otherwise shed
+with RateLimited. Client buckets (per user, or per IP for anonymous calls)
+are checked by the rate_limit view decorator, which answers 429 with
+Retry-After instead of queueing.
+
+With RATE_LIMIT_BACKEND=cache the buckets live in a shared Django cache
+(Redis/Memcached/DB) so all gunicorn workers draw from one budget; the
+default "local" backend keeps one budget per worker process.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import JsonResponse
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+# "local" (per process), "cache" (shared Django cache) or "none".
+BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local").lower()
+CACHE_ALIAS = os.getenv("RATE_LIMIT_CACHE_ALIAS", "default")
+# Longest an upstream call may queue for a token before it is shed.
+MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+# Use the first X-Forwarded-For address (only behind a proxy that sets it).
+TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "False").lower() in ("true", "1", "yes")
+
+RATE_METRIC = "mood_jockey_ratelimit_total"
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(value):
+    """
+    "60/m" -> (capacity 60, refill 1.0 token/s). The capacity doubles as the
+    burst size. Returns None for an empty value (unlimited).
+    """
+    if not value:
+        return None
+    count, _, period = value.partition("/")
+    seconds = _PERIODS[(period or "s").strip().lower()[0]]
+    capacity = float(count)
+    return capacity, capacity / seconds
+
+
+UPSTREAM_LIMITS = {
+    "jamendo": parse_rate(os.getenv("RATE_LIMIT_JAMENDO", "20/s")),
+    "gemini": parse_rate(os.getenv("RATE_LIMIT_GEMINI", "60/m")),
+}
+CLIENT_LIMITS = {
+    "generate": parse_rate(os.getenv("RATE_LIMIT_CLIENT", "30/m")),
+    "public": parse_rate(os.getenv("RATE_LIMIT_PUBLIC", "10/m")),
+    # History exports and imports walk a user's whole history.
+    "transfer": parse_rate(os.getenv("RATE_LIMIT_TRANSFER", "10/h")),
+    # Media proxy downloads (cache hits are free).
+    "media": parse_rate(os.getenv("RATE_LIMIT_MEDIA", "60/m")),
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, bucket, retry_after):
+        super().__init__(f"Rate limit exceeded for {bucket}; retry in {retry_after:.1f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+def _refill(state, capacity, rate, now):
+    tokens, updated = state if state is not None else (capacity, now)
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _take(state, capacity, rate, cost, max_wait, now):
+    """
+    Returns (new_state, wait, allowed). A caller that may wait takes its
+    token in advance (the balance goes negative), so queued callers are
+    served in arrival order without re-polling.
+    """
+    tokens = _refill(state, capacity, rate, now)
+    if tokens >= cost:
+        return (tokens - cost, now), 0.0, True
+    wait = (cost - tokens) / rate
+    if wait <= max_wait:
+        return (tokens - cost, now), wait, True
+    return (tokens, now), wait, False
+
+
+class LocalBucketStore:
+    """Buckets in this process's memory."""
+
+    # Once there are this many buckets, those that have refilled to capacity
+    # (identical to a missing one) are dropped, at most once per second.
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        # key -> (state, capacity, rate); the limits are kept so pruning can refill.
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def take(self, key, capacity, rate, cost, max_wait):
+        now = time.time()
+        with self._lock:
+            if len(self._buckets) > self.MAX_KEYS and now - self._pruned_at >= 1:
+                self._prune(now)
+            entry = self._buckets.get(key)
+            state, wait, allowed = _take(entry and entry[0], capacity, rate, cost, max_wait, now)
+            self._buckets[key] = (state, capacity, rate)
+        return wait, allowed
+
+    def peek(self, key, capacity, rate):
+        with self._lock:
+            entry = self._buckets.get(key)
+            return _refill(entry and entry[0], capacity, rate, time.time())
+
+    def _prune(self, now):
+        self._pruned_at = now
+        for key, (state, capacity, rate) in list(self._buckets.items()):
+            if _refill(state, capacity, rate, now) >= capacity:
+                del self._buckets[key]
+
+
+class CacheBucketStore:
+    """
+    Buckets in a shared Django cache. Each read-modify-write runs under a
+    short cache.add lock; if the lock is contended for too long the update
+    goes ahead anyway (slightly over-admitting beats blocking requests).
+    """
+
+    LOCK_ATTEMPTS = 20
+
+    def __init__(self, alias=CACHE_ALIAS):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, rate, cost, max_wait):
+        cache_key = f"ratelimit:{key}"
+        locked = self._lock(cache_key)
+        try:
+            state, wait, allowed = _take(self.cache.get(cache_key), capacity, rate, cost, max_wait, time.time())
+            # A missing bucket is a full one, so entries only need to outlive a refill.
+            self.cache.set(cache_key, state, timeout=math.ceil((capacity - state[0]) / rate) + 1)
+        finally:
+            if locked:
+                self.cache.delete(f"{cache_key}:lock")
+        return wait, allowed
+
+    def peek(self, key, capacity, rate):
+        return _refill(self.cache.get(f"ratelimit:{key}"), capacity, rate, time.time())
+
+    def _lock(self, cache_key):
+        for _ in range(self.LOCK_ATTEMPTS):
+            if self.cache.add(f"{cache_key}:lock", 1, timeout=1):
+                return True
+            time.sleep(0.002)
+        return False
+
+
+class Governor:
+    def __init__(self, store, upstream_limits=None, client_limits=None, max_wait=MAX_WAIT):
+        self.store = store
+        self.upstream_limits = upstream_limits if upstream_limits is not None else UPSTREAM_LIMITS
+        self.client_limits = client_limits if client_limits is not None else CLIENT_LIMITS
+        self.max_wait = max_wait
+
+    def _check(self, bucket, key, limit, cost, max_wait):
+        """Returns how long the caller must wait for its token; raises RateLimited if too long."""
+        capacity, rate = limit
+        wait, allowed = self.store.take(key, capacity, rate, cost, max_wait)
+        if not allowed:
+            metrics.registry.inc(RATE_METRIC, bucket=bucket, outcome="rejected")
+            raise RateLimited(bucket, wait)
+        metrics.registry.inc(RATE_METRIC, bucket=bucket, outcome="queued" if wait else "allowed")
+        return wait
+
+    def acquire(self, upstream, cost=1):
+        """Takes `cost` tokens from an upstream's budget, sleeping up to max_wait for them."""
+        limit = self.upstream_limits.get(upstream)
+        if limit is None:
+            return
+        wait = self._check(upstream, f"upstream:{upstream}", limit, cost, self.max_wait)
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self, upstream, cost=1):
+        limit = self.upstream_limits.get(upstream)
+        if limit is None:
+            return
+        if isinstance(self.store, LocalBucketStore):
+            wait = self._check(upstream, f"upstream:{upstream}", limit, cost, self.max_wait)
+        else:
+            wait = await sync_to_async(self._check)(upstream, f"upstream:{upstream}", limit, cost, self.max_wait)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def retry_after(self, upstream):
+        """Seconds until the upstream has a token again (0 if it has one now)."""
+        limit = self.upstream_limits.get(upstream)
+        if limit is None:
+            return 0.0
+        capacity, rate = limit
+        tokens = self.store.peek(f"upstream:{upstream}", capacity, rate)
+        return max(0.0, (1 - tokens) / rate)
+
+    def check_client(self, bucket, client, cost=1):
+        """
+        Client buckets never queue. Returns (limit, remaining) or raises
+        RateLimited. A cost above the bucket's capacity is charged as a full
+        bucket, since more could never be granted.
+        """
+        limit = self.client_limits.get(bucket)
+        if limit is None:
+            return None
+        key = f"client:{bucket}:{client}"
+        self._check(bucket, key, limit, min(cost, limit[0]), 0.0)
+        return limit[0], max(0, int(self.store.peek(key, *limit)))
+
+    def usage(self):
+        """Current upstream budgets, for /api/diagnostics/."""
+        usage = {}
+        for upstream, limit in self.upstream_limits.items():
+            if limit is None:
+                usage[upstream] = None
+                continue
+            capacity, rate = limit
+            tokens = self.store.peek(f"upstream:{upstream}", capacity, rate)
+            usage[upstream] = {
+                "capacity": capacity,
+                "refill_per_second": round(rate, 4),
+                "available": round(max(tokens, 0.0), 2),
+                "utilization": round(1 - max(tokens, 0.0) / capacity, 3),
+            }
+        return {"backend": BACKEND, "upstreams": usage}
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Returns the process-wide Governor, or None when RATE_LIMIT_BACKEND=none."""
+    global _governor
+    if BACKEND not in ("local", "cache"):
+        return None
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = Governor(CacheBucketStore() if BACKEND == "cache" else LocalBucketStore())
+    return _governor
+
+
+def acquire(upstream, cost=1):
+    governor = get_governor()
+    if governor is not None:
+        governor.acquire(upstream, cost)
+
+
+async def aacquire(upstream, cost=1):
+    governor = get_governor()
+    if governor is not None:
+        await governor.aacquire(upstream, cost)
+
+
+def upstream_retry_after(upstream):
+    governor = get_governor()
+    return governor.retry_after(upstream) if governor is not None else 0.0
+
+
+def client_id(request):
+    """Authenticated users are limited per account, everyone else per IP."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    address = request.META.get("REMOTE_ADDR", "")
+    if TRUST_FORWARDED and request.META.get("HTTP_X_FORWARDED_FOR"):
+        address = request.META["HTTP_X_FORWARDED_FOR"].split(",")[0].strip()
+    return f"ip:{address}"
+
+
+def rate_limited_response(error):
+    response = JsonResponse(
+        {'error': 'Too many requests. Please try again shortly.', 'retry_after': math.ceil(error.retry_after)},
+        status=429,
+    )
+    response["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+
+def rate_limit(bucket, cost=None):
+    """
+    View decorator applying a client bucket. `cost(request)` may charge more
+    than one token (e.g. per input of a batch). Adds X-RateLimit-Limit and
+    X-RateLimit-Remaining headers; answers 429 + Retry-After when exhausted.
+    """
+
+    def check(request):
+        governor = get_governor()
+        if governor is None:
+            return None, None
+        try:
+            return governor.check_client(bucket, client_id(request), cost(request) if cost else 1), None
+        except RateLimited as e:
+            return None, rate_limited_response(e)
+
+    def annotate(response, budget):
+        if budget is not None:
+            response["X-RateLimit-Limit"] = str(int(budget[0]))
+            response["X-RateLimit-Remaining"] = str(budget[1])
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # request.user and a cache store both do blocking I/O.
+                budget, rejected = await sync_to_async(check)(request)
+                if rejected is not None:
+                    return rejected
+                return annotate(await view(request, *args, **kwargs), budget)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                budget, rejected = check(request)
+                if rejected is not None:
+                    return rejected
+                return annotate(view(request, *args, **kwargs), budget)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,64 @@
+"""
+Fast JSON responses for the playlist APIs.
+
+Payloads are built from values() rows (plain dicts) instead of model
+instances and encoded with orjson when it is installed, falling back to the
+stdlib encoder. Compression is handled by middleware.compression_middleware.
+"""
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# "auto" uses orjson when installed; "stdlib" forces the json module.
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto").lower()
+
+# Bump when the get_query payload shape changes so old ETags stop matching.
+PAYLOAD_VERSION = 1
+
+
+def dumps(data):
+    """Encodes data to compact UTF-8 JSON bytes."""
+    if orjson is not None and JSON_ENCODER != "stdlib":
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Types orjson does not know (e.g. Decimal, lazy strings).
+            pass
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":")).encode("utf-8")
+
+
+class FastJsonResponse(HttpResponse):
+    """Drop-in for JsonResponse (dict payloads) using dumps()."""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
+
+
+def query_etag(query_id, created_at):
+    """Saved queries never change, so id + creation time identify the payload."""
+    return f'"q{query_id}-{int(created_at.timestamp() * 1000000)}-v{PAYLOAD_VERSION}"'
+
+
+def query_payload(query_row, track_rows):
+    """
+    get_query's payload from a MoodQuery values() row (id, user_input,
+    generated_keywords, created_at) and Track values() rows.
+    """
+    return {
+        "query_id": query_row["id"],
+        "user_input": query_row["user_input"],
+        "keywords": query_row["generated_keywords"],
+        "created_at": query_row["created_at"].isoformat(),
+        "tracks": track_rows,
+    }
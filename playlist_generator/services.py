@@ -1,117 +1,616 @@
+import asyncio
+import contextvars
 import os
-import requests
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
 
+from . import metrics, ranking
+from .breaker import get_breaker
+from .catalog import MIN_FILL, CatalogService
+from .http_clients import MAX_RETRIES, RETRY_BACKOFF, RETRY_STATUSES, get_async_client, get_session
+from .degraded import DegradedService
+from .ratelimit import RateLimited, aacquire, acquire
+from .singleflight import get_singleflight
+from .track_cache import FRESH, STALE, TrackResultCache, get_track_cache
+from .warm_playlists import WarmPlaylistService
+
 load_dotenv()
 
+TRACKS_URL = os.getenv("JAMENDO_API_URL", "https://api.jamendo.com/v3.0").rstrip("/") + "/tracks/"
+
+# Fire all tiered search passes at once instead of one after another.
+CONCURRENT_SEARCH = os.getenv("JAMENDO_CONCURRENT_SEARCH", "True").lower() in ("true", "1", "yes")
+# Upper bound on in-flight Jamendo requests per process, shared by all requests.
+SEARCH_WORKERS = int(os.getenv("JAMENDO_SEARCH_WORKERS", "8"))
+# Seconds before a single Jamendo request is abandoned.
+TIMEOUT = float(os.getenv("JAMENDO_TIMEOUT", "10"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Lazily creates the process-wide pool used for concurrent search passes."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=SEARCH_WORKERS, thread_name_prefix="jamendo"
+                )
+    return _executor
+
 class JamendoService:
     @staticmethod
-    def _fetch(params):
-        """Internal helper to call the Jamendo tracks endpoint."""
-        client_id = os.getenv("JAMENDO_CLIENT_ID")
-        url = "https://api.jamendo.com/v3.0/tracks/"
+    def _parse_item(item):
+        """Maps a raw Jamendo track to our track dict, keeping its musicinfo tags."""
+        musicinfo_tags = (item.get("musicinfo") or {}).get("tags") or {}
+        return {
+            "id": item.get("id"),
+            "title": item.get("name"),
+            "artist": item.get("artist_name"),
+            "preview_url": item.get("audio"),
+            "album_image": item.get("image"),
+            "tags": {
+                kind: [t.lower() for t in musicinfo_tags.get(kind) or []]
+                for kind in ("genres", "instruments", "vartags")
+            },
+        }
+
+    @staticmethod
+    def _query_params(params):
         base = {
-            "client_id": client_id,
+            "client_id": os.getenv("JAMENDO_CLIENT_ID"),
             "format": "json",
             "include": "musicinfo",
         }
         base.update(params)
+        return base
+
+    @staticmethod
+    def _request(params):
+        """
+        Internal helper to call the Jamendo tracks endpoint.
+        Returns None on failure so errors are never cached. A pass that cannot
+        get a Jamendo token in time, or finds the circuit breaker open, fails
+        the same way at once, so the other tiers and the cache still answer.
+        """
+        breaker = get_breaker("jamendo")
+        if not breaker.allow():
+            return None
         try:
-            response = requests.get(url, params=base, timeout=10)
+            acquire("jamendo")
+        except RateLimited as e:
+            print(f"Jamendo Service Error: {e}")
+            return None
+
+        start = time.perf_counter()
+        try:
+            response = get_session().get(TRACKS_URL, params=JamendoService._query_params(params), timeout=TIMEOUT)
             response.raise_for_status()
             results = response.json().get("results", [])
-            return [
-                {
-                    "id": item.get("id"),
-                    "title": item.get("name"),
-                    "artist": item.get("artist_name"),
-                    "preview_url": item.get("audio"),
-                    "album_image": item.get("image"),
-                }
-                for item in results
-            ]
+            tracks = [JamendoService._parse_item(item) for item in results]
         except Exception as e:
+            breaker.failure()
             print(f"Jamendo Service Error: {e}")
+            return None
+        breaker.success(time.perf_counter() - start)
+        return tracks
+
+    @staticmethod
+    def _revalidate(cache, params, page):
+        """Refreshes a stale cache entry; runs on the shared pool."""
+        try:
+            results = JamendoService._request({**params, "limit": page})
+            if results is not None:
+                cache.set(params, page, results)
+        finally:
+            cache.end_refresh(params)
+
+    @staticmethod
+    def _fetch(params):
+        """
+        Returns tracks for one search pass, served from the result cache when
+        possible. Stale entries are returned immediately and refreshed in the
+        background (stale-while-revalidate).
+        """
+        cache = get_track_cache()
+        if cache is None:
+            metrics.tag(cache="off")
+            return JamendoService._coalesced_request(params) or []
+
+        limit = int(params.get("limit", 10))
+        tracks, status = cache.get(params, limit)
+        metrics.tag(cache=status)
+        page = cache.page_size(limit)
+        if status == FRESH:
+            return tracks
+        if status == STALE:
+            if cache.begin_refresh(params):
+                _get_executor().submit(JamendoService._revalidate, cache, params, page)
+            return tracks
+
+        def fill():
+            results = JamendoService._request({**params, "limit": page})
+            if results is not None:
+                cache.set(params, page, results)
+            return results
+
+        results = JamendoService._coalesced_request({**params, "limit": page}, fill)
+        if results is None:
             return []
+        return results[:limit]
+
+    @staticmethod
+    def _flight_key(params):
+        return f"{TrackResultCache.make_key(params)}:{params.get('limit')}"
 
     @staticmethod
-    def get_tracks(genres, moods, keywords, limit=24):
+    def _coalesced_request(params, call=None):
         """
-        Tiered search strategy:
+        Runs `call` (default: _request(params)) once for all identical
+        in-flight parameter sets, so a burst of the same search makes a
+        single upstream request.
+        """
+        call = call or (lambda: JamendoService._request(params))
+        flight = get_singleflight()
+        if flight is None:
+            return call()
+        return flight.do("jamendo", JamendoService._flight_key(params), call)
+
+    @staticmethod
+    def _build_passes(genres, moods, keywords):
+        """
+        Tiered search strategy, highest relevance first:
         1. Highly specific: Genre + Mood combination
         2. Specific: Mood + Keyword combination
         3. Mood only (often most important for feeling-based queries)
         4. Genre only
         5. Keyword only (fuzzy)
-        """
-        tracks = []
-        seen_ids = set()
-
-        def add_tracks(new_tracks):
-            for t in new_tracks:
-                if t["id"] not in seen_ids:
-                    seen_ids.add(t["id"])
-                    tracks.append(t)
 
+        Returns a list of (tier_name, params) tuples without the "limit" key.
+        """
         safe_genres = [g.lower() for g in genres] if genres else []
         safe_moods = [m.lower() for m in moods] if moods else []
         safe_keywords = [k.lower() for k in keywords] if keywords else []
 
+        passes = []
+
         # --- Pass 1: Genre + Mood Combo (Highest Relevance) ---
-        if len(tracks) < limit and safe_genres and safe_moods:
-            tag_combo = f"{safe_genres[0]}+{safe_moods[0]}"
-            results = JamendoService._fetch({
-                "tags": tag_combo,
-                "limit": limit - len(tracks),
+        if safe_genres and safe_moods:
+            passes.append(("genre_mood", {
+                "tags": f"{safe_genres[0]}+{safe_moods[0]}",
                 "order": "popularity_week",
-            })
-            add_tracks(results)
+            }))
 
         # --- Pass 2: Mood + Keyword Combo ---
-        if len(tracks) < limit and safe_moods and safe_keywords:
-            tag_combo = f"{safe_moods[0]}+{safe_keywords[0]}"
-            results = JamendoService._fetch({
-                "fuzzytags": tag_combo,
-                "limit": limit - len(tracks),
+        if safe_moods and safe_keywords:
+            passes.append(("mood_keyword", {
+                "fuzzytags": f"{safe_moods[0]}+{safe_keywords[0]}",
                 "order": "popularity_month",
-            })
-            add_tracks(results)
+            }))
 
         # --- Pass 3: Mood only (Mood drives the vibe more than genre) ---
-        if len(tracks) < limit and safe_moods:
-            results = JamendoService._fetch({
+        if safe_moods:
+            passes.append(("mood", {
                 "tags": safe_moods[0],
-                "limit": limit - len(tracks),
                 "order": "popularity_week",
                 "boost": "popularity_month"
-            })
-            add_tracks(results)
+            }))
 
         # --- Pass 4: Primary genre fallback ---
-        if len(tracks) < limit and safe_genres:
-            results = JamendoService._fetch({
+        if safe_genres:
+            passes.append(("genre", {
                 "tags": safe_genres[0],
-                "limit": limit - len(tracks),
                 "order": "popularity_week",
-            })
-            add_tracks(results)
-            
+            }))
+
         # --- Pass 5: Keyword fallback (fuzzy search) ---
-        if len(tracks) < limit and safe_keywords:
-            results = JamendoService._fetch({
+        if safe_keywords:
+            passes.append(("keyword", {
                 "fuzzytags": safe_keywords[0],
-                "limit": limit - len(tracks),
                 "order": "popularity_total",
-            })
-            add_tracks(results)
+            }))
+
+        return passes
+
+    @staticmethod
+    def _timed_fetch(stage, tier, fetch, params):
+        """Runs one pass inside a metrics span tagged with tier, cache status and result count."""
+        with metrics.span(stage, tier=tier) as span:
+            results = fetch(params)
+            span.results = len(results)
+            return results
+
+    @staticmethod
+    def _run_sequential(passes, limit, count, fetch=None, stop_at=None):
+        """
+        Runs the passes one after another, asking each only for what is still
+        missing, until `stop_at` (default `limit`) tracks are in. Yields
+        (tier_name, results) per pass.
+        """
+        fetch = fetch or JamendoService._fetch
+        stage = "catalog" if fetch is CatalogService.search else "jamendo"
+        stop_at = stop_at or limit
+        for tier, params in passes:
+            if count() >= stop_at:
+                break
+            yield tier, JamendoService._timed_fetch(stage, tier, fetch, {**params, "limit": limit - count()})
+
+    @staticmethod
+    def _run_concurrent(passes, limit, count, fetch=None, stop_at=None):
+        """
+        Sends every pass at once on the shared pool, then yields
+        (tier_name, results) in tier order. Passes that have not started yet
+        are cancelled as soon as the merged prefix reaches `stop_at`
+        (default `limit`).
+        """
+        fetch = fetch or JamendoService._fetch
+        stop_at = stop_at or limit
+        # Each pass runs in a copy of the caller's context so its span lands in this request.
+        futures = [
+            (tier, _get_executor().submit(
+                contextvars.copy_context().run,
+                JamendoService._timed_fetch, "jamendo", tier, fetch, {**params, "limit": limit},
+            ))
+            for tier, params in passes
+        ]
+        try:
+            for tier, future in futures:
+                if count() >= stop_at:
+                    break
+                yield tier, future.result()
+        finally:
+            for _, future in futures:
+                future.cancel()
+
+    @staticmethod
+    def iter_tracks(genres, moods, keywords, limit=24, concurrent=None, fetch=None, warm=True, headroom=0):
+        """
+        Runs the tiered search passes (see _build_passes) until `limit` tracks
+        are collected, yielding (tier_name, new_tracks) as each tier is merged
+        so callers can stream results. In local catalog mode the passes are
+        answered from the database first and Jamendo is only searched when too
+        few tracks were found. With `concurrent` (defaults to
+        JAMENDO_CONCURRENT_SEARCH) the passes are fetched in parallel, so
+        latency is bounded by the slowest single pass instead of their sum.
+        `fetch` replaces _fetch for the live passes (see get_tracks_batch).
+        With `warm` a fresh precomputed set (see warm_playlists) answers the
+        whole request before any pass runs. When every live pass fails (e.g.
+        the Jamendo circuit breaker is open) the "degraded" tier answers from
+        locally stored data instead (see degraded.DegradedService). Up to
+        `headroom` extra tracks are kept from the passes that run anyway, as
+        candidates for ranking; no pass is added to find them.
+        """
+        fetch = fetch or JamendoService._fetch
+        cap = limit + headroom
+        tracks = []
+        seen_ids = set()
+
+        def add_tracks(new_tracks):
+            added = []
+            for t in new_tracks:
+                if len(tracks) >= cap:
+                    break
+                if t["id"] not in seen_ids:
+                    seen_ids.add(t["id"])
+                    tracks.append(t)
+                    added.append(t)
+            return added
+
+        def count():
+            return len(tracks)
+
+        if concurrent is None:
+            concurrent = CONCURRENT_SEARCH
+
+        passes = JamendoService._build_passes(genres, moods, keywords)
+
+        # --- Precomputed warm set: one indexed lookup instead of the passes ---
+        if warm and WarmPlaylistService.enabled():
+            with metrics.span("warm") as span:
+                results = WarmPlaylistService.lookup(genres, moods, keywords, limit, extra=headroom)
+                span.tag(cache="hit" if results else "miss")
+            if results:
+                yield "warm", add_tracks(results)
+                return
+
+        # --- Local catalog first: same tiers answered from the tag index ---
+        if CatalogService.enabled():
+            for tier, results in JamendoService._run_sequential(
+                passes, cap, count, fetch=CatalogService.search, stop_at=limit
+            ):
+                added = add_tracks(results)
+                if added:
+                    yield f"catalog_{tier}", added
+            if len(tracks) >= limit * MIN_FILL:
+                return
+
+        if concurrent and len(passes) > 1:
+            runner = JamendoService._run_concurrent(passes, cap, count, fetch, stop_at=limit)
+        else:
+            runner = JamendoService._run_sequential(passes, cap, count, fetch, stop_at=limit)
+        for tier, results in runner:
+            added = add_tracks(results)
+            if added:
+                yield tier, added
 
         # --- Ultimate fallback: generic popular tracks ---
         if not tracks:
-            results = JamendoService._fetch({
+            results = JamendoService._timed_fetch("jamendo", "fallback", fetch, {
+                "tags": "pop",
+                "limit": cap,
+                "order": "popularity_total",
+            })
+            added = add_tracks(results)
+            if added:
+                yield "fallback", added
+
+        # --- Degraded mode: Jamendo is down, answer from stored tracks ---
+        if not tracks:
+            with metrics.span("degraded") as span:
+                results = DegradedService.tracks(passes, genres, moods, keywords, cap)
+                span.results = len(results)
+            added = add_tracks(results)
+            if added:
+                yield "degraded", added
+
+    @staticmethod
+    def get_tracks(genres, moods, keywords, limit=24, concurrent=None, fetch=None, warm=True):
+        """
+        Collects iter_tracks into a single list of at most `limit` tracks,
+        re-ranked for relevance and artist diversity (see ranking).
+        """
+        tracks = [
+            track
+            for _, batch in JamendoService.iter_tracks(
+                genres, moods, keywords, limit, concurrent, fetch, warm, ranking.headroom(limit)
+            )
+            for track in batch
+        ]
+        return ranking.rank(tracks, genres, moods, keywords, limit)
+
+    @staticmethod
+    def get_tracks_batch(analyses, limit=24):
+        """
+        Runs get_tracks for many mood analyses at once. Analyses with the same
+        genres/moods/keywords share one search, and identical pass parameters
+        across different analyses share one upstream call. Returns a list of
+        track lists aligned with `analyses` (empty for analyses with an error).
+        """
+        shared = {}
+        shared_lock = threading.Lock()
+
+        def shared_fetch(params):
+            key = (TrackResultCache.make_key(params), params.get("limit"))
+            with shared_lock:
+                future = shared.get(key)
+                owner = future is None
+                if owner:
+                    future = shared[key] = Future()
+            if owner:
+                try:
+                    future.set_result(JamendoService._fetch(params))
+                except Exception as e:
+                    future.set_exception(e)
+            return future.result()
+
+        groups = {}
+        for i, analysis in enumerate(analyses):
+            if "error" in analysis:
+                continue
+            signature = tuple(
+                tuple(v.lower() for v in analysis.get(field) or [])
+                for field in ("genres", "moods", "keywords")
+            )
+            groups.setdefault(signature, []).append(i)
+
+        results = [[] for _ in analyses]
+        if not groups:
+            return results
+
+        def run(signature):
+            genres, moods, keywords = signature
+            return JamendoService.get_tracks(genres, moods, keywords, limit=limit, fetch=shared_fetch)
+
+        # A dedicated pool: the searches themselves wait on the shared pass pool.
+        with ThreadPoolExecutor(max_workers=min(len(groups), SEARCH_WORKERS)) as pool:
+            futures = {
+                signature: pool.submit(contextvars.copy_context().run, run, signature)
+                for signature in groups
+            }
+            for signature, future in futures.items():
+                for i in groups[signature]:
+                    results[i] = list(future.result())
+        return results
+
+    # --- Async variants (used by the ASGI views in async_views.py) ---
+
+    @staticmethod
+    async def _request_async(params):
+        """Async _request on the per-loop keep-alive client, retrying 429/5xx with backoff."""
+        breaker = get_breaker("jamendo")
+        if not breaker.allow():
+            return None
+        try:
+            await aacquire("jamendo")
+        except RateLimited as e:
+            print(f"Jamendo Service Error: {e}")
+            return None
+
+        start = time.perf_counter()
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                response = await get_async_client().get(
+                    TRACKS_URL, params=JamendoService._query_params(params), timeout=TIMEOUT
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    break
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+            response.raise_for_status()
+            results = response.json().get("results", [])
+            tracks = [JamendoService._parse_item(item) for item in results]
+        except Exception as e:
+            breaker.failure()
+            print(f"Jamendo Service Error: {e}")
+            return None
+        breaker.success(time.perf_counter() - start)
+        return tracks
+
+    @staticmethod
+    async def _fetch_async(params):
+        """Async _fetch; stale entries are still refreshed on the shared thread pool."""
+        cache = get_track_cache()
+        if cache is None:
+            metrics.tag(cache="off")
+            return await JamendoService._coalesced_request_async(params) or []
+
+        limit = int(params.get("limit", 10))
+        tracks, status = await cache.aget(params, limit)
+        metrics.tag(cache=status)
+        page = cache.page_size(limit)
+        if status == FRESH:
+            return tracks
+        if status == STALE:
+            if cache.begin_refresh(params):
+                _get_executor().submit(JamendoService._revalidate, cache, params, page)
+            return tracks
+
+        async def fill():
+            results = await JamendoService._request_async({**params, "limit": page})
+            if results is not None:
+                await cache.aset(params, page, results)
+            return results
+
+        results = await JamendoService._coalesced_request_async({**params, "limit": page}, fill)
+        if results is None:
+            return []
+        return results[:limit]
+
+    @staticmethod
+    async def _coalesced_request_async(params, call=None):
+        call = call or (lambda: JamendoService._request_async(params))
+        flight = get_singleflight()
+        if flight is None:
+            return await call()
+        return await flight.ado("jamendo", JamendoService._flight_key(params), call)
+
+    @staticmethod
+    async def _timed_fetch_async(stage, tier, fetch, params):
+        with metrics.span(stage, tier=tier) as span:
+            results = await fetch(params)
+            span.results = len(results)
+            return results
+
+    @staticmethod
+    async def _run_sequential_async(passes, limit, count, fetch=None, stop_at=None):
+        stage = "jamendo" if fetch is None else "catalog"
+        fetch = fetch or JamendoService._fetch_async
+        stop_at = stop_at or limit
+        for tier, params in passes:
+            if count() >= stop_at:
+                break
+            yield tier, await JamendoService._timed_fetch_async(stage, tier, fetch, {**params, "limit": limit - count()})
+
+    @staticmethod
+    async def _run_concurrent_async(passes, limit, count, stop_at=None):
+        """Like _run_concurrent, but in-flight passes are truly cancelled once `stop_at` is met."""
+        stop_at = stop_at or limit
+        tasks = [
+            (tier, asyncio.ensure_future(JamendoService._timed_fetch_async(
+                "jamendo", tier, JamendoService._fetch_async, {**params, "limit": limit}
+            )))
+            for tier, params in passes
+        ]
+        try:
+            for tier, task in tasks:
+                if count() >= stop_at:
+                    break
+                yield tier, await task
+        finally:
+            for _, task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def iter_tracks_async(genres, moods, keywords, limit=24, concurrent=None, headroom=0):
+        """Async generator version of iter_tracks with identical tiering and dedup."""
+        cap = limit + headroom
+        tracks = []
+        seen_ids = set()
+
+        def add_tracks(new_tracks):
+            added = []
+            for t in new_tracks:
+                if len(tracks) >= cap:
+                    break
+                if t["id"] not in seen_ids:
+                    seen_ids.add(t["id"])
+                    tracks.append(t)
+                    added.append(t)
+            return added
+
+        def count():
+            return len(tracks)
+
+        if concurrent is None:
+            concurrent = CONCURRENT_SEARCH
+
+        passes = JamendoService._build_passes(genres, moods, keywords)
+
+        if WarmPlaylistService.enabled():
+            with metrics.span("warm") as span:
+                results = await sync_to_async(WarmPlaylistService.lookup)(genres, moods, keywords, limit, extra=headroom)
+                span.tag(cache="hit" if results else "miss")
+            if results:
+                yield "warm", add_tracks(results)
+                return
+
+        if CatalogService.enabled():
+            async for tier, results in JamendoService._run_sequential_async(
+                passes, cap, count, fetch=sync_to_async(CatalogService.search), stop_at=limit
+            ):
+                added = add_tracks(results)
+                if added:
+                    yield f"catalog_{tier}", added
+            if len(tracks) >= limit * MIN_FILL:
+                return
+
+        if concurrent and len(passes) > 1:
+            runner = JamendoService._run_concurrent_async(passes, cap, count, stop_at=limit)
+        else:
+            runner = JamendoService._run_sequential_async(passes, cap, count, stop_at=limit)
+        async for tier, results in runner:
+            added = add_tracks(results)
+            if added:
+                yield tier, added
+
+        if not tracks:
+            results = await JamendoService._timed_fetch_async("jamendo", "fallback", JamendoService._fetch_async, {
                 "tags": "pop",
-                "limit": limit,
+                "limit": cap,
                 "order": "popularity_total",
             })
-            add_tracks(results)
+            added = add_tracks(results)
+            if added:
+                yield "fallback", added
 
-        return tracks[:limit]
+        if not tracks:
+            with metrics.span("degraded") as span:
+                results = await sync_to_async(DegradedService.tracks)(passes, genres, moods, keywords, cap)
+                span.results = len(results)
+            added = add_tracks(results)
+            if added:
+                yield "degraded", added
+
+    @staticmethod
+    async def get_tracks_async(genres, moods, keywords, limit=24, concurrent=None):
+        tracks = []
+        async for _, batch in JamendoService.iter_tracks_async(
+            genres, moods, keywords, limit, concurrent, ranking.headroom(limit)
+        ):
+            tracks.extend(batch)
+        return ranking.rank(tracks, genres, moods, keywords, limit)
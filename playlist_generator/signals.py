@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import MoodQuery
+from .query_index import SOURCE_SIMILAR, embed, get_query_index
+
+
+@receiver(post_save, sender=MoodQuery)
+def index_mood_query(sender, instance, created, **kwargs):
+    """
+    Adds new analysed queries to the similarity index once their tracks are
+    committed. bulk_create sends no post_save, so bulk-inserted rows (history
+    imports) are only indexed by `manage.py build_query_index`.
+    """
+    index = get_query_index()
+    # Answers from the index would only add near-duplicates of their neighbours.
+    if index is None or not created or instance.analysis_source == SOURCE_SIMILAR:
+        return
+    analysis = instance.generated_keywords
+    if not isinstance(analysis, dict) or "error" in analysis:
+        return
+    vector = embed(instance.user_input)
+    if not vector.any():
+        return
+
+    def add():
+        try:
+            index.add(instance.id, vector)
+        except Exception as e:
+            print(f"Query Index Error: {e}")
+
+    transaction.on_commit(add)
+
+
+@receiver(post_delete, sender=MoodQuery)
+def unindex_mood_query(sender, instance, **kwargs):
+    index = get_query_index()
+    if index is None:
+        return
+    query_id = instance.id
+
+    def remove():
+        try:
+            index.remove(query_id)
+        except Exception as e:
+            print(f"Query Index Error: {e}")
+
+    transaction.on_commit(remove)
@@ -0,0 +1,244 @@
+"""
+Single-flight coalescing for identical in-flight upstream calls.
+
+Concurrent callers asking for the same key share one call: the first
+("leader") runs it and everyone else ("followers") waits for its result.
+Within a process this uses Futures (threads) or asyncio Futures (one event
+loop). With SINGLEFLIGHT_BACKEND=cache the leader also takes a short lock in
+a shared Django cache (Redis/Memcached/DB) and publishes its result there,
+so identical calls in other gunicorn workers wait for it too.
+"""
+import asyncio
+import copy
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+# "local" (per process), "cache" (local + shared Django cache lock) or "none".
+BACKEND = os.getenv("SINGLEFLIGHT_BACKEND", "local").lower()
+CACHE_ALIAS = os.getenv("SINGLEFLIGHT_CACHE_ALIAS", "default")
+# How long a cross-worker lock lives if its leader dies mid-call.
+LOCK_TIMEOUT = float(os.getenv("SINGLEFLIGHT_LOCK_TIMEOUT", "15"))
+# How long a follower in another worker waits before doing the call itself.
+WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "10"))
+POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.05"))
+# Published results only need to outlive the followers' wait.
+RESULT_TTL = 30
+
+COALESCED_METRIC = "mood_jockey_singleflight_total"
+
+_MISSING = object()
+
+
+class SharedLock:
+    """
+    Cross-worker leader election on a Django cache. cache.add is atomic on
+    the shared backends, so exactly one worker wins each lock. The lock holds
+    a token, and release only deletes a lock that still holds the caller's,
+    so a worker that ran the call without the lock (after waiting too long)
+    never frees the lock of the worker that still has the call in flight.
+    """
+
+    def __init__(self, alias=CACHE_ALIAS):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+
+    @staticmethod
+    def _keys(key):
+        return f"singleflight:lock:{key}", f"singleflight:result:{key}"
+
+    def acquire(self, key):
+        """Returns a token if this worker now holds the lock, else None."""
+        lock_key, _ = self._keys(key)
+        token = uuid.uuid4().hex
+        return token if self.cache.add(lock_key, token, timeout=LOCK_TIMEOUT) else None
+
+    def release(self, key, result, token):
+        """Publishes the result (if any) and frees the lock when `token` still holds it."""
+        lock_key, result_key = self._keys(key)
+        if result is not None:
+            self.cache.set(result_key, result, timeout=RESULT_TTL)
+        if token is not None and self.cache.get(lock_key) == token:
+            self.cache.delete(lock_key)
+
+    def wait(self, key):
+        """Polls for the other worker's result; _MISSING if it never came or its call failed."""
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            result = self.cache.get(result_key, _MISSING)
+            if result is not _MISSING:
+                return result
+            if self.cache.get(lock_key) is None:
+                # Released without a result: one last look, then give up.
+                return self.cache.get(result_key, _MISSING)
+            time.sleep(POLL_INTERVAL)
+        return _MISSING
+
+    async def aacquire(self, key):
+        lock_key, _ = self._keys(key)
+        token = uuid.uuid4().hex
+        return token if await self.cache.aadd(lock_key, token, timeout=LOCK_TIMEOUT) else None
+
+    async def arelease(self, key, result, token):
+        lock_key, result_key = self._keys(key)
+        if result is not None:
+            await self.cache.aset(result_key, result, timeout=RESULT_TTL)
+        if token is not None and await self.cache.aget(lock_key) == token:
+            await self.cache.adelete(lock_key)
+
+    async def await_result(self, key):
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            result = await self.cache.aget(result_key, _MISSING)
+            if result is not _MISSING:
+                return result
+            if await self.cache.aget(lock_key) is None:
+                return await self.cache.aget(result_key, _MISSING)
+            await asyncio.sleep(POLL_INTERVAL)
+        return _MISSING
+
+
+class _AsyncCall:
+    """An in-flight coroutine call and how many callers are awaiting it."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls. `do(name, key, fn)` runs fn() once
+    per key at a time; `ado` does the same for coroutine functions, in a task
+    of its own that is only cancelled once every caller has been. Results of
+    None count as failures: they are handed to current waiters but never
+    published to other workers. Followers get deep copies so no caller can
+    mutate another's result.
+    """
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, name, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            metrics.registry.inc(COALESCED_METRIC, call=name, role="follower")
+            return copy.deepcopy(future.result())
+
+        try:
+            result = self._lead(name, key, fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _lead(self, name, key, fn):
+        if self.shared is None:
+            metrics.registry.inc(COALESCED_METRIC, call=name, role="leader")
+            return fn()
+        token = self.shared.acquire(key)
+        if token is None:
+            result = self.shared.wait(key)
+            if result is not _MISSING:
+                metrics.registry.inc(COALESCED_METRIC, call=name, role="remote_follower")
+                return result
+        metrics.registry.inc(COALESCED_METRIC, call=name, role="leader")
+        result = None
+        try:
+            result = fn()
+            return result
+        finally:
+            self.shared.release(key, result, token)
+
+    async def ado(self, name, key, fn):
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        call = calls.get(key)
+        follower = call is not None
+        if follower:
+            metrics.registry.inc(COALESCED_METRIC, call=name, role="follower")
+        else:
+            # The call runs in its own task so no caller's cancellation reaches the others.
+            call = calls[key] = _AsyncCall(loop.create_task(self._alead(name, key, fn)))
+            call.task.add_done_callback(lambda task: self._forget(loop, key, call))
+
+        call.waiters += 1
+        try:
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller gave up: stop the upstream call as well.
+                self._forget(loop, key, call)
+                call.task.cancel()
+            raise
+        return copy.deepcopy(result) if follower else result
+
+    def _forget(self, loop, key, call):
+        calls = self._async_calls.get(loop)
+        if calls is not None and calls.get(key) is call:
+            del calls[key]
+            if not calls:
+                del self._async_calls[loop]
+        if call.task.done() and not call.task.cancelled():
+            # Mark retrieved so a failure nobody awaited isn't logged as "never retrieved".
+            call.task.exception()
+
+    async def _alead(self, name, key, fn):
+        if self.shared is None:
+            metrics.registry.inc(COALESCED_METRIC, call=name, role="leader")
+            return await fn()
+        token = await self.shared.aacquire(key)
+        if token is None:
+            result = await self.shared.await_result(key)
+            if result is not _MISSING:
+                metrics.registry.inc(COALESCED_METRIC, call=name, role="remote_follower")
+                return result
+        metrics.registry.inc(COALESCED_METRIC, call=name, role="leader")
+        result = None
+        try:
+            result = await fn()
+            return result
+        finally:
+            await self.shared.arelease(key, result, token)
+
+
+_singleflight = None
+_singleflight_lock = threading.Lock()
+
+
+def get_singleflight():
+    """Returns the process-wide SingleFlight, or None when SINGLEFLIGHT_BACKEND=none."""
+    global _singleflight
+    if BACKEND not in ("local", "cache"):
+        return None
+    if _singleflight is None:
+        with _singleflight_lock:
+            if _singleflight is None:
+                _singleflight = SingleFlight(SharedLock() if BACKEND == "cache" else None)
+    return _singleflight
@@ -0,0 +1,25 @@
+from urllib.parse import urlencode
+
+from django import template
+from django.urls import reverse
+
+from playlist_generator import media_proxy
+
+register = template.Library()
+
+
+@register.simple_tag
+def media_proxy_enabled():
+    """"true"/"false" for inline scripts."""
+    return "true" if media_proxy.ENABLED else "false"
+
+
+@register.filter
+def proxied_art(url, size=None):
+    """Album art through the proxy, resized to `size` px (e.g. |proxied_art:48)."""
+    if not url or not media_proxy.ENABLED:
+        return url
+    params = {"url": url}
+    if size:
+        params["size"] = size
+    return f"{reverse('playlist_generator:media_art')}?{urlencode(params)}"
@@ -1,3 +1,1285 @@
-from django.test import TestCase
+import asyncio
+import functools
+import gzip
+import http.server
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.signals import request_started
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    ai_service, async_views, breaker, catalog, history, history_io, jobs, media_proxy, middleware, mood_analyzer,
+    query_index, ranking, ratelimit, services, singleflight, track_cache, views, warm_playlists, warmup,
+)
+from .ai_service import GeminiService
+from .catalog import CatalogService
+from .fake_upstreams import FakeJamendoHandler, FakeUpstream, UpstreamConfig
+from .models import MoodAnalysisCache, MoodQuery, PlaylistJob, Tag, Track, TrackTag, WarmPlaylist
+from .mood_cache import DatabaseBackend, MoodCache, normalize_text
+from .persistence import count_queries, save_mood_query
+from .services import JamendoService
+from .singleflight import SingleFlight
+from .track_cache import TrackResultCache
+
+ANALYSIS = {"genres": ["jazz"], "moods": ["sad"], "keywords": ["rain"]}
+
+
+def make_tracks(count, start=0):
+    return [
+        {
+            "id": str(1000 + i),
+            "title": f"Track {i}",
+            "artist": f"Artist {i % 7}",
+            "preview_url": f"https://prod-1.storage.jamendo.com/?trackid={1000 + i}",
+            "album_image": f"https://usercontent.jamendo.com/?type=album&id={i}",
+        }
+        for i in range(start, start + count)
+    ]
+
+
+class FreshGovernorMixin:
+    """Gives every test its own rate-limit budgets."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(ratelimit, "_governor", ratelimit.Governor(ratelimit.LocalBucketStore()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class MoodCacheTests(TestCase):
+    def test_exact_and_near_duplicate_hits(self):
+        cache = MoodCache(DatabaseBackend(), similarity=0.6)
+        cache.set("sad jazz for a rainy evening", ANALYSIS)
+        self.assertEqual(cache.get("Sad jazz for a rainy evening!"), ANALYSIS)
+        self.assertEqual(cache.get("sad jazz for rainy evenings"), ANALYSIS)
+        self.assertIsNone(cache.get("upbeat techno"))
+        self.assertEqual(cache.stats()["near_hits"], 1)
+
+    def test_word_order_and_negation_keep_keys_apart(self):
+        self.assertNotEqual(normalize_text("happy not sad"), normalize_text("sad, not happy"))
+        self.assertEqual(normalize_text("Lo-fi beats, lo-fi!"), "lofi beat")
+        cache = MoodCache(DatabaseBackend(), similarity=0.6)
+        cache.set("happy not sad", ANALYSIS)
+        self.assertEqual(cache.get("Happy, not sad"), ANALYSIS)
+        self.assertIsNone(cache.get("sad, not happy"))
+        self.assertIsNone(cache.get("happy sad"))
+        # Word order alone still gives a near-duplicate hit.
+        cache.set("rainy evening jazz", ANALYSIS)
+        self.assertEqual(cache.get("jazz for a rainy evening"), ANALYSIS)
+
+    def test_database_index_is_shared_between_workers(self):
+        writer = MoodCache(DatabaseBackend(), similarity=0.6)
+        reader = MoodCache(DatabaseBackend(), similarity=0.6)
+        writer.set("sad jazz for a rainy evening", ANALYSIS)
+        self.assertEqual(reader.get("sad jazz for rainy evenings"), ANALYSIS)
+
+    def test_last_used_at_is_only_touched_when_stale(self):
+        backend = DatabaseBackend(touch_interval=300)
+        backend.set("sad jazz", ANALYSIS)
+        recent = timezone.now() - timedelta(seconds=60)
+        MoodAnalysisCache.objects.update(last_used_at=recent)
+        with self.assertNumQueries(1):
+            self.assertEqual(backend.get("sad jazz"), ANALYSIS)
+        self.assertEqual(MoodAnalysisCache.objects.get().last_used_at, recent)
+
+        MoodAnalysisCache.objects.update(last_used_at=timezone.now() - timedelta(seconds=600))
+        with self.assertNumQueries(2):
+            backend.get("sad jazz")
+        self.assertGreater(MoodAnalysisCache.objects.get().last_used_at, recent)
+
+
+class PersistenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener", password="secret")
+
+    def test_save_mood_query_keeps_order_and_reuses_tracks(self):
+        mood_query, rows = save_mood_query(self.user, "sad jazz", ANALYSIS, make_tracks(5))
+        self.assertEqual([row["jamendo_id"] for row in rows], ["1000", "1001", "1002", "1003", "1004"])
+        self.assertEqual(set(rows[0]), {"id", "jamendo_id", "title", "artist", "preview_url", "album_image"})
+
+        _, rows = save_mood_query(self.user, "more sad jazz", ANALYSIS, make_tracks(5, start=3))
+        self.assertEqual(Track.objects.count(), 8)
+        self.assertEqual(mood_query.tracks.count(), 5)
+        self.assertEqual(MoodQuery.objects.count(), 2)
+
+    def test_save_mood_query_cost_does_not_grow_with_playlist(self):
+        counts = []
+        for size in (3, 24):
+            with count_queries() as counter:
+                save_mood_query(self.user, f"jazz {size}", ANALYSIS, make_tracks(size, start=size * 100))
+            counts.append(counter["count"])
+        self.assertEqual(counts[0], counts[1])
+
+
+class GenerateViewParityTests(FreshGovernorMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("listener", password="secret")
+        self.body = json.dumps({"user_input": "sad jazz"})
+
+    def test_sync_and_async_views_report_query_count(self):
+        with mock.patch.object(views, "find_similar", return_value=None), \
+                mock.patch.object(views, "resolve_mood", return_value=(ANALYSIS, "gemini")), \
+                mock.patch.object(views.JamendoService, "get_tracks", return_value=make_tracks(24)):
+            request = RequestFactory().post("/generate/", self.body, content_type="application/json")
+            request.user = self.user
+            sync_response = views.generate_playlist(request)
+
+        async def resolve(user_input):
+            return ANALYSIS, "gemini"
+
+        async def get_tracks(*args, **kwargs):
+            return make_tracks(24, start=100)
+
+        async def auser():
+            return self.user
+
+        with mock.patch.object(async_views, "find_similar", return_value=None), \
+                mock.patch.object(async_views, "resolve_mood_async", resolve), \
+                mock.patch.object(async_views.JamendoService, "get_tracks_async", get_tracks):
+            request = AsyncRequestFactory().post("/generate/", self.body, content_type="application/json")
+            request.user, request.auser = self.user, auser
+            async_response = async_to_sync(async_views.generate_playlist)(request)
+
+        self.assertEqual(sync_response.status_code, 200)
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response["X-DB-Query-Count"], sync_response["X-DB-Query-Count"])
+        self.assertEqual(len(json.loads(async_response.content)["tracks"]), 24)
+
+
+class StatusViewTests(TestCase):
+    def test_status_is_public_and_reveals_no_internals(self):
+        response = self.client.get(reverse("playlist_generator:api_status"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {"status", "service", "endpoints", "instructions"})
+
+    def test_diagnostics_are_staff_only(self):
+        url = reverse("playlist_generator:diagnostics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user("listener"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user("operator", is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("job_queue", response.json())
+
+    @mock.patch.dict("os.environ", {"METRICS_TOKEN": "s3cret"})
+    def test_diagnostics_accept_the_metrics_token(self):
+        url = reverse("playlist_generator:diagnostics")
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer s3cret"}).status_code, 200)
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer wrong"}).status_code, 403)
+
+    def test_metrics_are_staff_only_without_a_token(self):
+        url = reverse("playlist_generator:metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer "}).status_code, 403)
+        self.client.force_login(User.objects.create_user("operator", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @mock.patch.dict("os.environ", {"METRICS_TOKEN": "s3cret"})
+    def test_metrics_accept_the_metrics_token(self):
+        url = reverse("playlist_generator:metrics")
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer s3cret"}).status_code, 200)
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer s3cre"}).status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_threads_share_one_call(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"tracks": [1, 2]}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("test", "key", fn)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(flight.do("test", "key", fn)))
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(results, [{"tracks": [1, 2]}] * 2)
+        self.assertEqual(len(calls), 1)
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return {"tracks": [1, 2]}
+
+        leader = asyncio.ensure_future(flight.ado("test", "key", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado("test", "key", fn))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await follower, {"tracks": [1, 2]})
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight._async_calls, {})
+
+    async def test_call_is_cancelled_once_every_caller_is(self):
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.ado("test", "key", fn)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        self.assertEqual(flight._async_calls, {})
+
+    async def test_failures_reach_every_caller(self):
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        results = await asyncio.gather(
+            flight.ado("test", "key", fn), flight.ado("test", "key", fn), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_timed_out_follower_leaves_the_leaders_lock(self):
+        shared = singleflight.SharedLock()
+        self.addCleanup(shared.cache.clear)
+        token = shared.acquire("key")
+        with mock.patch.object(singleflight, "WAIT_TIMEOUT", 0.1):
+            result = SingleFlight(singleflight.SharedLock()).do("test", "key", lambda: {"tracks": [1]})
+        self.assertEqual(result, {"tracks": [1]})
+        # The other worker still holds its lock, so a third one keeps waiting instead of calling.
+        self.assertIsNone(shared.acquire("key"))
+        shared.release("key", {"tracks": [2]}, token)
+        self.assertIsNotNone(shared.acquire("key"))
+
+
+class RateLimitTests(FreshGovernorMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("listener")
+        self.client.force_login(self.user)
+        self.url = reverse("playlist_generator:generate_playlist_batch")
+
+    def post_batch(self, size):
+        body = json.dumps({"user_inputs": [f"sad jazz {i}" for i in range(size)]})
+        with mock.patch.object(views, "resolve_moods_batch", side_effect=lambda inputs, _: [(ANALYSIS, "local")] * len(inputs)), \
+                mock.patch.object(views.JamendoService, "get_tracks_batch",
+                                  side_effect=lambda analyses, limit: [make_tracks(3)] * len(analyses)):
+            return self.client.post(self.url, body, content_type="application/json")
+
+    def test_batch_limit_never_exceeds_the_client_bucket(self):
+        self.assertLessEqual(views.BATCH_MAX_INPUTS, ratelimit.CLIENT_LIMITS["generate"][0])
+
+    def test_oversized_batch_is_rejected_not_throttled(self):
+        response = self.post_batch(views.BATCH_MAX_INPUTS + 5)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(int(response["X-RateLimit-Remaining"]), ratelimit.CLIENT_LIMITS["generate"][0] - 1)
+
+    def test_full_bucket_batch_then_retry_after(self):
+        self.assertEqual(self.post_batch(views.BATCH_MAX_INPUTS).status_code, 200)
+        response = self.post_batch(1)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    def test_cost_above_capacity_is_charged_as_a_full_bucket(self):
+        governor = ratelimit.Governor(ratelimit.LocalBucketStore(), client_limits={"generate": (5, 1.0)})
+        self.assertEqual(governor.check_client("generate", "ip:1", cost=50), (5, 0))
+        with self.assertRaises(ratelimit.RateLimited):
+            governor.check_client("generate", "ip:1")
+
+    def test_pruning_keeps_empty_buckets(self):
+        store = ratelimit.LocalBucketStore()
+        store.MAX_KEYS = 2
+        clock = mock.Mock(return_value=1000.0)
+        with mock.patch.object(ratelimit.time, "time", clock):
+            # A spent 10/h bucket and two that refill within a second.
+            self.assertTrue(store.take("transfer:ip:1", 10, 10 / 3600, 10, 0)[1])
+            store.take("public:ip:2", 1, 1.0, 1, 0)
+            store.take("public:ip:3", 1, 1.0, 1, 0)
+            clock.return_value += 120
+            store.take("public:ip:4", 1, 1.0, 1, 0)
+            self.assertEqual(set(store._buckets), {"transfer:ip:1", "public:ip:4"})
+            self.assertFalse(store.take("transfer:ip:1", 10, 10 / 3600, 1, 0)[1])
+
+
+class MediaProxyTests(FreshGovernorMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.source = tempfile.mkdtemp()
+        with open(os.path.join(cls.source, "preview.mp3"), "wb") as f:
+            f.write(b"ID3" + bytes(range(256)) * 40)
+        with open(os.path.join(cls.source, "other.mp3"), "wb") as f:
+            f.write(b"ID3" + bytes(range(256)) * 20)
+        handler = functools.partial(QuietHandler, directory=cls.source)
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.source, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        for patcher in (
+            mock.patch.object(media_proxy, "ENABLED", True),
+            mock.patch.object(media_proxy, "ALLOWED_HOSTS", ["127.0.0.1"]),
+            mock.patch.object(media_proxy, "_cache", media_proxy.MediaCache(cache_dir)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fetch_caches_the_file(self):
+        url = f"{self.base}/preview.mp3"
+        path = media_proxy.fetch(media_proxy.PREVIEW, url)
+        self.assertEqual(path.read_bytes()[:3], b"ID3")
+        requests_made = len(QuietHandler.requests)
+        self.assertEqual(media_proxy.fetch(media_proxy.PREVIEW, url), path)
+        self.assertEqual(len(QuietHandler.requests), requests_made)
+
+    def test_fetch_without_singleflight(self):
+        with mock.patch.object(media_proxy, "get_singleflight", return_value=None):
+            path = media_proxy.fetch(media_proxy.PREVIEW, f"{self.base}/preview.mp3")
+        self.assertTrue(path.exists())
+
+    def test_disallowed_hosts_are_refused(self):
+        with self.assertRaises(media_proxy.MediaError) as raised:
+            media_proxy.fetch(media_proxy.PREVIEW, "https://example.com/preview.mp3")
+        self.assertEqual(raised.exception.status, 400)
+
+
+    def test_album_art_is_resized(self):
+        from PIL import Image
+
+        with open(os.path.join(self.source, "cover.png"), "wb") as f:
+            Image.new("RGB", (300, 200), (200, 10, 10)).save(f, "PNG")
+        path = media_proxy.fetch(media_proxy.ART, f"{self.base}/cover.png", 48)
+        with Image.open(path) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ("JPEG", (48, 32)))
+
+    def test_missing_pillow_is_logged(self):
+        with mock.patch.dict("sys.modules", {"PIL": None}), \
+                mock.patch.object(media_proxy, "_warned_no_pillow", False), \
+                self.assertLogs("playlist_generator.media_proxy", "WARNING"):
+            self.assertEqual(media_proxy._thumbnail(b"not an image", 48), b"not an image")
+
+    def test_redirects_off_the_allowlist_are_refused(self):
+        url = f"{self.base}/redirect?to=http://localhost:{self.server.server_port}/preview.mp3"
+        with self.assertRaises(media_proxy.MediaError) as raised:
+            media_proxy.fetch(media_proxy.PREVIEW, url)
+        self.assertEqual(raised.exception.status, 502)
+
+        path = media_proxy.fetch(media_proxy.PREVIEW, f"{self.base}/redirect?to=/preview.mp3")
+        self.assertEqual(path.read_bytes()[:3], b"ID3")
+
+    def test_only_downloads_are_rate_limited(self):
+        url = reverse("playlist_generator:media_preview")
+        preview = f"{self.base}/preview.mp3"
+        with mock.patch.dict(ratelimit.CLIENT_LIMITS, {"media": (1, 1 / 60)}):
+            self.assertEqual(self.client.get(url, {"url": preview}).status_code, 200)
+            for _ in range(3):
+                self.assertEqual(self.client.get(url, {"url": preview}).status_code, 200)
+            response = self.client.get(url, {"url": f"{self.base}/other.mp3"})
+        self.assertEqual(response.status_code, 429)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves a directory and records request paths instead of logging them."""
+
+    requests = []
+
+    def do_GET(self):
+        if self.path.startswith("/redirect?to="):
+            self.send_response(302)
+            self.send_header("Location", self.path.split("=", 1)[1])
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        self.requests.append(self.path)
+
+
+class QueryIndexTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        for patcher in (
+            mock.patch.object(query_index, "ENABLED", True),
+            mock.patch.object(query_index, "_index", query_index.QueryIndex(os.path.join(directory, "index.bin"))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        with self.captureOnCommitCallbacks(execute=True):
+            save_mood_query(self.alice, "rainy day jazz to study with", ANALYSIS, make_tracks(24))
+
+    def test_similar_inputs_reuse_the_users_own_history(self):
+        analysis, tracks = query_index.find_similar("Rainy day jazz, to study with!", 10, self.alice)
+        self.assertEqual(analysis, ANALYSIS)
+        self.assertEqual(len(tracks), 10)
+        self.assertIsNone(query_index.find_similar("heavy metal workout", 10, self.alice))
+
+    def test_other_users_history_is_never_used(self):
+        self.assertIsNone(query_index.find_similar("rainy day jazz to study with", 10, self.bob))
+        self.assertIsNone(query_index.find_similar("rainy day jazz to study with", 10, AnonymousUser()))
+        self.assertIsNone(query_index.find_similar("rainy day jazz to study with", 10, None))
+
+    def test_users_own_match_is_found_behind_closer_rows_of_others(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                save_mood_query(self.bob, "rainy day jazz to study with", ANALYSIS, make_tracks(24, start=100))
+        with mock.patch.object(query_index, "NEIGHBOURS", 1):
+            self.assertIsNotNone(query_index.find_similar("rainy day jazz to study with", 10, self.alice))
+
+    def test_deleted_queries_are_not_reused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            MoodQuery.objects.filter(user=self.alice).delete()
+        self.assertIsNone(query_index.find_similar("rainy day jazz to study with", 10, self.alice))
+
+
+def mock_pipeline(module):
+    """Patches a module's Gemini and Jamendo steps with canned results."""
+    return mock.patch.multiple(
+        module,
+        find_similar=mock.Mock(return_value=None),
+        resolve_mood=mock.Mock(return_value=(ANALYSIS, "gemini")),
+    ), mock.patch.object(module.JamendoService, "get_tracks", return_value=make_tracks(24))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener")
+        for patcher in mock_pipeline(jobs):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_identical_requests_share_a_job(self):
+        job, created = jobs.enqueue(self.user, "sad jazz")
+        again, created_again = jobs.enqueue(self.user, "Sad  jazz!")
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.id, job.id)
+
+    def test_claim_run_and_succeed(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        claimed = jobs.claim()
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts), (job.id, PlaylistJob.RUNNING, 1))
+        self.assertIsNone(jobs.claim())
+        jobs.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.stage), (PlaylistJob.SUCCEEDED, "done"))
+        self.assertEqual(job.mood_query.tracks.count(), 24)
+
+    def test_failed_attempts_are_retried_then_fail(self):
+        jobs.resolve_mood.return_value = ({"error": "Gemini is down"}, "gemini")
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            PlaylistJob.objects.filter(id=job.id).update(run_after=timezone.now())
+            jobs.run(jobs.claim())
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual((job.status, job.error), (PlaylistJob.FAILED, "Gemini is down"))
+
+    def test_takeover_after_save_reuses_the_playlist(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        first = jobs.claim()
+        saved = jobs.generate(first)
+        # The first worker dies before recording success; its lease runs out.
+        PlaylistJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        second = jobs.claim()
+        self.assertEqual(second.attempts, 2)
+        jobs.run(second)
+        job.refresh_from_db()
+        self.assertEqual(job.mood_query_id, saved.id)
+        self.assertEqual(MoodQuery.objects.count(), 1)
+
+    def test_concurrent_saves_keep_the_first(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        claimed = jobs.claim()
+        first = jobs._persist(claimed, ANALYSIS, make_tracks(24), "gemini")
+        second = jobs._persist(claimed, ANALYSIS, make_tracks(24), "gemini")
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(MoodQuery.objects.count(), 1)
+
+    def test_other_users_jobs_are_hidden(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        self.client.force_login(User.objects.create_user("other"))
+        response = self.client.get(reverse("playlist_generator:job_status", args=[job.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class RunJobsViewTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener")
+        for patcher in mock_pipeline(jobs):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch.dict("os.environ", {"CRON_SECRET": "cron"})
+    def test_cron_request_drains_the_queue(self):
+        url = reverse("playlist_generator:run_jobs")
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={"Authorization": "Bearer wrong"}).status_code, 403)
+
+        response = self.client.get(url, headers={"Authorization": "Bearer cron"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["ran"], 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlaylistJob.SUCCEEDED)
+
+    def test_drain_returns_on_time_and_leaves_a_short_lease(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        release = threading.Event()
+
+        def slow_analysis(user_input):
+            release.wait(5)
+            return ANALYSIS, "gemini"
+
+        with mock.patch.object(jobs, "resolve_mood", side_effect=slow_analysis):
+            started = timezone.now()
+            self.assertEqual(jobs.drain(seconds=0.5, concurrency=1, attempt_seconds=0.3), 0)
+            self.assertLess((timezone.now() - started).total_seconds(), 2)
+            job.refresh_from_db()
+            self.assertEqual(job.status, PlaylistJob.RUNNING)
+            self.assertLessEqual(job.locked_until, timezone.now() + timedelta(seconds=0.3))
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name.startswith("job-worker-"):
+                    thread.join(5)
+
+    def test_drain_claims_nothing_without_time_for_an_attempt(self):
+        job, _ = jobs.enqueue(self.user, "sad jazz")
+        self.assertEqual(jobs.drain(seconds=0.2, concurrency=1, attempt_seconds=1), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlaylistJob.QUEUED)
+
+
+class HistoryTransferTests(FreshGovernorMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("listener", password="secret")
+        self.other = User.objects.create_user("importer", password="secret")
+        self.created_at = timezone.now() - timedelta(days=30)
+        for i in range(3):
+            mood_query, _ = save_mood_query(self.user, f"sad jazz {i}", ANALYSIS, make_tracks(4, start=i * 4))
+            MoodQuery.objects.filter(id=mood_query.id).update(created_at=self.created_at + timedelta(hours=i))
+
+    def export(self, fmt):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("playlist_generator:export_history"), {"format": fmt})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(
+            chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in response.streaming_content
+        )
+
+    def post_import(self, body, **params):
+        self.client.force_login(self.other)
+        url = reverse("playlist_generator:import_history")
+        if params:
+            url += "?" + "&".join(f"{k}={v}" for k, v in params.items())
+        return self.client.post(url, body, content_type="application/x-ndjson")
+
+    def test_ndjson_round_trip_keeps_order_and_times(self):
+        response = self.post_import(self.export("ndjson"))
+        self.assertEqual(json.loads(response.content), {"success": True, "imported": 3, "skipped": 0})
+
+        imported = MoodQuery.objects.filter(user=self.other).order_by("created_at")
+        self.assertEqual([q.user_input for q in imported], ["sad jazz 0", "sad jazz 1", "sad jazz 2"])
+        self.assertEqual(imported[0].created_at, self.created_at)
+        self.assertEqual(
+            list(MoodQuery.tracks.through.objects.filter(moodquery=imported[1])
+                 .order_by("id").values_list("track__jamendo_id", flat=True)),
+            ["1004", "1005", "1006", "1007"],
+        )
+        self.assertEqual(Track.objects.count(), 12)
+
+        # Re-running the same import is a no-op.
+        response = self.post_import(self.export("ndjson"))
+        self.assertEqual(json.loads(response.content)["skipped"], 3)
+
+    def test_csv_round_trip(self):
+        response = self.post_import(self.export("csv"), format="csv")
+        self.assertEqual(json.loads(response.content)["imported"], 3)
+        imported = MoodQuery.objects.filter(user=self.other).first()
+        self.assertEqual(imported.generated_keywords, ANALYSIS)
+        self.assertEqual(imported.tracks.count(), 4)
+
+    def test_oversized_body_is_rejected_before_reading(self):
+        with mock.patch.object(history_io, "IMPORT_MAX_BYTES", 100):
+            response = self.post_import(self.export("ndjson"))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(MoodQuery.objects.filter(user=self.other).exists())
+
+    def test_too_many_records_saves_nothing(self):
+        with mock.patch.object(history_io, "IMPORT_MAX_RECORDS", 2), \
+                mock.patch.object(history_io, "import_history",
+                                  functools.partial(history_io.import_history, batch_size=1)):
+            response = self.post_import(self.export("ndjson"))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(MoodQuery.objects.filter(user=self.other).exists())
+
+    def test_invalid_record_is_a_bad_request(self):
+        response = self.post_import(b'{"user_input": "ok"}\n{"tracks": []}\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Record 2", json.loads(response.content)["error"])
+        self.assertFalse(MoodQuery.objects.filter(user=self.other).exists())
+
+
+class WarmupTests(SimpleTestCase):
+    def test_blocking_warmup_waits_for_the_first_request(self):
+        with mock.patch.object(warmup, "ON_START", "blocking"), \
+                mock.patch.object(warmup, "_started", False), \
+                mock.patch.object(warmup, "warmup") as run:
+            self.addCleanup(request_started.disconnect, dispatch_uid="warmup_on_start")
+            warmup.start_warmup_on_first_request()
+            run.assert_not_called()
+            request_started.send(sender=self.__class__)
+            request_started.send(sender=self.__class__)
+        run.assert_called_once_with()
+
+    def test_off_never_hooks_requests(self):
+        with mock.patch.object(warmup, "ON_START", "off"), mock.patch.object(warmup, "warmup") as run:
+            warmup.start_warmup_on_first_request()
+            request_started.send(sender=self.__class__)
+        run.assert_not_called()
+
+    def test_schema_stays_a_module_level_name(self):
+        schema = ai_service.MoodAnalysisSchema
+        self.assertIs(schema, ai_service.get_schema())
+        self.assertEqual(schema.__module__, ai_service.__name__)
+        self.assertEqual(ai_service.generate_configs()[1]["response_schema"], list[schema])
+        self.assertEqual(schema(genres=["jazz"], moods=["sad"], keywords=["rain"]).model_dump(), ANALYSIS)
+
+
+class StreamPlaylistTests(FreshGovernorMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("listener")
+        self.client.force_login(self.user)
+        self.url = reverse("playlist_generator:stream_playlist")
+
+    def stream(self, analysis, tiers):
+        body = json.dumps({"user_input": "sad jazz"})
+        with mock.patch.object(views, "find_similar", return_value=None), \
+                mock.patch.object(views, "resolve_mood", return_value=(analysis, "local")), \
+                mock.patch.object(views.JamendoService, "iter_tracks", return_value=iter(tiers)):
+            response = self.client.post(self.url, body, content_type="application/json")
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_events_arrive_per_tier_then_done(self):
+        events = self.stream(ANALYSIS, [("exact", make_tracks(2)), ("genre_mood", make_tracks(3, start=2))])
+        self.assertEqual([e["event"] for e in events], ["analysis", "tracks", "tracks", "done"])
+        self.assertEqual(events[0]["analysis_source"], "local")
+        self.assertEqual([e["tier"] for e in events[1:3]], ["exact", "genre_mood"])
+        self.assertEqual(len(events[-1]["tracks"]), 5)
+        self.assertEqual(MoodQuery.objects.get(id=events[-1]["query_id"]).tracks.count(), 5)
+
+    def test_analysis_error_ends_the_stream(self):
+        events = self.stream({"error": "Gemini is down"}, [])
+        self.assertEqual(events, [{"event": "error", "error": "Gemini is down"}])
+        self.assertFalse(MoodQuery.objects.exists())
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener", password="secret")
+        other = User.objects.create_user("other")
+        now = timezone.now()
+        for i in range(7):
+            mood_query, _ = save_mood_query(self.user, f"sad jazz {i}", ANALYSIS, make_tracks(2, start=i * 2))
+            # Pairs share a timestamp, so the cursor has to break ties on id.
+            MoodQuery.objects.filter(id=mood_query.id).update(created_at=now - timedelta(minutes=i // 2))
+        save_mood_query(other, "not mine", ANALYSIS, make_tracks(2))
+
+    def test_pages_walk_the_history_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            queries, cursor = history.get_history_page(self.user, cursor, limit=3)
+            seen.extend(q.user_input for q in queries)
+            if cursor is None:
+                break
+        # Newest first; within a shared timestamp the higher id first.
+        self.assertEqual(seen, [f"sad jazz {i}" for i in (1, 0, 3, 2, 5, 4, 6)])
+
+    def test_page_cost_does_not_depend_on_position(self):
+        _, cursor = history.get_history_page(self.user, limit=2)
+        counts = []
+        for page_cursor in (None, cursor):
+            with count_queries() as counter:
+                history.get_history_page(self.user, page_cursor, limit=2)
+            counts.append(counter["count"])
+        self.assertEqual(counts[0], counts[1])
+
+    def test_api_rejects_bad_cursor(self):
+        self.client.force_login(self.user)
+        url = reverse("playlist_generator:history_api")
+        self.assertEqual(self.client.get(url, {"cursor": "not-a-cursor"}).status_code, 400)
+        data = json.loads(self.client.get(url, {"limit": 5}).content)
+        self.assertEqual(len(data["queries"]), 5)
+        self.assertEqual(len(data["queries"][0]["tracks"]), 2)
+        data = json.loads(self.client.get(url, {"cursor": data["next_cursor"]}).content)
+        self.assertEqual([q["user_input"] for q in data["queries"]], ["sad jazz 4", "sad jazz 6"])
+        self.assertIsNone(data["next_cursor"])
+
+
+class LocalAnalyzerTests(TestCase):
+    def setUp(self):
+        self.analyzer = mood_analyzer.LocalMoodAnalyzer(threshold=0.8)
+
+    def test_lexicon_answers_inputs_that_name_tags(self):
+        self.assertEqual(
+            self.analyzer.analyze("Energetic rock for the gym"),
+            {"genres": ["rock"], "moods": ["energetic"], "keywords": ["workout"]},
+        )
+        self.assertIsNone(self.analyzer.analyze("something for my grandmother's birthday"))
+        # A genre alone is not enough to skip Gemini.
+        self.assertIsNone(self.analyzer.analyze("hip hop workout"))
+
+    def test_classifier_learns_from_gemini_analyses_only(self):
+        user = User.objects.create_user("listener")
+        analysis = {"genres": ["jazz"], "moods": ["romantic"], "keywords": []}
+        for _ in range(mood_analyzer.MIN_SUPPORT):
+            MoodQuery.objects.create(user=user, user_input="velvet evening", generated_keywords=analysis)
+            MoodQuery.objects.create(user=user, user_input="velvet haze", generated_keywords=ANALYSIS,
+                                     analysis_source="local")
+        self.assertEqual(self.analyzer.analyze("velvet evening"), analysis)
+        self.assertEqual(self.analyzer.get_classifier().samples, mood_analyzer.MIN_SUPPORT)
+
+    def test_resolve_mood_only_calls_gemini_when_unsure(self):
+        with mock.patch.object(mood_analyzer, "_analyzer", self.analyzer), \
+                mock.patch.object(mood_analyzer, "ENABLED", True), \
+                mock.patch.object(mood_analyzer.GeminiService, "analyze_mood", return_value=ANALYSIS) as gemini:
+            self.assertEqual(mood_analyzer.resolve_mood("sad jazz")[1], "local")
+            gemini.assert_not_called()
+            self.assertEqual(mood_analyzer.resolve_mood("a long day at the office"), (ANALYSIS, "gemini"))
+            gemini.assert_called_once()
+
+    def test_gemini_failure_degrades_to_local_guess(self):
+        with mock.patch.object(mood_analyzer, "_analyzer", self.analyzer), \
+                mock.patch.object(mood_analyzer, "ENABLED", True), \
+                mock.patch.object(mood_analyzer.GeminiService, "analyze_mood", return_value={"error": "down"}):
+            analysis, source = mood_analyzer.resolve_mood("hip hop workout")
+            self.assertEqual((analysis["genres"], source), (["hiphop"], "degraded"))
+            self.assertEqual(mood_analyzer.resolve_mood("a long day at the office"), ({"error": "down"}, "gemini"))
+
+
+class WarmPlaylistTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(warm_playlists, "ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        warm_playlists.WarmPlaylistService.store("Jazz", "Sad", "Rain", 10, make_tracks(10))
+
+    def test_lookup_uses_first_genre_mood_and_keyword(self):
+        service = warm_playlists.WarmPlaylistService
+        self.assertEqual(len(service.lookup(["jazz", "pop"], ["sad"], ["rain", "night"], 4, extra=2)), 6)
+        self.assertIsNone(service.lookup(["jazz"], ["sad"], ["rain"], 11))
+        self.assertIsNone(service.lookup(["jazz"], ["sad"], [], 4))
+        self.assertIsNone(service.lookup([], ["sad"], ["rain"], 4))
+
+    def test_stale_sets_are_ignored(self):
+        WarmPlaylist.objects.update(refreshed_at=timezone.now() - timedelta(seconds=warm_playlists.MAX_AGE + 1))
+        self.assertIsNone(warm_playlists.WarmPlaylistService.lookup(["jazz"], ["sad"], ["rain"], 4))
+
+    def test_warm_set_answers_without_searching(self):
+        fetch = mock.Mock(side_effect=AssertionError("searched live"))
+        tiers = list(JamendoService.iter_tracks(["jazz"], ["sad"], ["rain"], limit=4, fetch=fetch))
+        self.assertEqual([tier for tier, _ in tiers], ["warm"])
+        self.assertEqual(len(tiers[0][1]), 4)
+
+
+class QueryEtagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener")
+        self.client.force_login(self.user)
+        self.mood_query, _ = save_mood_query(self.user, "sad jazz", ANALYSIS, make_tracks(3))
+        self.url = reverse("playlist_generator:get_query", args=[self.mood_query.id])
+
+    def test_matching_etag_gets_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)["tracks"]), 3)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_deleted_or_foreign_query_is_not_found(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.force_login(User.objects.create_user("other"))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+        self.mood_query.delete()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    payload = json.dumps({"tracks": make_tracks(40)}).encode()
+
+    def respond(self, content=None, content_type="application/json", encoding="gzip, br", etag='"q1-1-v1"'):
+        def get_response(request):
+            response = HttpResponse(self.payload if content is None else content, content_type=content_type)
+            if etag:
+                response["ETag"] = etag
+            return response
+
+        request = RequestFactory().get("/api/query/1/", HTTP_ACCEPT_ENCODING=encoding)
+        return middleware.compression_middleware(get_response)(request)
+
+    def test_gzip_weakens_etag_and_varies(self):
+        with mock.patch.object(middleware, "brotli", None):
+            response = self.respond()
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.payload)
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertEqual(response["ETag"], 'W/"q1-1-v1"')
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_brotli_preferred_when_installed_and_accepted(self):
+        fake_brotli = mock.Mock()
+        fake_brotli.compress.return_value = b"br"
+        with mock.patch.object(middleware, "brotli", fake_brotli):
+            self.assertEqual(self.respond()["Content-Encoding"], "br")
+            self.assertEqual(self.respond(encoding="gzip, br;q=0")["Content-Encoding"], "gzip")
+            response = self.respond(encoding="identity")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, self.payload)
+        self.assertEqual(response["ETag"], '"q1-1-v1"')
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_small_or_unlisted_responses_are_left_alone(self):
+        small = b"x" * (middleware.COMPRESS_MIN_BYTES - 1)
+        self.assertFalse(self.respond(content=small).has_header("Content-Encoding"))
+        self.assertTrue(self.respond(content=small + b"xx").has_header("Content-Encoding"))
+        # HTML carries CSRF tokens (BREACH); images are already compressed.
+        for content_type in ("text/html; charset=utf-8", "image/jpeg"):
+            response = self.respond(content_type=content_type)
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertFalse(response.has_header("Vary"))
+
+    def test_streaming_responses_are_skipped(self):
+        def get_response(request):
+            return StreamingHttpResponse(iter([self.payload]), content_type="application/json")
+
+        request = RequestFactory().get("/generate/stream/", HTTP_ACCEPT_ENCODING="gzip")
+        response = middleware.compression_middleware(get_response)(request)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(response.streaming_content), self.payload)
+
+
+class BreakerTests(SimpleTestCase):
+    def test_opens_after_failures_then_probes_once(self):
+        cb = breaker.CircuitBreaker("test", failures=2, open_seconds=60)
+        cb.failure()
+        self.assertTrue(cb.allow())
+        cb.failure()
+        self.assertEqual(cb.state, breaker.OPEN)
+        self.assertFalse(cb.allow())
+
+        cb.opened_at -= 60
+        self.assertTrue(cb.allow())
+        self.assertEqual(cb.state, breaker.HALF_OPEN)
+        # Only one probe at a time while half-open.
+        self.assertFalse(cb.allow())
+        cb.success()
+        self.assertEqual(cb.state, breaker.CLOSED)
+        self.assertTrue(cb.allow())
+
+    def test_failed_probe_reopens(self):
+        cb = breaker.CircuitBreaker("test", failures=1, open_seconds=60)
+        cb.failure()
+        cb.opened_at -= 60
+        self.assertTrue(cb.allow())
+        cb.failure()
+        self.assertEqual(cb.snapshot()["state"], breaker.OPEN)
+        self.assertGreater(cb.snapshot()["retry_in"], 0)
+
+    def test_slow_calls_count_as_failures(self):
+        cb = breaker.CircuitBreaker("test", failures=2, slow_seconds=1.0)
+        cb.success(elapsed=5.0)
+        cb.success(elapsed=5.0)
+        self.assertTrue(cb.is_open)
+
+    def test_open_jamendo_breaker_fails_fast(self):
+        with mock.patch.dict(breaker._breakers, clear=True), \
+                mock.patch("playlist_generator.services.get_session") as get_session:
+            jamendo = breaker.get_breaker("jamendo")
+            for _ in range(jamendo.failure_threshold):
+                jamendo.failure()
+            self.assertIsNone(JamendoService._request({"tags": "jazz"}))
+        get_session.assert_not_called()
+
+
+class RankingTests(SimpleTestCase):
+    @staticmethod
+    def track(i, artist, genres, moods=()):
+        return {"id": str(i), "artist": artist, "tags": {"genres": list(genres), "vartags": list(moods)}}
+
+    def test_relevance_first_with_artists_spread_out(self):
+        tracks = [
+            self.track(0, "A", ["rock"]),
+            self.track(1, "B", ["jazz"], ["sad"]),
+            self.track(2, "B", ["jazz"], ["sad"]),
+            self.track(3, "B", ["jazz"], ["sad"]),
+            self.track(4, "C", ["jazz"], ["sad"]),
+            self.track(5, "D", ["jazz"]),
+        ]
+        ranked = [t["id"] for t in ranking.rank(tracks, ["jazz"], ["sad"], [], 6)]
+        # The untagged-for-this-mood rock track drops to the end; artist C
+        # jumps ahead of B's second and third tracks.
+        self.assertEqual(ranked[:2], ["1", "4"])
+        self.assertEqual(ranked[-1], "0")
+        self.assertEqual(len(ranking.rank(tracks, ["jazz"], ["sad"], [], 3)), 3)
+
+    def test_without_tags_keeps_tier_order(self):
+        tracks = [self.track(i, f"Artist {i}", []) for i in range(5)]
+        self.assertEqual([t["id"] for t in ranking.rank(tracks, ["jazz"], ["sad"], [], 3)], ["0", "1", "2"])
+
+
+class BenchmarkTests(FreshGovernorMixin, SimpleTestCase):
+    def test_fake_jamendo_speaks_the_tracks_api(self):
+        jamendo = FakeUpstream(FakeJamendoHandler, UpstreamConfig(latency=0)).start()
+        self.addCleanup(jamendo.stop)
+        with mock.patch.object(services, "TRACKS_URL", f"{jamendo.url}/v3.0/tracks/"), \
+                mock.patch.dict(breaker._breakers, clear=True):
+            tracks = JamendoService._request({"tags": "jazz+sad", "limit": 5})
+        self.assertEqual(len(tracks), 5)
+        self.assertEqual(set(tracks[0]), set(make_tracks(1)[0]) | {"tags"})
+        self.assertEqual(tracks[0]["tags"]["genres"], ["jazz", "sad"])
+        self.assertEqual(jamendo.requests, 1)
+
+    @skipUnless(connection.vendor == "sqlite", "the benchmark creates its own test database")
+    def test_benchmark_report_against_fake_upstreams(self):
+        output = os.path.join(tempfile.mkdtemp(), "report.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        subprocess.run(
+            [
+                sys.executable, "manage.py", "benchmark", "--requests", "4", "--concurrency", "2",
+                "--endpoints", "generate", "get_query", "--jamendo-latency", "0", "--gemini-latency", "0",
+                "--history-size", "5", "--output", output,
+            ],
+            cwd=settings.BASE_DIR, check=True, capture_output=True,
+        )
+        with open(output) as f:
+            report = json.load(f)
+        self.assertEqual(set(report["results"]), {"generate", "get_query"})
+        for result in report["results"].values():
+            self.assertEqual((result["requests"], result["errors"]), (4, 0))
+            self.assertGreater(result["throughput_rps"], 0)
+            self.assertLessEqual(result["latency_ms"]["p50"], result["latency_ms"]["p95"])
+            self.assertLessEqual(result["latency_ms"]["p95"], result["latency_ms"]["p99"])
+            self.assertGreater(result["db_queries"]["mean"], 0)
+        self.assertGreater(report["results"]["generate"]["upstream_calls"]["jamendo"], 0)
+
+
+class TieredSearchTests(SimpleTestCase):
+    TIERS = ["genre_mood", "mood_keyword", "mood", "genre", "keyword"]
+
+    def staggered_fetch(self, delays, per_pass=4, overlap=2):
+        """Fake fetch: pass n sleeps delays[n] and returns tracks overlapping the previous pass's."""
+        calls = []
+        lock = threading.Lock()
+        tags = ["jazz+sad", "sad+rain", "sad", "jazz", "rain"]
+
+        def fetch(params):
+            n = tags.index(params.get("tags") or params.get("fuzzytags"))
+            tier = self.TIERS[n]
+            with lock:
+                calls.append(tier)
+            time.sleep(delays[n])
+            return make_tracks(per_pass, start=n * (per_pass - overlap))
+
+        return fetch, calls
+
+    def tiers(self, fetch, limit, concurrent=True):
+        with mock.patch.object(services.CatalogService, "enabled", return_value=False):
+            return list(JamendoService.iter_tracks(["jazz"], ["sad"], ["rain"], limit, concurrent, fetch, warm=False))
+
+    def test_results_merge_in_tier_order_when_later_tiers_finish_first(self):
+        fetch, _ = self.staggered_fetch([0.2, 0.15, 0.1, 0.05, 0.0])
+        tiers = self.tiers(fetch, limit=100)
+        self.assertEqual([tier for tier, _ in tiers], self.TIERS)
+        ids = [track["id"] for _, batch in tiers for track in batch]
+        # Each pass overlaps the one before it by two tracks; those are merged once.
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids, [track["id"] for track in make_tracks(12)])
+
+    def test_passes_run_concurrently(self):
+        fetch, _ = self.staggered_fetch([0.2] * 5)
+        start = time.perf_counter()
+        self.tiers(fetch, limit=100)
+        self.assertLess(time.perf_counter() - start, 0.6)
+
+    def test_passes_not_started_are_cancelled_at_stop_at(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        fetch, calls = self.staggered_fetch([0.05] * 5, per_pass=10, overlap=0)
+        with mock.patch.object(services, "_get_executor", return_value=executor):
+            tiers = self.tiers(fetch, limit=10)
+        executor.shutdown(wait=True)
+        self.assertEqual([tier for tier, _ in tiers], ["genre_mood"])
+        # The free worker may already have picked up the next pass; the rest never start.
+        self.assertEqual(calls[0], "genre_mood")
+        self.assertLessEqual(len(calls), 2)
+
+    def test_sequential_passes_only_ask_for_what_is_missing(self):
+        limits = []
+
+        def fetch(params):
+            limits.append(params["limit"])
+            return make_tracks(3, start=len(limits) * 3)
+
+        self.tiers(fetch, limit=7, concurrent=False)
+        self.assertEqual(limits, [7, 4, 1])
+
+
+class TrackCacheTests(SimpleTestCase):
+    PARAMS = {"tags": "sad+jazz", "order": "popularity_week", "limit": 10}
+
+    def make_cache(self, **kwargs):
+        cache = TrackResultCache(**{"order_ttls": {"popularity_week": 60, "popularity_total": 600},
+                                    "default_ttl": 30, "stale_ttl": 300, "min_page": 24, **kwargs})
+        cache.cache.clear()
+        self.addCleanup(cache.cache.clear)
+        return cache
+
+    def test_key_ignores_limit_and_tag_order(self):
+        key = TrackResultCache.make_key(self.PARAMS)
+        self.assertEqual(key, TrackResultCache.make_key({**self.PARAMS, "limit": 50}))
+        self.assertEqual(key, TrackResultCache.make_key({**self.PARAMS, "tags": "Jazz+sad"}))
+        self.assertNotEqual(key, TrackResultCache.make_key({**self.PARAMS, "order": "popularity_total"}))
+
+    def test_ttl_depends_on_order(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.ttl_for(self.PARAMS), 60)
+        self.assertEqual(cache.ttl_for({**self.PARAMS, "order": "popularity_total"}), 600)
+        self.assertEqual(cache.ttl_for({"tags": "sad"}), 30)
+        with mock.patch.object(cache.cache, "set") as cache_set:
+            cache.set({**self.PARAMS, "order": "popularity_total"}, 24, make_tracks(24))
+        self.assertEqual(cache_set.call_args.kwargs["timeout"], 600 + 300)
+
+    def test_page_size_is_clamped(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.page_size(5), 24)
+        self.assertEqual(cache.page_size(50), 50)
+        self.assertEqual(cache.page_size(500), 200)
+
+    def test_larger_page_answers_smaller_limits(self):
+        cache = self.make_cache()
+        cache.set(self.PARAMS, 24, make_tracks(24))
+        tracks, status = cache.get(self.PARAMS, 10)
+        self.assertEqual(status, track_cache.FRESH)
+        self.assertEqual(tracks, make_tracks(10))
+        self.assertEqual(cache.get(self.PARAMS, 30), (None, track_cache.MISS))
+
+    def test_short_page_answers_any_limit(self):
+        cache = self.make_cache()
+        # Jamendo returned fewer tracks than asked for: there are no more to fetch.
+        cache.set(self.PARAMS, 24, make_tracks(5))
+        self.assertEqual(cache.get(self.PARAMS, 100), (make_tracks(5), track_cache.FRESH))
+
+    def test_stale_entry_is_served_and_refreshed_once(self):
+        cache = self.make_cache(order_ttls={"popularity_week": 0})
+        cache.set(self.PARAMS, 24, make_tracks(24))
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        requests = []
+
+        def request(params):
+            requests.append(params)
+            release.wait(2)
+            return make_tracks(24, start=100)
+
+        with mock.patch.object(services, "get_track_cache", return_value=cache), \
+                mock.patch.object(services, "_get_executor", return_value=executor), \
+                mock.patch.object(JamendoService, "_request", side_effect=request):
+            self.assertEqual(JamendoService._fetch(self.PARAMS), make_tracks(10))
+            self.assertEqual(JamendoService._fetch(self.PARAMS), make_tracks(10))
+            release.set()
+            executor.shutdown(wait=True)
+        self.assertEqual(requests, [{**self.PARAMS, "limit": 24}])
+        self.assertEqual(cache.get(self.PARAMS, 10)[0], make_tracks(10, start=100))
+        # The refresh slot is released for the next time the entry goes stale.
+        self.assertTrue(cache.begin_refresh(self.PARAMS))
+
+
+class CatalogTests(TestCase):
+    def ingest(self, *specs):
+        """Ingests (jamendo_id, listens, tag names) tuples; tags are split into genres and vartags."""
+        return CatalogService.ingest([
+            {**make_tracks(1, start=int(jamendo_id) - 1000)[0], "listens": listens,
+             "tags": {"genres": [t for t in names if t == "jazz"], "vartags": [t for t in names if t != "jazz"]}}
+            for jamendo_id, listens, names in specs
+        ])
+
+    def ids(self, params):
+        return [track["id"] for track in CatalogService.search(params)]
+
+    def test_tags_must_all_match(self):
+        self.ingest(("1000", 5, ["jazz", "sad"]), ("1001", 50, ["jazz"]), ("1002", 9, ["jazz", "sad", "rain"]))
+        self.assertEqual(self.ids({"tags": "jazz+sad", "limit": 10}), ["1002", "1000"])
+        self.assertEqual(self.ids({"tags": "jazz+sad+rain", "limit": 10}), ["1002"])
+        self.assertEqual(self.ids({"tags": "jazz", "limit": 2}), ["1001", "1002"])
+
+    def test_fuzzytags_rank_by_matches_then_listens(self):
+        self.ingest(
+            ("1000", 5, ["jazz", "sad"]), ("1001", 50, ["jazz"]), ("1002", 9, ["sad", "rain"]),
+            ("1003", 99, ["techno"]),
+        )
+        self.assertEqual(self.ids({"fuzzytags": "jazz+sad+rain", "limit": 10}), ["1002", "1000", "1001"])
+        track = CatalogService.search({"fuzzytags": "rain", "limit": 1})[0]
+        self.assertEqual(track["id"], "1002")
+        self.assertEqual(track["tags"]["genres"], [])
+        self.assertCountEqual(track["tags"]["vartags"], ["sad", "rain"])
+
+    def test_ingest_upserts_without_duplicating_tags(self):
+        self.assertEqual(self.ingest(("1000", 5, ["jazz", "sad"]), ("1001", 7, ["sad"])), (2, 0))
+        self.assertEqual(self.ingest(("1000", 80, ["jazz", "rain"]), ("1002", 1, ["sad"])), (1, 1))
+        self.assertEqual(Track.objects.filter(catalog_synced_at__isnull=False).count(), 3)
+        track = Track.objects.get(jamendo_id="1000")
+        self.assertEqual(track.listens, 80)
+        self.assertEqual(
+            sorted(TrackTag.objects.filter(track=track).values_list("tag__name", flat=True)), ["jazz", "rain"]
+        )
+        self.assertEqual(TrackTag.objects.count(), 4)
+        self.assertEqual(Tag.objects.filter(name="sad").count(), 1)
+
+    def test_live_search_tops_up_below_min_fill(self):
+        self.ingest(("1000", 5, ["jazz", "sad"]), ("1001", 4, ["jazz", "sad"]))
+        calls = []
+
+        def fetch(params):
+            calls.append(params)
+            return make_tracks(5, start=10)
+
+        def tiers(min_fill):
+            with mock.patch.object(catalog, "MODE", "local"), mock.patch.object(services, "MIN_FILL", min_fill):
+                return [tier for tier, _ in JamendoService.iter_tracks(["jazz"], ["sad"], [], 5, False, fetch,
+                                                                      warm=False)]
+
+        self.assertEqual(tiers(0.4), ["catalog_genre_mood"])
+        self.assertEqual(calls, [])
+        self.assertEqual(tiers(1.0), ["catalog_genre_mood", "genre_mood"])
+        self.assertEqual(calls[0]["limit"], 3)
+
+
+class BatchAnalysisTests(FreshGovernorMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = MoodCache(DatabaseBackend(), similarity=1.0)
+        for target, value in (
+            ("get_mood_cache", self.cache),
+            ("get_breaker", breaker.CircuitBreaker("gemini-test")),
+        ):
+            patcher = mock.patch.object(ai_service, target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {"GEMINI_API_KEY": "test-key"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def analysis(text):
+        return {"genres": ["jazz"], "moods": [text.split()[0]], "keywords": [text]}
+
+    def fake_chunks(self):
+        chunks = []
+
+        def analyze_chunk(api_key, chunk):
+            chunks.append(list(chunk))
+            return [self.analysis(text) for text in chunk]
+
+        return mock.patch.object(GeminiService, "_analyze_chunk", side_effect=analyze_chunk), chunks
+
+    def test_results_align_with_duplicates_and_cache_hits(self):
+        self.cache.set("calm piano", ANALYSIS)
+        inputs = ["sad rain", "calm piano", "happy sun", "sad rain", "Calm piano!"]
+        patcher, chunks = self.fake_chunks()
+        with patcher:
+            results = GeminiService.analyze_moods_batch(inputs)
+        self.assertEqual(chunks, [["sad rain", "happy sun"]])
+        self.assertEqual(results, [
+            self.analysis("sad rain"), ANALYSIS, self.analysis("happy sun"), self.analysis("sad rain"), ANALYSIS,
+        ])
+        # Duplicates get their own copies, and fresh analyses are cached for next time.
+        self.assertIsNot(results[0], results[3])
+        self.assertEqual(self.cache.get("happy sun"), self.analysis("happy sun"))
+
+    def test_misses_are_split_by_chunk_size(self):
+        inputs = [f"mood {i}" for i in range(5)]
+        patcher, chunks = self.fake_chunks()
+        with patcher:
+            results = GeminiService.analyze_moods_batch(inputs, chunk_size=2)
+        self.assertEqual(chunks, [["mood 0", "mood 1"], ["mood 2", "mood 3"], ["mood 4"]])
+        self.assertEqual(results, [self.analysis(text) for text in inputs])
+
+    def generate(self, items):
+        client = mock.Mock()
+        client.models.generate_content.return_value = mock.Mock(parsed=None, text=json.dumps(items))
+        return mock.patch.object(ai_service, "get_genai_client", return_value=client), client
+
+    def test_chunk_uses_one_structured_call(self):
+        chunk = ["sad rain", "happy sun"]
+        patcher, client = self.generate([self.analysis(text) for text in chunk])
+        with patcher, mock.patch.object(GeminiService, "analyze_mood") as analyze_mood:
+            self.assertEqual(GeminiService._analyze_chunk("test-key", chunk), [self.analysis(t) for t in chunk])
+        self.assertEqual(client.models.generate_content.call_count, 1)
+        analyze_mood.assert_not_called()
+
+    def test_misaligned_chunk_falls_back_to_single_calls(self):
+        chunk = ["sad rain", "happy sun"]
+        patcher, client = self.generate([self.analysis("sad rain")])
+        with patcher, mock.patch.object(GeminiService, "analyze_mood", side_effect=self.analysis) as analyze_mood:
+            self.assertEqual(GeminiService._analyze_chunk("test-key", chunk), [self.analysis(t) for t in chunk])
+        self.assertEqual([c.args[0] for c in analyze_mood.call_args_list], chunk)
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENABLED = os.getenv("JAMENDO_CACHE_ENABLED", "True").lower() in ("true", "1", "yes")
+# Django cache alias holding the results; point it at Redis/Memcached to share across workers.
+CACHE_ALIAS = os.getenv("JAMENDO_CACHE_ALIAS", "default")
+# Seconds a cached page stays fresh, per Jamendo "order" value.
+ORDER_TTLS = {
+    "popularity_week": int(os.getenv("JAMENDO_CACHE_TTL_WEEK", str(6 * 3600))),
+    "popularity_month": int(os.getenv("JAMENDO_CACHE_TTL_MONTH", str(12 * 3600))),
+    "popularity_total": int(os.getenv("JAMENDO_CACHE_TTL_TOTAL", str(24 * 3600))),
+}
+DEFAULT_TTL = int(os.getenv("JAMENDO_CACHE_TTL", "3600"))
+# Extra seconds a stale page may be served while it is refreshed in the background.
+STALE_TTL = int(os.getenv("JAMENDO_CACHE_STALE_TTL", "3600"))
+# Pages are fetched at least this large so one entry can serve smaller limits.
+MIN_PAGE = int(os.getenv("JAMENDO_CACHE_MIN_PAGE", "24"))
+# Jamendo rejects limits above 200.
+MAX_PAGE = 200
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+def _normalize_value(key, value):
+    value = str(value).strip().lower()
+    if key in ("tags", "fuzzytags"):
+        # "focus+chillout" and "chillout+focus" are the same AND query.
+        value = "+".join(sorted(part for part in value.split("+") if part))
+    return value
+
+
+class TrackResultCache:
+    """
+    Caches Jamendo track pages keyed on the normalized query parameters
+    (everything except "limit"). Each entry remembers the page size it was
+    fetched with, so a larger cached page also answers smaller limits.
+    """
+
+    def __init__(self, alias=CACHE_ALIAS, order_ttls=None, default_ttl=DEFAULT_TTL,
+                 stale_ttl=STALE_TTL, min_page=MIN_PAGE):
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+        self.order_ttls = order_ttls if order_ttls is not None else ORDER_TTLS
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.min_page = min_page
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(params):
+        normalized = sorted(
+            (k, _normalize_value(k, v)) for k, v in params.items() if k != "limit"
+        )
+        raw = "&".join(f"{k}={v}" for k, v in normalized)
+        return f"jamendo_tracks:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def ttl_for(self, params):
+        return self.order_ttls.get(params.get("order"), self.default_ttl)
+
+    def page_size(self, limit):
+        """Page size to request upstream for a given limit."""
+        return min(max(int(limit), self.min_page), MAX_PAGE)
+
+    def get(self, params, limit):
+        """Returns (tracks, status) where status is FRESH, STALE or MISS."""
+        return self._resolve(self.cache.get(self.make_key(params)), limit)
+
+    async def aget(self, params, limit):
+        return self._resolve(await self.cache.aget(self.make_key(params)), limit)
+
+    def _resolve(self, entry, limit):
+        if entry is None:
+            return None, MISS
+        limit = int(limit)
+        tracks = entry["tracks"]
+        # A short page means Jamendo had no more results, so it covers any limit.
+        if entry["limit"] < limit and len(tracks) >= entry["limit"]:
+            return None, MISS
+        status = FRESH if time.time() < entry["fresh_until"] else STALE
+        return tracks[:limit], status
+
+    def _entry(self, params, limit, tracks):
+        ttl = self.ttl_for(params)
+        entry = {"limit": int(limit), "tracks": tracks, "fresh_until": time.time() + ttl}
+        return self.make_key(params), entry, ttl + self.stale_ttl
+
+    def set(self, params, limit, tracks):
+        key, entry, timeout = self._entry(params, limit, tracks)
+        self.cache.set(key, entry, timeout=timeout)
+
+    async def aset(self, params, limit, tracks):
+        key, entry, timeout = self._entry(params, limit, tracks)
+        await self.cache.aset(key, entry, timeout=timeout)
+
+    def begin_refresh(self, params):
+        """Claims the background refresh for a stale key; False if one is already running."""
+        key = self.make_key(params)
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, params):
+        with self._lock:
+            self._refreshing.discard(self.make_key(params))
+
+
+_track_cache = None
+_track_cache_lock = threading.Lock()
+
+
+def get_track_cache():
+    """Returns the process-wide TrackResultCache, or None when JAMENDO_CACHE_ENABLED is off."""
+    global _track_cache
+    if not ENABLED:
+        return None
+    if _track_cache is None:
+        with _track_cache_lock:
+            if _track_cache is None:
+                _track_cache = TrackResultCache()
+    return _track_cache
@@ -1,12 +1,34 @@
+import os
+
 from django.urls import path
 from . import views
+from . import async_views
 
 app_name = 'playlist_generator'
 
+# Serve the async endpoints when running under ASGI (see async_views.py).
+if os.getenv("ASYNC_VIEWS", "False").lower() in ("true", "1", "yes"):
+    generation_views = async_views
+else:
+    generation_views = views
+
 urlpatterns = [
-    path('generate/', views.generate_playlist, name='generate_playlist'),
+    path('generate/', generation_views.generate_playlist, name='generate_playlist'),
+    path('generate/stream/', views.stream_playlist, name='stream_playlist'),
+    path('generate/batch/', views.generate_playlist_batch, name='generate_playlist_batch'),
+    path('generate/jobs/', views.enqueue_playlist, name='enqueue_playlist'),
     path('api/status/', views.api_status, name='api_status'),
-    path('api/public/generate/', views.public_generate_playlist, name='public_generate_playlist'),
-    path('api/query/<int:query_id>/', views.get_query, name='get_query'),
+    path('api/diagnostics/', views.diagnostics, name='diagnostics'),
+    path('api/metrics/', views.metrics_view, name='metrics'),
+    path('api/warmup/', views.warmup_view, name='warmup'),
+    path('api/public/generate/', generation_views.public_generate_playlist, name='public_generate_playlist'),
+    path('api/history/', views.history_api, name='history_api'),
+    path('api/history/export/', views.export_history, name='export_history'),
+    path('api/history/import/', views.import_history, name='import_history'),
+    path('api/query/<int:query_id>/', generation_views.get_query, name='get_query'),
     path('api/query/<int:query_id>/delete/', views.delete_query, name='delete_query'),
+    path('api/jobs/run/', views.run_jobs, name='run_jobs'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('media/preview/', views.media_preview, name='media_preview'),
+    path('media/art/', views.media_art, name='media_art'),
 ]
@@ -1,12 +1,27 @@
+import hmac
 import json
 import logging
+import math
+import os
+from datetime import timedelta
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
-from .models import MoodQuery, Track
+from . import breaker, history_io, jobs, media_proxy, metrics, query_index, warmup
+from .models import MoodQuery, PlaylistJob, Track
 from .services import JamendoService
-from .ai_service import GeminiService
+from .mood_analyzer import resolve_mood, resolve_moods_batch
+from .mood_cache import get_mood_cache
+from .persistence import count_queries, save_mood_query
+from .query_index import SOURCE_SIMILAR, find_similar
+from .history import PAGE_SIZE, TRACK_FIELDS, get_history_page, serialize_query
+from .ratelimit import CLIENT_LIMITS, RateLimited, get_governor, rate_limit, rate_limited_response, upstream_retry_after
+from .responses import FastJsonResponse, dumps, query_etag, query_payload
 
 logger = logging.getLogger(__name__)
 
@@ -27,8 +42,114 @@ def api_status(request):
         "instructions": "You can test the API by clicking the example_test_link or by changing the 'user_input' parameter in the URL."
     })
 
+def _is_operator(request, token_names=("METRICS_TOKEN",)):
+    """Staff users, or callers presenting one of the named tokens (environment variables) as a bearer token."""
+    presented = request.headers.get("Authorization", "")
+    for name in token_names:
+        token = os.getenv(name)
+        if token and hmac.compare_digest(presented.encode(), f"Bearer {token}".encode()):
+            return True
+    return request.user.is_authenticated and request.user.is_staff
+
+@require_http_methods(["GET"])
+def diagnostics(request):
+    """Caches, rate budgets, breakers, the query index and the job queue of this worker. Staff only."""
+    if not _is_operator(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    mood_cache = get_mood_cache()
+    governor = get_governor()
+    index = query_index.get_query_index()
+    return JsonResponse({
+        "mood_cache": mood_cache.stats() if mood_cache else None,
+        "rate_limits": governor.usage() if governor else None,
+        "circuit_breakers": breaker.snapshot(),
+        "media_cache": media_proxy.get_media_cache().stats() if media_proxy.ENABLED else None,
+        "query_index": index.stats() if index else None,
+        "job_queue": jobs.stats(),
+    })
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Prometheus-style per-stage latency histograms for this worker process.
+    Staff only; scrapers send `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    if not _is_operator(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+@rate_limit("public")
+def warmup_view(request):
+    """
+    Builds pooled clients and loads the lazily imported libraries in this
+    process (see warmup.py). Point a scheduled ping here to keep instances warm.
+    """
+    return JsonResponse({"status": "warm", "timings_ms": warmup.warmup()})
+
+def _proxied_media(request, kind, size=None):
+    if not media_proxy.ENABLED:
+        raise Http404("Media proxy is disabled")
+    url = request.GET.get('url', '')
+    try:
+        try:
+            return media_proxy.serve(request, media_proxy.fetch(kind, url, size))
+        except FileNotFoundError:
+            # Evicted between lookup and open; fetch it again.
+            return media_proxy.serve(request, media_proxy.fetch(kind, url, size))
+    except media_proxy.MediaError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+def _media_cost(kind):
+    """Only downloads take a "media" token; files already in the cache are free."""
+    def cost(request):
+        if not media_proxy.ENABLED:
+            return 0
+        try:
+            size = int(request.GET.get('size', 0)) if kind == media_proxy.ART else 0
+        except ValueError:
+            return 0
+        return 0 if media_proxy.is_cached(kind, request.GET.get('url', ''), size or None) else 1
+    return cost
+
+@require_http_methods(["GET", "HEAD"])
+@rate_limit("media", cost=_media_cost(media_proxy.PREVIEW))
+def media_preview(request):
+    """Audio preview through the on-disk media cache, with Range support: ?url=<preview_url>."""
+    return _proxied_media(request, media_proxy.PREVIEW)
+
+@require_http_methods(["GET", "HEAD"])
+@rate_limit("media", cost=_media_cost(media_proxy.ART))
+def media_art(request):
+    """Album art through the media cache, optionally resized: ?url=<album_image>&size=48."""
+    try:
+        size = int(request.GET.get('size', 0))
+    except ValueError:
+        return JsonResponse({'error': 'size must be an integer'}, status=400)
+    if not 0 <= size <= media_proxy.MAX_IMAGE_SIZE:
+        return JsonResponse({'error': f'size must be between 0 and {media_proxy.MAX_IMAGE_SIZE}'}, status=400)
+    return _proxied_media(request, media_proxy.ART, size or None)
+
+def no_tracks_response():
+    """
+    404, 429 when the searches came back empty because the Jamendo budget
+    ran out, or 503 while Jamendo's circuit breaker is open and no stored
+    tracks matched.
+    """
+    retry_after = upstream_retry_after("jamendo")
+    if retry_after > 0:
+        return rate_limited_response(RateLimited("jamendo", retry_after))
+    jamendo = breaker.get_breaker("jamendo").snapshot()
+    if jamendo["state"] != breaker.CLOSED:
+        response = JsonResponse({'error': 'Music search is temporarily unavailable.'}, status=503)
+        response["Retry-After"] = str(max(1, math.ceil(jamendo["retry_in"])))
+        return response
+    return JsonResponse({'error': 'No tracks found for the given mood'}, status=404)
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@rate_limit("public")
 def public_generate_playlist(request):
     """Public version of the generate_playlist endpoint. Supports GET for easy browser testing."""
     try:
@@ -42,39 +163,48 @@ def public_generate_playlist(request):
         if not user_input:
             return JsonResponse({'error': 'User input is required'}, status=400)
 
-        # 1. Analyze mood with Gemini
-        ai_response = GeminiService.analyze_mood(user_input)
-        if 'error' in ai_response:
-            return JsonResponse(ai_response, status=500)
-            
-        genres = ai_response.get('genres', [])
-        moods = ai_response.get('moods', [])
-        keywords = ai_response.get('keywords', [])
-        
-        # 2. Fetch tracks from Jamendo
-        jamendo_tracks = JamendoService.get_tracks(genres, moods, keywords, limit=10)
+        # 0. Reuse one of the user's near-identical past queries (no Gemini or Jamendo calls)
+        similar = find_similar(user_input, 10, request.user)
+        if similar:
+            (ai_response, jamendo_tracks), source = similar, SOURCE_SIMILAR
+        else:
+            # 1. Analyze mood (local analyzer, Gemini when it isn't confident)
+            ai_response, source = resolve_mood(user_input)
+            if 'error' in ai_response:
+                return JsonResponse(ai_response, status=500)
+
+            genres = ai_response.get('genres', [])
+            moods = ai_response.get('moods', [])
+            keywords = ai_response.get('keywords', [])
+
+            # 2. Fetch tracks from Jamendo
+            jamendo_tracks = JamendoService.get_tracks(genres, moods, keywords, limit=10)
         
         if not jamendo_tracks:
-            return JsonResponse({'error': 'No tracks found for the given mood'}, status=404)
+            return no_tracks_response()
 
         # 3. Format response (Skip saving to DB for public/anonymous testing if desired, or save to a default 'anonymous' user)
         # For simplicity in this public test, we just return the tracks without saving to DB history.
         
-        return JsonResponse({
+        return FastJsonResponse({
             'message': 'Public test successful',
             'user_input': user_input,
             'keywords': ai_response,
+            'analysis_source': source,
             'tracks': jamendo_tracks
         })
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         logger.exception("An error occurred during public playlist generation")
         return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
 
 @login_required
 @require_http_methods(["POST"])
+@rate_limit("generate")
 def generate_playlist(request):
     try:
         data = json.loads(request.body)
@@ -83,85 +213,379 @@ def generate_playlist(request):
         if not user_input:
             return JsonResponse({'error': 'User input is required'}, status=400)
 
-        # 1. Analyze mood with Gemini
-        ai_response = GeminiService.analyze_mood(user_input)
-        if 'error' in ai_response:
-            return JsonResponse(ai_response, status=500)
-            
-        genres = ai_response.get('genres', [])
-        moods = ai_response.get('moods', [])
-        keywords = ai_response.get('keywords', [])
-        
-        # 2. Fetch tracks from Jamendo using tiered search strategy
-        jamendo_tracks = JamendoService.get_tracks(genres, moods, keywords, limit=24)
+        # 0. Reuse one of the user's near-identical past queries (no Gemini or Jamendo calls)
+        similar = find_similar(user_input, 24, request.user)
+        if similar:
+            (ai_response, jamendo_tracks), source = similar, SOURCE_SIMILAR
+        else:
+            # 1. Analyze mood (local analyzer, Gemini when it isn't confident)
+            ai_response, source = resolve_mood(user_input)
+            if 'error' in ai_response:
+                return JsonResponse(ai_response, status=500)
+
+            genres = ai_response.get('genres', [])
+            moods = ai_response.get('moods', [])
+            keywords = ai_response.get('keywords', [])
+
+            # 2. Fetch tracks from Jamendo using tiered search strategy
+            jamendo_tracks = JamendoService.get_tracks(genres, moods, keywords, limit=24)
         
         if not jamendo_tracks:
-            return JsonResponse({'error': 'No tracks found for the given mood'}, status=404)
+            return no_tracks_response()
 
-        # 3. Save to database
-        mood_query = MoodQuery.objects.create(
-            user=request.user,
-            user_input=user_input,
-            generated_keywords=ai_response
-        )
+        # 3. Save to database (bulk, single transaction)
+        with metrics.span("persist"), count_queries() as queries:
+            mood_query, saved_tracks = save_mood_query(request.user, user_input, ai_response, jamendo_tracks, source)
 
-        saved_tracks = []
-        for track_data in jamendo_tracks:
-            track, created = Track.objects.get_or_create(
-                jamendo_id=track_data['id'],
-                defaults={
-                    'title': track_data['title'],
-                    'artist': track_data['artist'],
-                    'preview_url': track_data['preview_url'],
-                    'album_image': track_data.get('album_image', '')
-                }
-            )
-            mood_query.tracks.add(track)
-            
-            # Add to response
-            track_dict = {
-                'id': track.id,
-                'jamendo_id': track.jamendo_id,
-                'title': track.title,
-                'artist': track.artist,
-                'preview_url': track.preview_url,
-                'album_image': track.album_image
-            }
-            saved_tracks.append(track_dict)
-            
-        return JsonResponse({
+        response = FastJsonResponse({
             'query_id': mood_query.id,
             'user_input': mood_query.user_input,
             'keywords': mood_query.generated_keywords,
+            'analysis_source': mood_query.analysis_source,
             'tracks': saved_tracks
         })
+        response['X-DB-Query-Count'] = queries['count']
+        return response
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         logger.exception("An error occurred during playlist generation")
         return JsonResponse({'error': 'An unexpected error occurred while generating your playlist.'}, status=500)
 
+# Upper bound on inputs accepted by one batch request. Each input costs a
+# "generate" token, so a batch may not be larger than that bucket holds.
+BATCH_MAX_INPUTS = int(os.getenv("BATCH_MAX_INPUTS", "50"))
+if CLIENT_LIMITS["generate"] is not None:
+    BATCH_MAX_INPUTS = min(BATCH_MAX_INPUTS, int(CLIENT_LIMITS["generate"][0]))
+
+def _batch_cost(request):
+    """One client token per input in the batch; malformed or oversized batches (answered 400) cost one."""
+    try:
+        user_inputs = json.loads(request.body).get('user_inputs')
+    except (json.JSONDecodeError, AttributeError):
+        return 1
+    if not isinstance(user_inputs, list) or not 0 < len(user_inputs) <= BATCH_MAX_INPUTS:
+        return 1
+    return len(user_inputs)
+
+@login_required
+@require_http_methods(["POST"])
+@rate_limit("generate", cost=_batch_cost)
+def generate_playlist_batch(request):
+    """
+    Generates and saves playlists for many inputs at once:
+    {"user_inputs": ["...", ...], "chunk_size": 20}. Moods are analyzed with
+    one Gemini call per chunk and the Jamendo searches share identical tiers.
+    Returns one result (or per-item error) per input, in order.
+    """
+    try:
+        data = json.loads(request.body)
+        user_inputs = data.get('user_inputs', [])
+
+        if not isinstance(user_inputs, list) or not user_inputs:
+            return JsonResponse({'error': 'user_inputs must be a non-empty list'}, status=400)
+        if len(user_inputs) > BATCH_MAX_INPUTS:
+            return JsonResponse({'error': f'At most {BATCH_MAX_INPUTS} inputs per batch'}, status=400)
+        if not all(isinstance(text, str) and text.strip() for text in user_inputs):
+            return JsonResponse({'error': 'Every user input must be a non-empty string'}, status=400)
+        chunk_size = data.get('chunk_size')
+        if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+            return JsonResponse({'error': 'chunk_size must be a positive integer'}, status=400)
+
+        # 1. Analyze all moods locally, the rest with chunked structured Gemini calls
+        resolved = resolve_moods_batch(user_inputs, chunk_size)
+        analyses = [analysis for analysis, _ in resolved]
+
+        # 2. Fan out the Jamendo searches with shared tiers
+        track_lists = JamendoService.get_tracks_batch(analyses, limit=24)
+
+        # 3. Save each playlist
+        results = []
+        with metrics.span("persist"):
+            for user_input, (analysis, source), jamendo_tracks in zip(user_inputs, resolved, track_lists):
+                if 'error' in analysis:
+                    results.append({'user_input': user_input, 'error': analysis['error']})
+                    continue
+                if not jamendo_tracks:
+                    results.append({'user_input': user_input, 'error': 'No tracks found for the given mood'})
+                    continue
+                mood_query, saved_tracks = save_mood_query(request.user, user_input, analysis, jamendo_tracks, source)
+                results.append({
+                    'query_id': mood_query.id,
+                    'user_input': mood_query.user_input,
+                    'keywords': mood_query.generated_keywords,
+                    'analysis_source': mood_query.analysis_source,
+                    'tracks': saved_tracks
+                })
+
+        return FastJsonResponse({'results': results})
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        logger.exception("An error occurred during batch playlist generation")
+        return JsonResponse({'error': 'An unexpected error occurred while generating your playlists.'}, status=500)
+
+def _ndjson(event, **payload):
+    return dumps({'event': event, **payload}) + b"\n"
+
+@login_required
+@require_http_methods(["POST"])
+@rate_limit("generate")
+def stream_playlist(request):
+    """
+    Streaming variant of generate_playlist. Emits newline-delimited JSON events:
+    "analysis" as soon as the mood is analyzed, "tracks" for each search tier
+    as it completes, then "done" with the saved query (or "error").
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    user_input = data.get('user_input', '')
+    if not user_input:
+        return JsonResponse({'error': 'User input is required'}, status=400)
+    user = request.user
+
+    def events():
+        try:
+            # 0. Reuse one of the user's near-identical past queries (no Gemini or Jamendo calls)
+            similar = find_similar(user_input, 24, user)
+            if similar:
+                (ai_response, similar_tracks), source = similar, SOURCE_SIMILAR
+                tiers = [(SOURCE_SIMILAR, similar_tracks)]
+            else:
+                # 1. Analyze mood (local analyzer, Gemini when it isn't confident)
+                ai_response, source = resolve_mood(user_input)
+                if 'error' in ai_response:
+                    yield _ndjson('error', error=ai_response['error'])
+                    return
+                tiers = JamendoService.iter_tracks(
+                    ai_response.get('genres', []),
+                    ai_response.get('moods', []),
+                    ai_response.get('keywords', []),
+                    limit=24,
+                )
+            yield _ndjson('analysis', user_input=user_input, keywords=ai_response, analysis_source=source)
+
+            # 2. Stream each search tier as it is merged
+            jamendo_tracks = []
+            for tier, batch in tiers:
+                jamendo_tracks.extend(batch)
+                yield _ndjson('tracks', tier=tier, tracks=[
+                    {
+                        'jamendo_id': t['id'],
+                        'title': t['title'],
+                        'artist': t['artist'],
+                        'preview_url': t['preview_url'],
+                        'album_image': t['album_image'],
+                    }
+                    for t in batch
+                ])
+
+            if not jamendo_tracks:
+                retry_after = upstream_retry_after("jamendo")
+                if retry_after > 0:
+                    yield _ndjson('error', error='Too many requests. Please try again shortly.', retry_after=math.ceil(retry_after))
+                else:
+                    yield _ndjson('error', error='No tracks found for the given mood')
+                return
+
+            # 3. Save to database
+            with metrics.span("persist"):
+                mood_query, saved_tracks = save_mood_query(user, user_input, ai_response, jamendo_tracks, source)
+            yield _ndjson('done', query_id=mood_query.id, tracks=saved_tracks)
+        except RateLimited as e:
+            yield _ndjson('error', error='Too many requests. Please try again shortly.', retry_after=math.ceil(e.retry_after))
+        except Exception:
+            logger.exception("An error occurred during streamed playlist generation")
+            yield _ndjson('error', error='An unexpected error occurred while generating your playlist.')
+
+    response = StreamingHttpResponse(events(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_http_methods(["POST"])
+@rate_limit("generate")
+def enqueue_playlist(request):
+    """
+    Job variant of generate_playlist: queues the generation and returns 202
+    with the job id at once. Poll status_url for progress and the result.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+    user_input = data.get('user_input', '')
+    if not user_input:
+        return JsonResponse({'error': 'User input is required'}, status=400)
+
+    try:
+        job, created = jobs.enqueue(request.user, user_input[:500])
+    except Exception as e:
+        logger.exception("An error occurred while queueing playlist generation")
+        return JsonResponse({'error': 'An unexpected error occurred while queueing your playlist.'}, status=500)
+
+    status_url = reverse('playlist_generator:job_status', args=[job.id])
+    response = JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'deduplicated': not created,
+        'status_url': status_url,
+    }, status=202)
+    response['Location'] = status_url
+    return response
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def run_jobs(request):
+    """
+    Runs due playlist jobs inside this request (jobs.drain) for hosts without
+    background workers, such as Vercel: its cron calls this with CRON_SECRET.
+    Other schedulers can send JOB_RUN_TOKEN; staff users may call it too.
+    """
+    if not _is_operator(request, ("CRON_SECRET", "JOB_RUN_TOKEN")):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    ran = jobs.drain()
+    pruned = jobs.prune(timezone.now() - timedelta(seconds=jobs.RETENTION_SECONDS))
+    return JsonResponse({'ran': ran, 'pruned': pruned, 'queue': jobs.stats()})
+
+@login_required
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    """Progress of a queued generation; includes the saved query once it has succeeded."""
+    job = PlaylistJob.objects.filter(id=job_id, user=request.user).values(
+        'id', 'status', 'stage', 'attempts', 'error', 'mood_query_id', 'run_after', 'created_at', 'finished_at'
+    ).first()
+    if job is None:
+        raise Http404("No PlaylistJob matches the given query.")
+
+    payload = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'attempts': job['attempts'],
+        'max_attempts': jobs.MAX_ATTEMPTS,
+        'error': job['error'] or None,
+        'created_at': job['created_at'].isoformat(),
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+    }
+    if job['status'] == PlaylistJob.SUCCEEDED and job['mood_query_id']:
+        query = MoodQuery.objects.filter(id=job['mood_query_id']).values(
+            'id', 'user_input', 'generated_keywords', 'created_at'
+        ).first()
+        if query is not None:
+            tracks = list(Track.objects.filter(mood_queries__id=query['id']).values(*TRACK_FIELDS))
+            payload['query'] = query_payload(query, tracks)
+    response = FastJsonResponse(payload)
+    if job['status'] in jobs.ACTIVE:
+        response['Retry-After'] = str(max(1, math.ceil(jobs.POLL_INTERVAL)))
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
 @login_required
 @require_http_methods(["GET"])
 def get_query(request, query_id):
-    query = get_object_or_404(MoodQuery, id=query_id, user=request.user)
-    tracks = [{
-        'id': t.id,
-        'title': t.title,
-        'artist': t.artist,
-        'preview_url': t.preview_url,
-        'album_image': t.album_image
-    } for t in query.tracks.all()]
-    
-    return JsonResponse({
-        'query_id': query.id,
-        'user_input': query.user_input,
-        'keywords': query.generated_keywords,
-        'created_at': query.created_at.isoformat(),
-        'tracks': tracks
+    """
+    Saved queries are immutable, so the response carries an ETag and a
+    matching If-None-Match gets a 304 after a single indexed lookup.
+    """
+    query = MoodQuery.objects.filter(id=query_id, user=request.user).values(
+        'id', 'user_input', 'generated_keywords', 'created_at'
+    ).first()
+    if query is None:
+        raise Http404("No MoodQuery matches the given query.")
+
+    etag = query_etag(query['id'], query['created_at'])
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        tracks = list(Track.objects.filter(mood_queries__id=query_id).values(*TRACK_FIELDS))
+        response = FastJsonResponse(query_payload(query, tracks))
+    response['ETag'] = etag
+    # Revalidate every time: the query may have been deleted since.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+def history_api(request):
+    """Cursor-paginated history for infinite scroll: ?cursor=<next_cursor>&limit=<n>."""
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+        queries, next_cursor = get_history_page(request.user, request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+
+    return FastJsonResponse({
+        'queries': [serialize_query(q) for q in queries],
+        'next_cursor': next_cursor
     })
 
+@login_required
+@require_http_methods(["GET"])
+@rate_limit("transfer")
+def export_history(request):
+    """
+    Streams the user's whole history with tracks: ?format=ndjson (default)
+    or csv. Read in chunks, so memory stays flat for any history size.
+    """
+    fmt = request.GET.get('format', history_io.NDJSON)
+    if fmt not in history_io.FORMATS:
+        return JsonResponse({'error': f"format must be one of {', '.join(history_io.FORMATS)}"}, status=400)
+    response = StreamingHttpResponse(
+        history_io.export_lines(history_io.iter_history(request.user), fmt),
+        content_type=history_io.FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="mood-jockey-history.{fmt}"'
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_http_methods(["POST"])
+@rate_limit("transfer")
+def import_history(request):
+    """
+    Imports an export file sent as the request body (NDJSON, or CSV with
+    ?format=csv or a text/csv content type) into the user's history. The
+    body is read line by line and saved in batches, all in one transaction:
+    a file over HISTORY_IMPORT_MAX_BYTES / HISTORY_IMPORT_MAX_RECORDS gets a
+    413 and an invalid one a 400, and neither saves anything.
+    """
+    fmt = request.GET.get('format') or (history_io.CSV if request.content_type == 'text/csv' else history_io.NDJSON)
+    if fmt not in history_io.FORMATS:
+        return JsonResponse({'error': f"format must be one of {', '.join(history_io.FORMATS)}"}, status=400)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > history_io.IMPORT_MAX_BYTES:
+        return JsonResponse(
+            {'error': f'Import too large: the file is larger than {history_io.IMPORT_MAX_BYTES} bytes'}, status=413
+        )
+    try:
+        with transaction.atomic():
+            totals = history_io.import_history(
+                history_io.parse_lines(history_io.limit_lines(request, history_io.IMPORT_MAX_BYTES), fmt),
+                user=request.user,
+                max_records=history_io.IMPORT_MAX_RECORDS,
+            )
+    except history_io.ImportTooLarge as e:
+        return JsonResponse({'error': f'Import too large: {e}'}, status=413)
+    except (UnicodeDecodeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid import file: {e}'}, status=400)
+    except Exception as e:
+        logger.exception("An error occurred during history import")
+        return JsonResponse({'error': 'An unexpected error occurred while importing your history.'}, status=500)
+    return JsonResponse({'success': True, **totals})
+
 @login_required
 @require_http_methods(["DELETE"])
 def delete_query(request, query_id):
@@ -0,0 +1,92 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from .models import MoodQuery, WarmPlaylist
+
+load_dotenv()
+
+# Serve playlists precomputed by `manage.py warm_playlists` before searching live.
+ENABLED = os.getenv("WARM_PLAYLISTS_ENABLED", "False").lower() in ("true", "1", "yes")
+# Tracks stored per combination (the largest limit a warm set can answer).
+SIZE = int(os.getenv("WARM_PLAYLIST_SIZE", "48"))
+# Sets older than this are ignored and the request searches live.
+MAX_AGE = int(os.getenv("WARM_PLAYLIST_MAX_AGE", "43200"))
+
+
+class WarmPlaylistService:
+    @staticmethod
+    def enabled():
+        return ENABLED
+
+    @staticmethod
+    def signature(genres, moods, keywords):
+        """
+        The search passes only use the first genre, mood and keyword, so
+        those three fully determine the playlist. None without a genre and mood.
+        """
+        if not genres or not moods:
+            return None
+        keyword = keywords[0].lower() if keywords else ""
+        return f"{genres[0].lower()}|{moods[0].lower()}|{keyword}"
+
+    @staticmethod
+    def lookup(genres, moods, keywords, limit, extra=0):
+        """
+        Returns up to `limit` (+ `extra` if the set has them) ranked tracks
+        from a fresh warm set, or None on a miss.
+        """
+        signature = WarmPlaylistService.signature(genres, moods, keywords)
+        if signature is None:
+            return None
+        warm = (
+            WarmPlaylist.objects.filter(
+                signature=signature,
+                size__gte=limit,
+                refreshed_at__gte=timezone.now() - timedelta(seconds=MAX_AGE),
+            )
+            .values_list("tracks", flat=True)
+            .first()
+        )
+        if not warm:
+            return None
+        return warm[:limit + extra]
+
+    @staticmethod
+    def store(genre, mood, keyword, size, tracks):
+        genre, mood, keyword = genre.lower(), mood.lower(), (keyword or "").lower()
+        WarmPlaylist.objects.update_or_create(
+            signature=WarmPlaylistService.signature([genre], [mood], [keyword] if keyword else []),
+            defaults={
+                "genre": genre,
+                "mood": mood,
+                "keyword": keyword,
+                "size": size,
+                "tracks": tracks,
+                "refreshed_at": timezone.now(),
+            },
+        )
+
+    @staticmethod
+    def popular_keywords(count, sample=5000):
+        """Most frequent first keywords in recent analyses (the one the searches use)."""
+        counter = Counter()
+        for analysis in (
+            MoodQuery.objects.filter(generated_keywords__isnull=False)
+            .order_by("-id")
+            .values_list("generated_keywords", flat=True)[:sample]
+            .iterator()
+        ):
+            keywords = analysis.get("keywords") if isinstance(analysis, dict) else None
+            if keywords:
+                counter[str(keywords[0]).lower()] += 1
+        return [keyword for keyword, _ in counter.most_common(count)]
+
+    @staticmethod
+    def prune(older_than):
+        """Deletes sets not refreshed since `older_than`; returns how many."""
+        deleted, _ = WarmPlaylist.objects.filter(refreshed_at__lt=older_than).delete()
+        return deleted
@@ -0,0 +1,104 @@
+"""
+Warmup for cold starts.
+
+The heavy libraries (google.genai, pydantic, NumPy, requests, Pillow) are
+imported on first use so a cold start only pays for Django and this app.
+warmup() pays the rest ahead of the first request that needs it: it builds
+the pooled Jamendo session and Gemini client, imports NumPy and trains the
+local analyzer. WARMUP_ON_START runs it when the server handles its first
+request, either in a background thread (that request is not held up) or
+before that request is served. It is hooked up from wsgi.py/asgi.py rather
+than run there, so management commands, tests and anything else that only
+imports the application never start it. /api/warmup/ runs it on demand,
+e.g. from a scheduled ping that keeps serverless instances warm.
+`manage.py profile_startup` measures both.
+"""
+import os
+import threading
+import time
+
+from django.core.signals import request_started
+from django.db import connection
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "off", "background" (a thread, so startup is not delayed) or "blocking".
+ON_START = os.getenv("WARMUP_ON_START", "off").lower()
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def warmup():
+    """Runs every warmup step once more (each is cheap after the first); returns {step: milliseconds}."""
+    from . import ai_service, http_clients, mood_analyzer, mood_cache, query_index
+
+    def load_numpy():
+        import numpy  # noqa: F401
+
+    def gemini_client():
+        api_key = os.getenv("GEMINI_API_KEY")
+        if api_key:
+            http_clients.get_genai_client(api_key)
+            ai_service.generate_configs()
+
+    def local_analyzer():
+        analyzer = mood_analyzer.get_local_analyzer()
+        if analyzer is not None:
+            analyzer.get_classifier()
+
+    def index():
+        index = query_index.get_query_index()
+        if index is not None:
+            index.stats()
+
+    timings = {}
+    for name, step in (
+        ("numpy", load_numpy),
+        ("jamendo_session", http_clients.get_session),
+        ("gemini_client", gemini_client),
+        ("mood_cache", mood_cache.get_mood_cache),
+        ("local_analyzer", local_analyzer),
+        ("query_index", index),
+    ):
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warmup Error ({name}): {e}")
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+def _warmup_thread():
+    try:
+        warmup()
+    finally:
+        # Connections are per thread; this one is not reused.
+        connection.close()
+
+
+def start_warmup(mode=None):
+    """Runs warmup() as WARMUP_ON_START says."""
+    mode = (mode or ON_START).lower()
+    if mode == "blocking":
+        warmup()
+    elif mode == "background":
+        threading.Thread(target=_warmup_thread, name="warmup", daemon=True).start()
+
+
+def _on_first_request(sender, **kwargs):
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    request_started.disconnect(dispatch_uid="warmup_on_start")
+    start_warmup()
+
+
+def start_warmup_on_first_request():
+    """Called from wsgi.py/asgi.py: starts the warmup when the first request comes in."""
+    if ON_START in ("background", "blocking"):
+        request_started.connect(_on_first_request, dispatch_uid="warmup_on_start")
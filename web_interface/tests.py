@@ -1,3 +1,66 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from playlist_generator.history import PAGE_SIZE
+from playlist_generator.persistence import save_mood_query
+
+ANALYSIS = {"genres": ["jazz"], "moods": ["sad"], "keywords": ["rain"]}
+
+
+class AuthViewTests(TestCase):
+    def test_home_shows_landing_or_dashboard(self):
+        response = self.client.get(reverse("web_interface:home"))
+        self.assertTemplateUsed(response, "web_interface/landing.html")
+
+        self.client.force_login(User.objects.create_user("listener"))
+        response = self.client.get(reverse("web_interface:home"))
+        self.assertTemplateUsed(response, "web_interface/dashboard.html")
+
+    def test_register_logs_the_new_user_in(self):
+        response = self.client.post(reverse("web_interface:register"), {
+            "username": "listener", "password1": "a-long-passphrase", "password2": "a-long-passphrase",
+        })
+        self.assertRedirects(response, reverse("web_interface:home"))
+        self.assertEqual(int(self.client.session["_auth_user_id"]), User.objects.get(username="listener").id)
+
+    def test_login_and_logout(self):
+        User.objects.create_user("listener", password="a-long-passphrase")
+        response = self.client.post(reverse("web_interface:login"), {
+            "username": "listener", "password": "wrong",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+        response = self.client.post(reverse("web_interface:login"), {
+            "username": "listener", "password": "a-long-passphrase",
+        })
+        self.assertRedirects(response, reverse("web_interface:home"))
+        response = self.client.post(reverse("web_interface:logout"))
+        self.assertRedirects(response, reverse("web_interface:login"))
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+
+class HistoryViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("listener")
+        tracks = [
+            {"id": str(i), "title": f"Track {i}", "artist": "Artist", "preview_url": f"https://example.com/{i}",
+             "album_image": ""}
+            for i in range(3)
+        ]
+        for i in range(PAGE_SIZE + 5):
+            save_mood_query(self.user, f"sad jazz {i}", ANALYSIS, tracks)
+
+    def test_requires_login(self):
+        response = self.client.get(reverse("web_interface:history"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_renders_first_page_with_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("web_interface:history"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["queries"]), PAGE_SIZE)
+        self.assertIsNotNone(response.context["next_cursor"])
+        self.assertContains(response, 'data-next-cursor="{}"'.format(response.context["next_cursor"]))
+        self.assertContains(response, f"sad jazz {PAGE_SIZE + 4}")
@@ -2,7 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
-from playlist_generator.models import MoodQuery
+from playlist_generator.history import get_history_page
 
 def home_view(request):
     if request.user.is_authenticated:
@@ -41,5 +41,5 @@ def logout_view(request):
 
 @login_required
 def history_view(request):
-    queries = MoodQuery.objects.filter(user=request.user).prefetch_related('tracks').order_by('-created_at')
-    return render(request, 'web_interface/history.html', {'queries': queries})
+    queries, next_cursor = get_history_page(request.user)
+    return render(request, 'web_interface/history.html', {'queries': queries, 'next_cursor': next_cursor})